@@ -55,7 +55,7 @@ from ..outputs.pure_api import LUXRENDER_VERSION
 from ..outputs.luxcore_api import ToValidLuxCoreName
 from ..outputs.luxcore_api import PYLUXCORE_AVAILABLE, UseLuxCore, pyluxcore
 from ..export.luxcore import LuxCoreExporter
-from ..export.luxcore.utils import get_elem_key
+from ..export.luxcore.utils import get_elem_key, DependencyIndex
 
 # Exporter Property Groups need to be imported to ensure initialisation
 from ..properties import (
@@ -1561,17 +1561,48 @@ class RENDERENGINE_luxrender(bpy.types.RenderEngine):
 
             filmWidth, filmHeight = self.get_film_size(scene)
 
-            luxcore_exporter = LuxCoreExporter(scene, self)
-            luxcore_config = luxcore_exporter.convert(filmWidth, filmHeight)
+            # Keep the scene and the rendersession between the frames of an animation
+            persistent = (self.is_animation and scene.luxcore_translatorsettings.persistent_animation and
+                          scene.luxcore_translatorsettings.export_type != 'luxcoreui')
+            animation_session = LuxCoreAnimationSession.get(scene, filmWidth, filmHeight) if persistent else None
+
+            if animation_session is not None:
+                luxcore_exporter = animation_session.luxcore_exporter
+                luxcore_config = animation_session.luxcore_config
+                luxcore_session = animation_session.luxcore_session
+                luxcore_exporter.renderengine = self
+
+                # Only convert what changed since the last frame
+                luxcore_scene = luxcore_config.GetScene()
+                luxcore_session.BeginSceneEdit()
+                updated_properties = luxcore_exporter.convert_frame_update(luxcore_scene)
+
+                if updated_properties is None:
+                    luxcore_session.EndSceneEdit()
+                    LuxCoreAnimationSession.stop()
+                    return
 
-            # Maybe export was cancelled by user, don't start the rendering with an incomplete scene then
-            if self.test_break() or luxcore_config is None:
-                return
+                luxcore_scene.Parse(updated_properties)
+                luxcore_session.EndSceneEdit()
 
-            luxcore_session = pyluxcore.RenderSession(luxcore_config)
-            # Start the rendering
-            LuxLog('Starting the rendering process...')
-            luxcore_session.Start()
+                LuxLog('Resuming the rendering process...')
+                if luxcore_session.IsInPause():
+                    luxcore_session.Resume()
+            else:
+                LuxCoreAnimationSession.stop()
+
+                luxcore_exporter = LuxCoreExporter(scene, self)
+                luxcore_exporter.persistent = persistent
+                luxcore_config = luxcore_exporter.convert(filmWidth, filmHeight)
+
+                # Maybe export was cancelled by user, don't start the rendering with an incomplete scene then
+                if self.test_break() or luxcore_config is None:
+                    return
+
+                luxcore_session = pyluxcore.RenderSession(luxcore_config)
+                # Start the rendering
+                LuxLog('Starting the rendering process...')
+                luxcore_session.Start()
 
             # Print a summary of errors that happened during export, if there are any
             luxcore_exporter.error_cache.print_errors()
@@ -1682,8 +1713,16 @@ class RENDERENGINE_luxrender(bpy.types.RenderEngine):
                     self.end_result(result)
                     last_image_display = now
 
-            LuxLog('Ending the rendering process...')
-            luxcore_session.Stop()
+            if persistent and not self.test_break() and scene.frame_current + scene.frame_step <= scene.frame_end:
+                # Keep the session for the next frame
+                LuxLog('Pausing the rendering process...')
+                luxcore_session.Pause()
+                LuxCoreAnimationSession.keep(scene, filmWidth, filmHeight, luxcore_exporter, luxcore_config,
+                                             luxcore_session)
+            else:
+                LuxLog('Ending the rendering process...')
+                LuxCoreAnimationSession.forget(luxcore_session)
+                luxcore_session.Stop()
 
             # Get the final result
             stats = luxcore_session.GetStats()
@@ -1702,6 +1741,7 @@ class RENDERENGINE_luxrender(bpy.types.RenderEngine):
             self.end_result(result)
             LuxLog('Done.\n')
         except Exception as exc:
+            LuxCoreAnimationSession.stop()
             LuxLog('Rendering aborted: %s' % exc)
             self.report({'ERROR'}, str(exc))
             import traceback
@@ -2011,15 +2051,19 @@ class RENDERENGINE_luxrender(bpy.types.RenderEngine):
     viewFilmHeight = -1
     viewImageBufferFloat = None
     last_update_time = 0
-    # store renderengine configuration of last update
-    lastRenderSettings = ''
-    lastVolumeSettings = ''
-    lastSessionSettings = ''
+    # store fingerprints of the renderengine configuration of last update (see the fingerprint methods of
+    # LuxCoreExporter), None if not known yet
+    lastRenderSettings = None
+    lastVolumeSettings = None
+    lastSessionSettings = None
     lastHaltTime = -1
     lastHaltSamples = -1
-    lastCameraSettings = ''
+    lastCameraSettings = None
     lastVisibilitySettings = None
-    lastNodeMatSettings = ''
+    # Structure: {material key: fingerprint}
+    lastNodeMatSettings = None
+    # Which materials use a texture/node tree/volume and which objects use a material
+    dependency_index = None
     update_counter = 0
 
     def create_view_buffer(self, width, height):
@@ -2079,13 +2123,12 @@ class RENDERENGINE_luxrender(bpy.types.RenderEngine):
             update_changes.set_cause(config = True)
             self.luxcore_view_update(context, update_changes)
 
-        # check if camera settings have changed
-        self.luxcore_exporter.convert_camera()
-        newCameraSettings = str(self.luxcore_exporter.pop_updated_scene_properties())
+        # check if camera settings have changed, the camera is only converted in the update
+        newCameraSettings = self.luxcore_exporter.camera_fingerprint()
 
-        if self.lastCameraSettings == '':
+        if self.lastCameraSettings is None:
             self.lastCameraSettings = newCameraSettings
-        elif self.lastCameraSettings != newCameraSettings and newCameraSettings.strip() != '':
+        elif self.lastCameraSettings != newCameraSettings and newCameraSettings is not None:
             update_changes = UpdateChanges()
             update_changes.set_cause(camera = True)
             self.lastCameraSettings = newCameraSettings
@@ -2161,6 +2204,9 @@ class RENDERENGINE_luxrender(bpy.types.RenderEngine):
                 # LuxCoreExporter instance for viewport rendering is only created here
                 self.luxcore_exporter = LuxCoreExporter(context.scene, self, True, context)
 
+                self.dependency_index = DependencyIndex(context.scene)
+                self.dependency_index.build()
+
             # check if filmsize has changed
             if (self.viewFilmWidth == -1) or (self.viewFilmHeight == -1) or (
                     self.viewFilmWidth != context.region.width) or (
@@ -2198,65 +2244,85 @@ class RENDERENGINE_luxrender(bpy.types.RenderEngine):
                         elif ob.type in ['CAMERA'] and ob.name == context.scene.camera.name:
                             update_changes.set_cause(camera = True)
 
+            # A new material or visibility might have been assigned to the objects (material slots linked to
+            # the object instead of the mesh only tag the object itself as updated)
+            for ob in update_changes.changed_objects_mesh | update_changes.changed_objects_transform:
+                self.dependency_index.update_object(ob)
+
+            for ob in update_changes.removed_objects:
+                self.dependency_index.remove_object(ob.name)
+
+            # Materials that were updated themselves or through their nodetree
+            updated_materials = set()
+
             if bpy.data.materials.is_updated:
-                for mat in bpy.data.materials:
-                    nodetree_name = mat.luxrender_material.nodetree
+                updated_materials.update(mat for mat in bpy.data.materials if mat.is_updated)
 
-                    mat_updated = False
+            if bpy.data.node_groups.is_updated:
+                for nodetree in bpy.data.node_groups:
+                    if nodetree.is_updated or nodetree.is_updated_data:
+                        updated_materials.update(self.dependency_index.get_nodetree_users(nodetree))
 
-                    if nodetree_name and nodetree_name in bpy.data.node_groups:
-                        # Check for nodetree updates
-                        nodetree = bpy.data.node_groups[nodetree_name]
+            for mat in updated_materials:
+                nodetree_name = mat.luxrender_material.nodetree
 
-                        if nodetree.is_updated or nodetree.is_updated_data:
-                            self.luxcore_exporter.convert_material(mat)
-                            newNodeMatSettings = str(self.luxcore_exporter.pop_updated_scene_properties())
+                if nodetree_name and nodetree_name in bpy.data.node_groups:
+                    # Moving nodes in the node editor also tags the nodetree, but does not change it
+                    mat_key = get_elem_key(mat)
+                    newNodeMatSettings = self.luxcore_exporter.material_fingerprint(mat)
 
-                            if self.lastNodeMatSettings == '':
-                                self.lastNodeMatSettings = newNodeMatSettings
-                                mat_updated = True
-                            elif self.lastNodeMatSettings != newNodeMatSettings:
-                                self.lastNodeMatSettings = newNodeMatSettings
-                                mat_updated = True
-                    else:
-                        mat_updated = mat.is_updated
+                    if self.lastNodeMatSettings is None:
+                        self.lastNodeMatSettings = {}
+
+                    mat_updated = self.lastNodeMatSettings.get(mat_key) != newNodeMatSettings
+                    self.lastNodeMatSettings[mat_key] = newNodeMatSettings
+                else:
+                    mat_updated = True
 
-                    if mat_updated:
-                        # only update this material
-                        update_changes.changed_materials.add(mat)
-                        update_changes.set_cause(materials = True)
+                if mat_updated:
+                    # only update this material
+                    update_changes.changed_materials.add(mat)
+                    update_changes.set_cause(materials = True)
 
             if bpy.data.textures.is_updated:
                 for tex in bpy.data.textures:
                     if tex.is_updated:
-                        for mat in tex.users_material:
+                        for mat in self.dependency_index.get_texture_users(tex):
                             update_changes.changed_materials.add(mat)
                             update_changes.set_cause(materials = True)
 
             # check for changes in volume configuration
-            for volume in context.scene.luxrender_volumes.volumes:
-                self.luxcore_exporter.convert_volume(volume)
-
-            # Exclude all densitygrid data properties from the update check
-            # All lines of the form "scene.textures.<densitygrid_tex_name>.data = [...]" will be removed
-            # This allows us to avoid re-exports of the smoke for every volume update check
-            newVolumeProperties = self.luxcore_exporter.pop_updated_scene_properties()
-            lines = str(newVolumeProperties).split('\n')
-            densitygrid_textures = [line for line in lines if 'type = "densitygrid"' in line]
-            names = [elem.split('.')[2] for elem in densitygrid_textures]
-            to_delete = ['scene.textures.' + name + '.data' for name in names]
-            newVolumeProperties.DeleteAll(to_delete)
-
-            newVolumeSettings = str(newVolumeProperties)
-
-            if self.lastVolumeSettings == '':
+            # The densitygrid data of smoke domains is not part of the fingerprint, so the smoke is not
+            # re-exported for every volume update check
+            newVolumeSettings = self.luxcore_exporter.volumes_fingerprint()
+
+            if self.lastVolumeSettings is None:
                 self.lastVolumeSettings = newVolumeSettings
             elif self.lastVolumeSettings != newVolumeSettings:
                 update_changes.set_cause(volumes = True)
+
+                # Materials reference volumes by name and fall back to the default volumes if they are missing,
+                # so they only have to be converted again when volumes were added, removed or renamed
+                old_names = {name for name, fingerprint in self.lastVolumeSettings}
+                new_names = {name for name, fingerprint in newVolumeSettings}
+
+                for mat in self.dependency_index.get_volume_users(old_names ^ new_names):
+                    update_changes.changed_materials.add(mat)
+                    update_changes.set_cause(materials = True)
+
                 self.lastVolumeSettings = newVolumeSettings
                 # reset the smoke cache because we need to redefine volume properties
                 SmokeCache.reset()
 
+            # Index the new references of the changed materials. If the pointiness shape of the objects using a
+            # material changed, the objects have to be converted again.
+            for mat in update_changes.changed_materials:
+                if self.dependency_index.update_material(mat):
+                    for ob in self.dependency_index.get_material_users(mat):
+                        if ob in self.lastVisibilitySettings:
+                            update_changes.set_cause(objectTransform = True)
+                            update_changes.changed_objects_transform.add(ob)
+
             # Check for changes in halt conditions
             newHaltTime = context.scene.luxcore_enginesettings.halt_time_preview
             newHaltSamples = context.scene.luxcore_enginesettings.halt_samples_preview
@@ -2269,21 +2335,18 @@ class RENDERENGINE_luxrender(bpy.types.RenderEngine):
             self.lastHaltSamples = newHaltSamples
 
             # Check for config changes that need a restart of the rendering
-            self.luxcore_exporter.convert_config(self.viewFilmWidth, self.viewFilmHeight)
-            newRenderSettings = str(self.luxcore_exporter.config_exporter.properties)
+            newRenderSettings = self.luxcore_exporter.config_fingerprint(self.viewFilmWidth, self.viewFilmHeight)
 
-            if self.lastRenderSettings == '':
+            if self.lastRenderSettings is None:
                 self.lastRenderSettings = newRenderSettings
             elif self.lastRenderSettings != newRenderSettings:
                 update_changes.set_cause(config = True)
                 self.lastRenderSettings = newRenderSettings
 
             # Check for config changes that do not require the rendering to be restarted (tonemapping, lightgroups)
-            session_props = self.luxcore_exporter.convert_imagepipeline()
-            session_props.Set(self.luxcore_exporter.convert_lightgroup_scales())
-            newSessionSettings = str(session_props)
+            newSessionSettings = self.luxcore_exporter.session_fingerprint()
 
-            if self.lastSessionSettings == '':
+            if self.lastSessionSettings is None:
                 self.lastSessionSettings = newSessionSettings
             elif self.lastSessionSettings != newSessionSettings:
                 update_changes.set_cause(session = True)
@@ -2351,12 +2414,12 @@ class RENDERENGINE_luxrender(bpy.types.RenderEngine):
                 else:
                     self.transparent_film = False
 
-                self.lastRenderSettings = ''
-                self.lastVolumeSettings = ''
-                self.lastSessionSettings = ''
+                self.lastRenderSettings = None
+                self.lastVolumeSettings = None
+                self.lastSessionSettings = None
                 self.lastHaltTime = -1
                 self.lastHaltSamples = -1
-                self.lastCameraSettings = ''
+                self.lastCameraSettings = None
                 self.lastVisibilitySettings = None
                 self.update_counter = 0
 
@@ -2406,6 +2469,8 @@ class RENDERENGINE_luxrender(bpy.types.RenderEngine):
                 LuxCoreSessionManager.stop_luxcore_session(self.space)
 
                 self.luxcore_exporter.convert_config(self.viewFilmWidth, self.viewFilmHeight)
+                self.lastRenderSettings = self.luxcore_exporter.config_fingerprint(self.viewFilmWidth,
+                                                                                   self.viewFilmHeight)
 
                 # change config
                 luxcore_config.Parse(self.luxcore_exporter.config_properties)
@@ -2425,6 +2490,11 @@ class RENDERENGINE_luxrender(bpy.types.RenderEngine):
                     LuxLog('Camera update')
                     self.luxcore_exporter.convert_camera()
 
+                # Volumes first, the materials only use volumes that were exported
+                if update_changes.cause_volumes:
+                    for volume in context.scene.luxrender_volumes.volumes:
+                        self.luxcore_exporter.convert_volume(volume)
+
                 if update_changes.cause_materials:
                     LuxLog('Materials update')
                     for material in update_changes.changed_materials:
@@ -2463,10 +2533,6 @@ class RENDERENGINE_luxrender(bpy.types.RenderEngine):
                                     luxcore_name = exported_object.luxcore_object_name
                                     luxcore_scene.DeleteObject(luxcore_name)
 
-                if update_changes.cause_volumes:
-                    for volume in context.scene.luxrender_volumes.volumes:
-                        self.luxcore_exporter.convert_volume(volume)
-
                 updated_properties = self.luxcore_exporter.pop_updated_scene_properties()
 
                 if context.space_data.local_view:
@@ -2631,6 +2697,61 @@ class LuxCoreSessionManager(object):
                 session.luxcore_session.Resume()
 
 
+class LuxCoreAnimationSession(object):
+    """
+    Exporter and rendersession of a final animation render, kept alive between frames (see the
+    persistent_animation translator setting). Blender creates a new render engine for every frame, so the
+    session is stored on the class.
+    """
+
+    active = None
+
+    @classmethod
+    def get(cls, scene, film_width, film_height):
+        """
+        Returns the kept session if it belongs to the scene, film size and frame that are rendered now, otherwise None
+        """
+        session = cls.active
+
+        if (session is not None and session.scene_pointer == scene.as_pointer() and
+                session.film_size == (film_width, film_height) and session.next_frame == scene.frame_current):
+            return session
+
+        return None
+
+    @classmethod
+    def keep(cls, scene, film_width, film_height, luxcore_exporter, luxcore_config, luxcore_session):
+        cls.active = cls(scene, film_width, film_height, luxcore_exporter, luxcore_config, luxcore_session)
+
+    @classmethod
+    def forget(cls, luxcore_session):
+        """
+        Drop the kept session without stopping it, if it is luxcore_session (which the caller stops)
+        """
+        if cls.active is not None and cls.active.luxcore_session is luxcore_session:
+            cls.active = None
+
+    @classmethod
+    def stop(cls):
+        session = cls.active
+        cls.active = None
+
+        if session is not None:
+            print('Stopping animation rendersession')
+            if session.luxcore_session.IsInSceneEdit():
+                session.luxcore_session.EndSceneEdit()
+
+            session.luxcore_session.Stop()
+
+    def __init__(self, scene, film_width, film_height, luxcore_exporter, luxcore_config, luxcore_session):
+        self.scene_pointer = scene.as_pointer()
+        self.film_size = (film_width, film_height)
+        self.next_frame = scene.frame_current + scene.frame_step
+        self.luxcore_exporter = luxcore_exporter
+        self.luxcore_config = luxcore_config
+        self.luxcore_session = luxcore_session
+
+
 @persistent
 def stop_viewport_render(context):
     LuxCoreSessionManager.stop_orphaned_sessions()
@@ -2644,6 +2765,16 @@ def stop_viewport_render(context):
 bpy.app.handlers.scene_update_post.append(stop_viewport_render)
 
 
+@persistent
+def stop_animation_session(context):
+    # The kept rendersession is not needed anymore once the render job ended or another file is loaded
+    LuxCoreAnimationSession.stop()
+
+bpy.app.handlers.render_cancel.append(stop_animation_session)
+bpy.app.handlers.render_complete.append(stop_animation_session)
+bpy.app.handlers.load_pre.append(stop_animation_session)
+
+
 class UpdateChanges(object):
     def __init__(self):
         self.changed_objects_transform = set()
@@ -24,14 +24,22 @@
 #
 # ***** END GPL LICENCE BLOCK *****
 #
-import collections, math, os, sys
+import array, collections, math, os, sys
 
 import bpy, mathutils
+from bpy.app.handlers import persistent
 
 from ..extensions_framework import util as efutil
 
 from ..outputs import LuxManager, LuxLog
-from ..util import bencode_file2string_with_size
+from ..util import bencode_file2lines_with_size, EncodedFileCache
+from .meshdata import NUMPY_AVAILABLE, NUMPY_IMPORT_ERROR
+
+if NUMPY_AVAILABLE:
+    import numpy
+else:
+    LuxLog('WARNING: numpy not available, falling back to slow mesh export')
+    LuxLog('(ImportError was: %s)' % NUMPY_IMPORT_ERROR)
 
 
 class ExportProgressThread(efutil.TimerThread):
@@ -83,26 +91,70 @@ class ExportCache(object):
             raise Exception('Item %s not found in %s!' % (ck, self.name))
 
 
+def compact_numeric_list(param_type, values):
+    """
+    param_type		string
+    values			list of numbers
+
+    Returns array.array holding values, or values itself if they do not
+    fit into a typed array without loss
+    """
+
+    try:
+        if param_type == 'integer':
+            return array.array('l', values)
+
+        return array.array('d', values)
+    except (TypeError, OverflowError):
+        return values
+
+
 class ParamSetItem(list):
+    """
+    One parameter of a ParamSet. Items stay [type_name, value] lists,
+    since that is what pylux takes, but keep their other attributes in
+    slots instead of a per-item dict.
+    """
+
+    __slots__ = ('type', 'name', 'value', 'size')
+
     WRAP_WIDTH = 100
 
+    # Number of array values formatted at once by write()
+    CHUNK_SIZE = 8192
+
+    # Float arrays with more values than this are written with the reduced
+    # precision passed to write(), if any
+    LARGE_ARRAY_SIZE = 1024
+
     def __init__(self, *args):
         self.type, self.name, self.value = args
-        self.type_name = "%s %s" % (self.type, self.name)
-        self.append(self.type_name)
+        self.size = None
+        self.append("%s %s" % (self.type, self.name))
         self.append(self.value)
 
-    def getSize(self, vl=None):
-        sz = 0
+    @property
+    def type_name(self):
+        return self[0]
 
+    def getSize(self, vl=None):
         if vl is None:
-            vl = self.value
-            sz += 100  # Rough overhead for encoded paramset item
+            # Values never change once added, so the estimate is only made once
+            if self.size is None:
+                self.size = 100 + self.getSize(vl=self.value)  # Rough overhead for encoded paramset item
+
+            return self.size
+
+        sz = 0
 
         if type(vl) in (list, tuple):
             for v in vl:
                 sz += self.getSize(vl=v)
 
+        # Bulk mesh data, estimate instead of walking every item
+        if type(vl) is array.array:
+            sz += len(vl) * (14 if vl.typecode in 'fd' else 8)
+
         if type(vl) is str:
             sz += len(vl)
         if type(vl) is float:
@@ -135,16 +187,60 @@ class ParamSetItem(list):
                 s = ' '.join(['%i' % i for i in lst])
         return s
 
+    def write(self, stream, precision=0):
+        """
+        stream		file object
+        precision	int, significant digits for large float arrays, 0 for exact values
+
+        Write the parameter to stream in the format of to_string(). Numbers
+        are written with the shortest exact representation, arrays are
+        formatted and written in chunks so they are never held as one string.
+
+        Returns None
+        """
+
+        if self.type not in ('float', 'integer', 'vector', 'point', 'normal'):
+            stream.write(self.to_string())
+            return
+
+        values = self.value
+        if type(values) in (int, float, bool):
+            values = [values]
+        elif type(values) not in (list, tuple, array.array):
+            # mathutils.Vector, Color, ...
+            values = list(values)
+
+        if self.type == 'integer':
+            format_chunk = lambda chunk: ' '.join(map('%i'.__mod__, chunk))
+        elif precision > 0 and len(values) > self.LARGE_ARRAY_SIZE:
+            format_chunk = lambda chunk: ' '.join(map(('%%.%dg' % precision).__mod__, chunk))
+        elif type(values) is array.array and values.typecode == 'f':
+            # 9 significant digits are exact for single precision values
+            format_chunk = lambda chunk: ' '.join(map('%.9g'.__mod__, chunk))
+        else:
+            # Shortest representation that parses back to the same value
+            format_chunk = lambda chunk: ' '.join(map(repr, map(float, chunk)))
+
+        stream.write('"%s %s" [' % (self.type, self.name))
+
+        for start in range(0, len(values), self.CHUNK_SIZE):
+            if start > 0:
+                stream.write(' ')
+
+            stream.write(format_chunk(values[start:start + self.CHUNK_SIZE]))
+
+        stream.write(']')
+
     def to_string(self):
         fs_num = '"%s %s" [%s]'
         fs_str = '"%s %s" ["%s"]'
 
-        if self.type == "float" and type(self.value) in (list, tuple):
+        if self.type == "float" and type(self.value) in (list, tuple, array.array):
             lst = self.list_wrap(self.value, self.WRAP_WIDTH, 'f')
             return fs_num % ('float', self.name, lst)
         if self.type == "float":
             return fs_num % ('float', self.name, '%0.15f' % self.value)
-        if self.type == "integer" and type(self.value) in (list, tuple):
+        if self.type == "integer" and type(self.value) in (list, tuple, array.array):
             lst = self.list_wrap(self.value, self.WRAP_WIDTH, 'i')
             return fs_num % ('integer', self.name, lst)
         if self.type == "integer":
@@ -177,18 +273,34 @@ class ParamSetItem(list):
 
 
 class ParamSet(list):
+    """
+    List of ParamSetItems with at most one item per parameter name. Large
+    numeric lists are stored as array.array, see add().
+    """
+
+    __slots__ = ('items_by_name', 'item_positions', 'item_sizes')
+
+    # Numeric lists with at least this many values are stored as array.array
+    ARRAY_MIN_SIZE = 1024
+
+    NUMERIC_TYPES = {'float', 'integer', 'point', 'normal', 'vector'}
+
     def __init__(self):
-        self.names = []
+        self.items_by_name = {}
+        self.item_positions = {}  # name -> index in the list
         self.item_sizes = {}
 
+    @property
+    def names(self):
+        return list(self.items_by_name.keys())
+
     def increase_size(self, param_name, sz):
         self.item_sizes[param_name] = sz
 
     def getSize(self):
         sz = 0
-        item_sizes_keys = self.item_sizes.keys()
         for p in self:
-            if p.name in item_sizes_keys:
+            if p.name in self.item_sizes:
                 sz += self.item_sizes[p.name]
             else:
                 sz += p.getSize()
@@ -200,15 +312,20 @@ class ParamSet(list):
         return self
 
     def add(self, type, name, value):
-        if name in self.names:
-            for p in self:
-                if p.name == name:
-                    self.remove(p)
-
-        self.append(
-            ParamSetItem(type, name, value)
-        )
-        self.names.append(name)
+        if type in self.NUMERIC_TYPES and isinstance(value, list) and len(value) >= self.ARRAY_MIN_SIZE:
+            value = compact_numeric_list(type, value)
+
+        item = ParamSetItem(type, name, value)
+        position = self.item_positions.get(name)
+
+        if position is None:
+            self.item_positions[name] = len(self)
+            self.append(item)
+        else:
+            # A replaced parameter keeps its place
+            self[position] = item
+
+        self.items_by_name[name] = item
         return self
 
     def add_float(self, name, value):
@@ -235,11 +352,17 @@ class ParamSet(list):
         return self
 
     def add_point(self, name, value):
-        self.add('point', name, [p for p in value])
+        if type(value) is array.array:
+            self.add('point', name, value)
+        else:
+            self.add('point', name, [p for p in value])
         return self
 
     def add_normal(self, name, value):
-        self.add('normal', name, [n for n in value])
+        if type(value) is array.array:
+            self.add('normal', name, value)
+        else:
+            self.add('normal', name, [n for n in value])
         return self
 
     def add_color(self, name, value):
@@ -251,13 +374,153 @@ class ParamSet(list):
         return self
 
 
+def layers_to_bitmask(layers):
+    """
+    layers		sequence of bool, one per layer
+
+    Returns int with bit i set if layer i is enabled
+    """
+
+    mask = 0
+    for i, enabled in enumerate(layers):
+        if enabled:
+            mask |= 1 << i
+
+    return mask
+
+
+class VisibilityIndex(object):
+    """
+    Layer visibility of objects and groups for one export. The scene and
+    render layer masks are computed once, and the result for every object
+    and group is cached as soon as it has been checked, so each further
+    check is a dict lookup.
+
+    The index is only valid while the layers cannot change, so exporters
+    start it with begin() and drop it with end(); outside of that,
+    is_obj_visible and is_obj_group_visible check the layers directly.
+    """
+
+    active = None
+
+    @staticmethod
+    def begin(scene):
+        VisibilityIndex.active = VisibilityIndex(scene)
+        return VisibilityIndex.active
+
+    @staticmethod
+    def end():
+        VisibilityIndex.active = None
+
+    @staticmethod
+    def get(scene=None):
+        """
+        Returns the active index if it was built for scene, otherwise None
+        """
+
+        index = VisibilityIndex.active
+
+        if index is not None and (scene is None or index.scene_pointer == scene.as_pointer()):
+            return index
+
+        return None
+
+    def __init__(self, scene):
+        self.scene_pointer = scene.as_pointer()
+        self.layer_mask = layers_to_bitmask(scene.layers) & layers_to_bitmask(scene.render.layers.active.layers)
+        self.object_layers = {}
+        self.object_groups = {}
+        self.group_masks = {}
+
+    def on_visible_layer(self, obj):
+        try:
+            return self.object_layers[obj]
+        except KeyError:
+            visible = (layers_to_bitmask(obj.layers) & self.layer_mask) != 0
+            self.object_layers[obj] = visible
+            return visible
+
+    def in_visible_group(self, obj):
+        try:
+            return self.object_groups[obj]
+        except KeyError:
+            pass
+
+        visible = len(obj.users_group) == 0
+
+        if not visible:
+            object_mask = layers_to_bitmask(obj.layers)
+
+            for grp in obj.users_group:
+                if grp not in self.group_masks:
+                    self.group_masks[grp] = layers_to_bitmask(grp.layers)
+
+                if object_mask & self.group_masks[grp]:
+                    visible = True
+                    break
+
+        self.object_groups[obj] = visible
+        return visible
+
+
 def is_obj_visible(scene, obj, is_dupli=False, is_viewport_render=False):
     hidden = obj.hide if is_viewport_render else obj.hide_render
 
+    if hidden:
+        return False
+
+    # Duplis are visible regardless of their own layers
+    if is_dupli:
+        return True
+
+    index = VisibilityIndex.get(scene)
+
+    if index is not None:
+        return index.on_visible_layer(obj)
+
     ov = False
     for lv in [ol and sl and rl for ol, sl, rl in zip(obj.layers, scene.layers, scene.render.layers.active.layers)]:
         ov |= lv
-    return (ov or is_dupli) and not hidden
+    return ov
+
+
+def is_obj_group_visible(obj):
+    """
+    Check for group layer visibility, if the object is in a group
+    """
+
+    index = VisibilityIndex.get()
+
+    if index is not None:
+        return index.in_visible_group(obj)
+
+    gviz = len(obj.users_group) == 0
+
+    for grp in obj.users_group:
+        gviz |= True in [a & b for a, b in zip(obj.layers, grp.layers)]
+
+    return gviz
+
+
+class WorldScale(object):
+    """
+    World scale for one export. The scale depends on the scene units and
+    the preview object size only, so exporters compute it once with begin()
+    and drop it with end(); outside of that, get_worldscale reads the scene
+    settings on every call.
+    """
+
+    value = None
+
+    @staticmethod
+    def begin():
+        WorldScale.value = None
+        WorldScale.value = get_worldscale(as_scalematrix=False)
+        return WorldScale.value
+
+    @staticmethod
+    def end():
+        WorldScale.value = None
 
 
 def get_worldscale(as_scalematrix=True):
@@ -265,6 +528,10 @@ def get_worldscale(as_scalematrix=True):
     For usability, previev_scale is not an own property but calculated from the object dimensions
     A user can directly judge mappings on an adjustable object_size, we simply scale the whole preview
     """
+    if WorldScale.value is not None:
+        ws = WorldScale.value
+        return mathutils.Matrix.Scale(ws, 4) if as_scalematrix else ws
+
     preview_scale = bpy.context.scene.luxrender_world.preview_object_size / 2
 
     # This is a safety net to prevent previewscale affecting render
@@ -283,6 +550,94 @@ def get_worldscale(as_scalematrix=True):
         return ws
 
 
+class MotionSampleCache(object):
+    """
+    World matrices of all objects of a scene at the motion blur subframes
+    of the current frame. The subframes are stepped through once for all
+    objects, instead of once per object, and object_anim_matrices serves
+    the sampled objects from this table.
+
+    Objects which do not move keep a single reference matrix while
+    sampling and end up with an empty list, like object_anim_matrices
+    returns for them.
+    """
+
+    active = None
+
+    @staticmethod
+    def begin(scene):
+        """
+        Sample all objects of scene if the scene camera uses object or
+        camera motion blur
+
+        Returns the new cache or None
+        """
+
+        MotionSampleCache.active = None
+
+        if scene.camera is None:
+            return None
+
+        lux_camera = scene.camera.data.luxrender_camera
+
+        if lux_camera.usemblur and (lux_camera.objectmblur or lux_camera.cammblur):
+            MotionSampleCache.active = MotionSampleCache(scene, scene.objects, lux_camera.motion_blur_samples)
+
+        return MotionSampleCache.active
+
+    @staticmethod
+    def end():
+        MotionSampleCache.active = None
+
+    @staticmethod
+    def get(scene, steps):
+        """
+        Returns the active cache if it was sampled from scene with steps, otherwise None
+        """
+
+        cache = MotionSampleCache.active
+
+        if cache is not None and cache.steps == steps and cache.scene_pointer == scene.as_pointer():
+            return cache
+
+        return None
+
+    def __init__(self, scene, objects, steps):
+        self.scene_pointer = scene.as_pointer()
+        self.steps = steps
+
+        objects = list(objects)
+        references = [None] * len(objects)
+        samples = [None] * len(objects)  # stays None as long as the object did not move
+
+        old_sf = scene.frame_subframe
+        cur_frame = scene.frame_current
+
+        for i in range(0, steps + 1):
+            scene.frame_set(cur_frame, subframe=i / float(steps))
+
+            for index, obj in enumerate(objects):
+                if i == 0:
+                    references[index] = obj.matrix_world.copy()
+                elif samples[index] is not None:
+                    samples[index].append(obj.matrix_world.copy())
+                elif obj.matrix_world != references[index]:
+                    # All earlier samples are equal to the reference
+                    samples[index] = [references[index]] + [references[index].copy() for _ in range(1, i)]
+                    samples[index].append(obj.matrix_world.copy())
+
+        # restore subframe value
+        scene.frame_set(cur_frame, old_sf)
+
+        self.matrices = {obj: obj_samples or [] for obj, obj_samples in zip(objects, samples)}
+
+    def __contains__(self, obj):
+        return obj in self.matrices
+
+    def __getitem__(self, obj):
+        return list(self.matrices[obj])
+
+
 def object_anim_matrices(scene, obj, steps=1):
     """
     steps		Number of interpolation steps per frame
@@ -291,6 +646,11 @@ def object_anim_matrices(scene, obj, steps=1):
     per-frame interpolation steps.
     The number of matrices returned is at most steps+1.
     """
+    cache = MotionSampleCache.get(scene, steps)
+
+    if cache is not None and obj in cache:
+        return cache[obj]
+
     old_sf = scene.frame_subframe
     cur_frame = scene.frame_current
 
@@ -343,11 +703,8 @@ def matrix_to_list(matrix, apply_worldscale=False, invert=False):
     """
 
     if apply_worldscale:
-        matrix = matrix.copy()
-        sm = get_worldscale()
-        matrix *= sm
         ws = get_worldscale(as_scalematrix=False)
-        matrix = fix_matrix_order(matrix)  # matrix indexing hack
+        matrix = fix_matrix_order(matrix * mathutils.Matrix.Scale(ws, 4))  # matrix indexing hack
         matrix[0][3] *= ws
         matrix[1][3] *= ws
         matrix[2][3] *= ws
@@ -365,6 +722,69 @@ def matrix_to_list(matrix, apply_worldscale=False, invert=False):
     return [float(i) for i in l]
 
 
+class TransformBuffer(object):
+    """
+    Flattened transformations of many matrices at once, stored in one
+    contiguous array of 16 floats per matrix in the layout of
+    matrix_to_list. The world scale is looked up once per buffer instead
+    of once per matrix.
+    """
+
+    STRING_FORMAT = ' '.join(['%.17g'] * 16)
+
+    def __init__(self, matrices, apply_worldscale=False):
+        """
+        matrices			list of 4x4 Matrix
+        apply_worldscale	bool
+        """
+
+        ws = get_worldscale(as_scalematrix=False) if apply_worldscale else 1
+
+        self.buffer = array.array('d')
+
+        if not matrices:
+            return
+
+        if NUMPY_AVAILABLE and fix_matrix_order is fix_matrix_order_new:
+            # Matrices hold single precision floats: the rotation part is multiplied
+            # by the single precision scale of Matrix.Scale, the translation by the
+            # scale itself, exactly like matrix_to_list does
+            scale = numpy.empty((4, 4), dtype=numpy.float64)
+            scale[:, :3] = numpy.float32(ws)
+            scale[:3, 3] = ws
+            scale[3, 3] = 1
+
+            values = numpy.array([[row[:] for row in matrix] for matrix in matrices], dtype=numpy.float64)
+            values = (values * scale).astype(numpy.float32).transpose(0, 2, 1)
+            self.buffer.frombytes(values.astype(numpy.float64).tobytes())
+        else:
+            for matrix in matrices:
+                self.buffer.extend(matrix_to_list(matrix, apply_worldscale=apply_worldscale))
+
+    def __len__(self):
+        return len(self.buffer) // 16
+
+    def __getitem__(self, index):
+        """
+        Returns list[16] of the transformation at index
+        """
+
+        if index < 0:
+            index += len(self)
+
+        return self.buffer[index * 16:index * 16 + 16].tolist()
+
+    def as_string(self, index):
+        """
+        Returns the transformation at index as space separated values, in
+        the syntax of LuxCore property strings. The buffer holds doubles,
+        17 significant digits parse back to exactly the values that the
+        Property path passes.
+        """
+
+        return self.STRING_FORMAT % tuple(self.buffer[index * 16:index * 16 + 16])
+
+
 def get_expanded_file_name(obj, file_path):
     """
     :param obj: object where file_path comes from
@@ -389,12 +809,21 @@ def process_filepath_data(scene, obj, file_path, paramset, parameter_name):
 
     if scene.luxrender_engine.allow_file_embed():
         paramset.add_string(parameter_name, file_basename)
-        encoded_data, encoded_size = bencode_file2string_with_size(file_relative)
+        encoded_lines, encoded_size = bencode_file2lines_with_size(file_relative,
+                                                                   scene.luxrender_engine.embed_compression)
         paramset.increase_size('%s_data' % parameter_name, encoded_size)
-        paramset.add_string('%s_data' % parameter_name, encoded_data.splitlines())
+        paramset.add_string('%s_data' % parameter_name, encoded_lines)
     else:
         paramset.add_string(parameter_name, file_relative)
 
 
+@persistent
+def clear_encoded_file_cache(context):
+    # The embedded files of the previous .blend file are not needed anymore
+    EncodedFileCache.clear()
+
+bpy.app.handlers.load_pre.append(clear_encoded_file_cache)
+
+
 def get_output_filename(scene):
     return '%s.%s.%05d' % (efutil.scene_filename(), bpy.path.clean_name(scene.name), scene.frame_current)
@@ -24,7 +24,7 @@
 #
 # ***** END GPL LICENCE BLOCK *****
 #
-import os, struct, math
+import collections, os, struct, math
 
 import bpy, mathutils, math
 from bpy.app.handlers import persistent
@@ -37,8 +37,12 @@ from ..export import ParamSet, ExportProgressThread, ExportCache, object_anim_ma
 from ..export import matrix_to_list
 from ..export import fix_matrix_order
 from ..export.materials import get_material_volume_defs
+from ..export.meshdata import NUMPY_AVAILABLE, TessfaceArrays, MeshPart, PLYFileWriter
+from ..export.meshdata import split_faces_by_material, write_ply_per_face, triangle_mesh_ply_blocks
+from ..export.plycache import PLYCache
+from ..export.hair import bspline_strands, thickness_profile, HairFileWriter
 from ..export import LuxManager
-from ..export import is_obj_visible
+from ..export import is_obj_visible, is_obj_group_visible
 from ..properties import find_node
 from ..properties.node_material import luxrender_texture_maker
 
@@ -83,6 +87,14 @@ class GeometryExporter(object):
         self.have_emitting_object = False
         self.exporting_duplis = False
 
+        # Writes PLY files in the background, created on first use
+        self.ply_writer = None
+
+        # PLY cache keys of the files queued for writing, and files
+        # which should be linked to them once they are written
+        self.ply_cache_pending = {}
+        self.ply_cache_links = []
+
         self.callbacks = {
             'duplis': {
                 'FACES': self.handler_Duplis_GENERIC,
@@ -187,15 +199,17 @@ class GeometryExporter(object):
                 raise UnexportableObjectException('Cannot create render/export mesh')
 
             # Collate faces by mat index
-            ffaces_mats = {}
-            mesh_faces = mesh.tessfaces
+            if NUMPY_AVAILABLE:
+                ffaces_mats = split_faces_by_material(mesh)
+            else:
+                ffaces_mats = {}
 
-            for f in mesh_faces:
-                mi = f.material_index
+                for f in mesh.tessfaces:
+                    mi = f.material_index
 
-                if mi not in ffaces_mats.keys():
-                    ffaces_mats[mi] = []
-                ffaces_mats[mi].append(f)
+                    if mi not in ffaces_mats.keys():
+                        ffaces_mats[mi] = []
+                    ffaces_mats[mi].append(f)
 
             material_indices = ffaces_mats.keys()
             number_of_mats = len(mesh.materials)
@@ -205,6 +219,9 @@ class GeometryExporter(object):
             else:
                 iterator_range = [0]
 
+            # Bulk copy of the mesh data, only made if a PLY file has to be written
+            mesh_arrays = None
+
             for i in iterator_range:
                 try:
                     if i not in material_indices:
@@ -216,30 +233,7 @@ class GeometryExporter(object):
                         mesh_definitions.append(self.ExportedMeshes.get(mesh_cache_key))
                         continue
 
-                    # Put PLY files in frame-numbered subfolders to avoid
-                    # clobbering when rendering animations
-                    sc_fr = '%s/%s/%s/%05d' % (
-                        efutil.export_path, efutil.scene_filename(), bpy.path.clean_name(self.geometry_scene.name),
-                        self.visibility_scene.frame_current)
-
-                    if not os.path.exists(sc_fr):
-                        os.makedirs(sc_fr)
-
-                    def make_plyfilename():
-                        _ply_serial = self.ExportedPLYs.serial(mesh_cache_key)
-                        _mesh_name = '%s_%04d_m%03d' % (obj.data.name, _ply_serial, i)
-                        _ply_filename = '%s.ply' % bpy.path.clean_name(_mesh_name)
-                        _ply_path = '/'.join([sc_fr, _ply_filename])
-
-                        return _mesh_name, _ply_path
-
-                    mesh_name, ply_path = make_plyfilename()
-
-                    # Ensure that all PLY files have unique names
-                    while self.ExportedPLYs.have(ply_path):
-                        mesh_name, ply_path = make_plyfilename()
-
-                    self.ExportedPLYs.add(ply_path, None)
+                    mesh_name, ply_path = self.makePLYFilename(obj, i, mesh_cache_key)
 
                     # skip writing the PLY file if the box is checked
                     skip_exporting = obj in self.KnownExportedObjects and not obj in self.KnownModifiedObjects
@@ -262,167 +256,28 @@ class GeometryExporter(object):
                         if vertex_color:
                             vertex_color_layer = vertex_color.data
 
-                        # Here we work out exactly which vert+normal combinations
-                        # we need to export. This is done first, and the export
-                        # combinations cached before writing to file because the
-                        # number of verts needed needs to be written in the header
-                        # and that number is not known before this is done.
-
-                        # Export data
-                        co_no_uv_vc_cache = []
-                        face_vert_indices = {}  # mapping of face index to list of exported vert indices for that face
-
-                        # Caches
-                        # mapping of vert index to exported vert index for verts with vert normals
-
-                        vert_vno_indices = {}
-                        vert_use_vno = set()  # Set of vert indices that use vert normals
-                        vert_index = 0  # exported vert index
-
-                        c1 = c2 = c3 = c4 = None
-
-                        for fidx, face in enumerate(ffaces_mats[i]):
-                            fvi = []
-                            if vertex_color_layer:
-                                c1 = vertex_color_layer[fidx].color1
-                                c2 = vertex_color_layer[fidx].color2
-                                c3 = vertex_color_layer[fidx].color3
-                                c4 = vertex_color_layer[fidx].color4
-
-                            for j, vertex in enumerate(face.vertices):
-                                v = mesh.vertices[vertex]
-
-                                if vertex_color_layer:
-                                    if j == 0:
-                                        vert_col = c1
-                                    elif j == 1:
-                                        vert_col = c2
-                                    elif j == 2:
-                                        vert_col = c3
-                                    elif j == 3:
-                                        vert_col = c4
+                        if NUMPY_AVAILABLE:
+                            if mesh_arrays is None:
+                                mesh_arrays = TessfaceArrays(mesh, uv_layer, vertex_color_layer)
 
-                                if face.use_smooth:
-                                    if uv_layer:
-                                        if vertex_color_layer:
-                                            vert_data = (v.co[:], v.normal[:], uv_layer[face.index].uv[j][:],
-                                                         (int(255 * vert_col[0]),
-                                                          int(255 * vert_col[1]),
-                                                          int(255 * vert_col[2]))[:])
-                                        else:
-                                            vert_data = (v.co[:], v.normal[:], uv_layer[face.index].uv[j][:])
-                                    else:
-                                        if vertex_color_layer:
-                                            vert_data = (v.co[:], v.normal[:],
-                                                         (int(255 * vert_col[0]),
-                                                          int(255 * vert_col[1]),
-                                                          int(255 * vert_col[2]))[:])
-                                        else:
-                                            vert_data = (v.co[:], v.normal[:])
-
-                                    if vert_data not in vert_use_vno:
-                                        vert_use_vno.add(vert_data)
+                            ply_cache = self.getPLYCache()
+                            ply_cache_key = mesh_arrays.part_digest(i) if ply_cache is not None else None
 
-                                        co_no_uv_vc_cache.append(vert_data)
-
-                                        vert_vno_indices[vert_data] = vert_index
-                                        fvi.append(vert_index)
-
-                                        vert_index += 1
-                                    else:
-                                        fvi.append(vert_vno_indices[vert_data])
-                                else:
-                                    if uv_layer:
-                                        if vertex_color_layer:
-                                            vert_data = (v.co[:], face.normal[:], uv_layer[face.index].uv[j][:],
-                                                         (int(255 * vert_col[0]),
-                                                          int(255 * vert_col[1]),
-                                                          int(255 * vert_col[2]))[:])
-                                        else:
-                                            vert_data = (v.co[:], face.normal[:], uv_layer[face.index].uv[j][:])
-                                    else:
-                                        if vertex_color_layer:
-                                            vert_data = (v.co[:], face.normal[:],
-                                                         (int(255 * vert_col[0]),
-                                                          int(255 * vert_col[1]),
-                                                          int(255 * vert_col[2]))[:])
-                                        else:
-                                            vert_data = (v.co[:], face.normal[:])
-
-                                    # All face-vert-co-no are unique, we cannot
-                                    # cache them
-                                    co_no_uv_vc_cache.append(vert_data)
-                                    fvi.append(vert_index)
-                                    vert_index += 1
-
-                            face_vert_indices[face.index] = fvi
-
-                        del vert_vno_indices
-                        del vert_use_vno
-
-                        with open(ply_path, 'wb') as ply:
-                            ply.write(b'ply\n')
-                            ply.write(b'format binary_little_endian 1.0\n')
-                            ply.write(b'comment Created by LuxBlend 2.6 exporter for LuxRender - www.luxrender.net\n')
-
-                            # vert_index == the number of actual verts needed
-                            ply.write(('element vertex %d\n' % vert_index).encode())
-                            ply.write(b'property float x\n')
-                            ply.write(b'property float y\n')
-                            ply.write(b'property float z\n')
-
-                            ply.write(b'property float nx\n')
-                            ply.write(b'property float ny\n')
-                            ply.write(b'property float nz\n')
-
-                            if uv_layer:
-                                ply.write(b'property float s\n')
-                                ply.write(b'property float t\n')
-
-                            if vertex_color_layer:
-                                ply.write(b'property uchar red\n')
-                                ply.write(b'property uchar green\n')
-                                ply.write(b'property uchar blue\n')
-
-                            ply.write(('element face %d\n' % len(ffaces_mats[i])).encode())
-                            ply.write(b'property list uchar uint vertex_indices\n')
-
-                            ply.write(b'end_header\n')
-
-                            # dump cached co/no/uv/vc
-                            if uv_layer:
-                                if vertex_color_layer:
-                                    for co, no, uv, vc in co_no_uv_vc_cache:
-                                        ply.write(struct.pack('<3f', *co))
-                                        ply.write(struct.pack('<3f', *no))
-                                        ply.write(struct.pack('<2f', *uv))
-                                        ply.write(struct.pack('<3B', *vc))
-                                else:
-                                    for co, no, uv in co_no_uv_vc_cache:
-                                        ply.write(struct.pack('<3f', *co))
-                                        ply.write(struct.pack('<3f', *no))
-                                        ply.write(struct.pack('<2f', *uv))
+                            if ply_cache_key in self.ply_cache_pending:
+                                # The same data is already queued for writing by this export
+                                self.ply_cache_links.append((ply_cache_key, obj, mesh_name, ply_path))
+                            elif ply_cache_key is not None and ply_cache.fetch(ply_cache_key, ply_path):
+                                LuxLog('Reusing cached PLY file: %s' % ply_path)
                             else:
-                                if vertex_color_layer:
-                                    for co, no, vc in co_no_uv_vc_cache:
-                                        ply.write(struct.pack('<3f', *co))
-                                        ply.write(struct.pack('<3f', *no))
-                                        ply.write(struct.pack('<3B', *vc))
-                                else:
-                                    for co, no in co_no_uv_vc_cache:
-                                        ply.write(struct.pack('<3f', *co))
-                                        ply.write(struct.pack('<3f', *no))
-
-                            # dump face vert indices
-                            for face in ffaces_mats[i]:
-                                lfvi = len(face_vert_indices[face.index])
-                                ply.write(struct.pack('<B', lfvi))
-                                ply.write(struct.pack('<%dI' % lfvi, *face_vert_indices[face.index]))
-
-                            del co_no_uv_vc_cache
-                            del face_vert_indices
+                                mesh_part = MeshPart(mesh_arrays, ffaces_mats[i])
+                                self.writePLYFile(obj, mesh_name, ply_path, mesh_part.ply_blocks())
+                                del mesh_part
 
-                        LuxLog('Binary PLY file written: %s' % ply_path)
+                                if ply_cache_key is not None:
+                                    self.ply_cache_pending[ply_cache_key] = ply_path
+                        else:
+                            write_ply_per_face(mesh, ffaces_mats[i], uv_layer, vertex_color_layer, ply_path)
+                            LuxLog('Binary PLY file written: %s' % ply_path)
                     else:
                         LuxLog('Skipping already exported PLY: %s' % mesh_name)
 
@@ -451,6 +306,136 @@ class GeometryExporter(object):
 
         return mesh_definitions
 
+    def makePLYFilename(self, obj, i, mesh_cache_key):
+        """
+        obj					Object
+        i					int, material index of the mesh part
+        mesh_cache_key		tuple
+
+        Make a unique mesh name and PLY file path for a mesh part. PLY files
+        are put in frame-numbered subfolders to avoid clobbering when
+        rendering animations.
+
+        Returns tuple of mesh name and PLY file path
+        """
+
+        sc_fr = '%s/%s/%s/%05d' % (
+            efutil.export_path, efutil.scene_filename(), bpy.path.clean_name(self.geometry_scene.name),
+            self.visibility_scene.frame_current)
+
+        if not os.path.exists(sc_fr):
+            os.makedirs(sc_fr)
+
+        def make_plyfilename():
+            _ply_serial = self.ExportedPLYs.serial(mesh_cache_key)
+            _mesh_name = '%s_%04d_m%03d' % (obj.data.name, _ply_serial, i)
+            _ply_filename = '%s.ply' % bpy.path.clean_name(_mesh_name)
+            _ply_path = '/'.join([sc_fr, _ply_filename])
+
+            return _mesh_name, _ply_path
+
+        mesh_name, ply_path = make_plyfilename()
+
+        # Ensure that all PLY files have unique names
+        while self.ExportedPLYs.have(ply_path):
+            mesh_name, ply_path = make_plyfilename()
+
+        self.ExportedPLYs.add(ply_path, None)
+
+        return mesh_name, ply_path
+
+    def writePLYFile(self, obj, mesh_name, ply_path, blocks):
+        """
+        Queue the PLY file data for writing on the background writer, see
+        waitForPLYFiles
+        """
+
+        if self.ply_writer is None:
+            self.ply_writer = PLYFileWriter(log=LuxLog)
+
+        self.ply_writer.submit(ply_path, blocks, owner=(obj, mesh_name))
+
+    def getPLYCache(self):
+        """
+        The PLY cache of the current export directory, or None if the
+        cache is disabled
+        """
+
+        engine = self.visibility_scene.luxrender_engine
+
+        if not (NUMPY_AVAILABLE and engine.ply_cache):
+            return None
+
+        cache_dir = '%s/%s/ply_cache' % (efutil.export_path, efutil.scene_filename())
+
+        return PLYCache.get(cache_dir, engine.ply_cache_size * 1024 * 1024, LuxLog)
+
+    def waitForPLYFiles(self):
+        """
+        Block until all PLY files queued by buildBinaryPLYMesh are on disk,
+        report the ones that could not be written and add the others to
+        the PLY cache.
+        """
+
+        if self.ply_writer is None:
+            return
+
+        failed_paths = set()
+
+        for (obj, mesh_name), ply_path, write_err in self.ply_writer.wait():
+            failed_paths.add(ply_path)
+
+            # Don't let partial export skip the broken file next time
+            GeometryExporter.NewExportedObjects.discard(obj)
+            GeometryExporter.KnownExportedObjects.discard(obj)
+
+            err = InvalidGeometryException('%s: cannot write %s (%s)' % (mesh_name, ply_path, write_err))
+            LuxLog('Mesh export failed, the scene references an unwritten PLY file: %s' % err)
+
+        self.ply_writer.shutdown()
+        self.ply_writer = None
+
+        ply_cache = self.getPLYCache()
+
+        if ply_cache is not None:
+            for ply_cache_key, ply_path in self.ply_cache_pending.items():
+                if ply_path not in failed_paths:
+                    ply_cache.store(ply_cache_key, ply_path)
+
+            for ply_cache_key, obj, mesh_name, ply_path in self.ply_cache_links:
+                if not ply_cache.fetch(ply_cache_key, ply_path):
+                    GeometryExporter.NewExportedObjects.discard(obj)
+                    GeometryExporter.KnownExportedObjects.discard(obj)
+
+                    err = InvalidGeometryException('%s: cannot link %s to cached data' % (mesh_name, ply_path))
+                    LuxLog('Mesh export failed, the scene references a missing PLY file: %s' % err)
+
+            try:
+                ply_cache.save()
+            except OSError as err:
+                LuxLog('WARNING: cannot save PLY cache index: %s' % err)
+
+        self.ply_cache_pending = {}
+        self.ply_cache_links = []
+
+    def usePLYSidecar(self, points, indices):
+        """
+        points				sequence of float
+        indices				sequence of int
+
+        Decide if a native mesh is too large to be written inline into
+        the geometry file
+
+        Returns bool
+        """
+
+        limit = self.visibility_scene.luxrender_engine.inline_mesh_limit
+
+        if self.lux_context.API_TYPE != 'FILE' or limit == 0:
+            return False
+
+        return len(points) > limit or len(indices) > limit
+
     def buildNativeMesh(self, obj):
         """
         Convert supported blender objects into a MESH, and then split into parts
@@ -466,16 +451,18 @@ class GeometryExporter(object):
             if mesh is None:
                 raise UnexportableObjectException('Cannot create render/export mesh')
 
-            # collate faces by mat index
-            ffaces_mats = {}
-            mesh_faces = mesh.tessfaces
+            # Collate faces by mat index
+            if NUMPY_AVAILABLE:
+                ffaces_mats = split_faces_by_material(mesh)
+            else:
+                ffaces_mats = {}
 
-            for f in mesh_faces:
-                mi = f.material_index
+                for f in mesh.tessfaces:
+                    mi = f.material_index
 
-                if mi not in ffaces_mats.keys():
-                    ffaces_mats[mi] = []
-                ffaces_mats[mi].append(f)
+                    if mi not in ffaces_mats.keys():
+                        ffaces_mats[mi] = []
+                    ffaces_mats[mi].append(f)
 
             material_indices = ffaces_mats.keys()
             number_of_mats = len(mesh.materials)
@@ -485,6 +472,9 @@ class GeometryExporter(object):
             else:
                 iterator_range = [0]
 
+            # Bulk copy of the mesh data, made for the first exported part
+            mesh_arrays = None
+
             for i in iterator_range:
                 try:
                     if i not in material_indices:
@@ -514,85 +504,105 @@ class GeometryExporter(object):
                         if uv_textures.active and uv_textures.active.data:
                             uv_layer = uv_textures.active.data
 
-                    # Export data
-                    points = []
-                    normals = []
-                    uvs = []
-                    ntris = 0
-                    face_vert_indices = []  # list of face vert indices
+                    if NUMPY_AVAILABLE:
+                        if mesh_arrays is None:
+                            mesh_arrays = TessfaceArrays(mesh, uv_layer)
 
-                    # Caches
-                    vert_vno_indices = {}  # mapping of vert index to exported vert index for verts with vert normals
-                    vert_use_vno = set()  # Set of vert indices that use vert normals
+                        mesh_part = MeshPart(mesh_arrays, ffaces_mats[i])
+                        points, normals, uvs, face_vert_indices = mesh_part.native_arrays()
+                        vert_index = len(mesh_part.vertices)
+                        ntris = len(face_vert_indices)
+                        del mesh_part
+                    else:
+                        # Export data
+                        points = []
+                        normals = []
+                        uvs = []
+                        ntris = 0
+                        face_vert_indices = []  # list of face vert indices
 
-                    vert_index = 0  # exported vert index
-                    for face in ffaces_mats[i]:
-                        fvi = []
-                        for j, vertex in enumerate(face.vertices):
-                            v = mesh.vertices[vertex]
+                        # Caches
+                        vert_vno_indices = {}  # mapping of vert index to exported vert index for verts with vert normals
+                        vert_use_vno = set()  # Set of vert indices that use vert normals
+
+                        vert_index = 0  # exported vert index
+                        for face in ffaces_mats[i]:
+                            fvi = []
+                            for j, vertex in enumerate(face.vertices):
+                                v = mesh.vertices[vertex]
 
-                            if face.use_smooth:
+                                if face.use_smooth:
 
-                                if uv_layer:
-                                    vert_data = (v.co[:], v.normal[:], uv_layer[face.index].uv[j][:] )
-                                else:
-                                    vert_data = (v.co[:], v.normal[:], tuple() )
+                                    if uv_layer:
+                                        vert_data = (v.co[:], v.normal[:], uv_layer[face.index].uv[j][:] )
+                                    else:
+                                        vert_data = (v.co[:], v.normal[:], tuple() )
+
+                                    if vert_data not in vert_use_vno:
+                                        vert_use_vno.add(vert_data)
+
+                                        points.extend(vert_data[0])
+                                        normals.extend(vert_data[1])
+                                        uvs.extend(vert_data[2])
+
+                                        vert_vno_indices[vert_data] = vert_index
+                                        fvi.append(vert_index)
 
-                                if vert_data not in vert_use_vno:
-                                    vert_use_vno.add(vert_data)
+                                        vert_index += 1
+                                    else:
+                                        fvi.append(vert_vno_indices[vert_data])
 
-                                    points.extend(vert_data[0])
-                                    normals.extend(vert_data[1])
-                                    uvs.extend(vert_data[2])
+                                else:
+                                    # all face-vert-co-no are unique, we cannot
+                                    # cache them
+                                    points.extend(v.co[:])
+                                    normals.extend(face.normal[:])
+                                    if uv_layer:
+                                        uvs.extend(uv_layer[face.index].uv[j][:])
 
-                                    vert_vno_indices[vert_data] = vert_index
                                     fvi.append(vert_index)
 
                                     vert_index += 1
-                                else:
-                                    fvi.append(vert_vno_indices[vert_data])
 
-                            else:
-                                # all face-vert-co-no are unique, we cannot
-                                # cache them
-                                points.extend(v.co[:])
-                                normals.extend(face.normal[:])
-                                if uv_layer:
-                                    uvs.extend(uv_layer[face.index].uv[j][:])
-
-                                fvi.append(vert_index)
-
-                                vert_index += 1
-
-                        # For Lux, we need to triangulate quad faces
-                        face_vert_indices.extend(fvi[0:3])
-                        ntris += 3
-                        if len(fvi) == 4:
-                            face_vert_indices.extend([fvi[0], fvi[2], fvi[3]])
+                            # For Lux, we need to triangulate quad faces
+                            face_vert_indices.extend(fvi[0:3])
                             ntris += 3
+                            if len(fvi) == 4:
+                                face_vert_indices.extend([fvi[0], fvi[2], fvi[3]])
+                                ntris += 3
 
-                    del vert_vno_indices
-                    del vert_use_vno
+                        del vert_vno_indices
+                        del vert_use_vno
 
                     # build shape ParamSet
                     shape_params = ParamSet()
+                    shape_type = 'mesh'
 
-                    if self.lux_context.API_TYPE == 'PURE':
-                        # ntris isn't really the number of tris!!
-                        shape_params.add_integer('ntris', ntris)
-                        shape_params.add_integer('nvertices', vert_index)
+                    if self.usePLYSidecar(points, face_vert_indices):
+                        # Large meshes are much faster to write and to parse as binary PLY files
+                        ply_path = self.makePLYFilename(obj, i, mesh_cache_key)[1]
+                        self.writePLYFile(obj, mesh_name, ply_path,
+                                          triangle_mesh_ply_blocks(points, normals, uvs, face_vert_indices))
 
-                    shape_params.add_integer('triindices', face_vert_indices)
-                    shape_params.add_point('P', points)
-                    shape_params.add_normal('N', normals)
+                        shape_type = 'plymesh'
+                        shape_params.add_string('filename', efutil.path_relative_to_export(ply_path))
+                    else:
+                        if self.lux_context.API_TYPE == 'PURE':
+                            # ntris isn't really the number of tris!!
+                            shape_params.add_integer('ntris', ntris)
+                            shape_params.add_integer('nvertices', vert_index)
+
+                        shape_params.add_integer('triindices', face_vert_indices)
+                        shape_params.add_point('P', points)
+                        shape_params.add_normal('N', normals)
 
-                    if uv_layer:
-                        shape_params.add_float('uv', uvs)
+                        if uv_layer:
+                            shape_params.add_float('uv', uvs)
 
                     # Add other properties from LuxRender Mesh panel
                     shape_params.update(obj.data.luxrender_mesh.get_paramset())
 
-                    mesh_definition = (mesh_name, i, 'mesh', shape_params)
+                    mesh_definition = (mesh_name, i, shape_type, shape_params)
                     mesh_definitions.append(mesh_definition)
 
                     # Only export objectBegin..objectEnd and cache this mesh_definition if we plan to use instancing
@@ -745,64 +755,51 @@ class GeometryExporter(object):
         return is_object_animated, next_matrices
 
     def exportShapeInstances(self, obj, mesh_definitions, matrix=None, parent=None):
-        # Don't export instances of portal meshes
-        if obj.type == 'MESH' and obj.data.luxrender_mesh.portal:
-            return
-
-        # or empty definitions
-        if len(mesh_definitions) < 1:
-            return
+        if matrix is not None:
+            matrices = [matrix]
+        else:
+            matrices = [[obj.matrix_world, None]]
 
-        self.lux_context.attributeBegin(comment=obj.name, file=Files.GEOM)
-        is_object_animated, next_matrices = self.is_object_animated(obj, matrix)
+        self.exportShapeInstanceTable(obj, mesh_definitions, matrices, parent)
 
-        # object translation/rotation/scale
-        if is_object_animated:
-            num_steps = len(next_matrices)
-            fsps = float(num_steps) * self.visibility_scene.render.fps / self.visibility_scene.render.fps_base
-            step_times = [i / fsps for i in range(0, num_steps + 1)]
-            self.lux_context.motionBegin(step_times)
+    def buildInstanceAttributes(self, obj, mesh_definitions, parent=None):
+        """
+        Resolve everything that the instances of mesh_definitions have in
+        common: material, emission, volumes and whether the shape is
+        instanced. Materials are written to the material file here, once
+        for all instances.
+
+        Returns list of (me_name, me_shape_type, me_shape_params, ob_mat,
+        named_material, emission, interior, exterior, instanced) tuples,
+        one per mesh definition
+        """
 
-        # then export first matrix as normal
-        if matrix is not None:
-            self.lux_context.transform(matrix_to_list(matrix[0], apply_worldscale=True))
+        if parent is not None:
+            mat_object = parent
         else:
-            self.lux_context.transform(matrix_to_list(obj.matrix_world, apply_worldscale=True))
+            mat_object = obj
 
-        # export rest of the frames matrices
-        if is_object_animated:
-            for next_matrix in next_matrices:
-                # fni = float(num_instances) * self.visibility_scene.render.fps
-                # self.lux_context.motionInstance(me_name, i/fni, (i+1)/fni, '%s_motion_%i' % (obj.name, i))
-                #self.lux_context.transformBegin(comment=obj.name)
-                #self.lux_context.identity()
-                #self.lux_context.transform(matrix_to_list(next_matrix, apply_worldscale=True))
-                #self.lux_context.coordinateSystem('%s_motion_%i' % (obj.name, i))
-                #self.lux_context.transformEnd()
-                self.lux_context.transform(matrix_to_list(next_matrix, apply_worldscale=True))
-            self.lux_context.motionEnd()
-
-        use_inner_scope = len(mesh_definitions) > 1
+        instanced = bool(self.allow_instancing(mat_object))
+
+        attributes = []
         for me_name, me_mat_index, me_shape_type, me_shape_params in mesh_definitions:
             me_shape_params.add_string('name', obj.name)
 
             if me_mat_index == '':
                 me_mat_index = 0
 
-            if use_inner_scope:
-                self.lux_context.attributeBegin()
-
-            if parent is not None:
-                mat_object = parent
-            else:
-                mat_object = obj
-
             try:
                 ob_mat = mat_object.material_slots[me_mat_index].material
             except IndexError:
                 ob_mat = None
                 LuxLog('WARNING: material slot %d on object "%s" is unassigned!' % (me_mat_index + 1, mat_object.name))
 
+            named_material = None
+            emission = None
+            int_v = None
+            ext_v = None
+            object_is_emitter = False
+
             if ob_mat is not None:
                 # Export material definition
                 if self.lux_context.API_TYPE == 'FILE':
@@ -812,18 +809,12 @@ class GeometryExporter(object):
                     self.lux_context.set_output_file(Files.GEOM)
 
                     if not 'CLAY' in mat_export_result:
-                        self.lux_context.namedMaterial(ob_mat.name)
-                elif self.lux_context.API_TYPE == 'PURE':
-                    mat_export_result = ob_mat.luxrender_material.export(self.visibility_scene, self.lux_context,
-                                                                         ob_mat, mode='direct')
+                        named_material = ob_mat.name
 
                 # We need to check the material's output node for a light-emission connection
                 output_node = find_node(ob_mat, 'luxrender_material_output_node')
                 light_node = None
 
-                if ob_mat.luxrender_material.nodetree:
-                    object_is_emitter = False
-
                 if output_node is not None:
                     light_socket = output_node.inputs['Emission']
 
@@ -834,92 +825,133 @@ class GeometryExporter(object):
                     object_is_emitter = ob_mat.luxrender_emission.use_emission
 
                 # If exporting an instance, we need to set emission in the ObjectBegin/End block
-                if object_is_emitter and not self.allow_instancing(mat_object):
+                if object_is_emitter and not instanced:
                     # Only add the AreaLightSource if this object's emission lightgroup is enabled
                     if self.visibility_scene.luxrender_lightgroups.is_enabled(ob_mat.luxrender_emission.lightgroup):
+                        light_group = None
                         if not self.visibility_scene.luxrender_lightgroups.ignore:
-                            self.lux_context.lightGroup(ob_mat.luxrender_emission.lightgroup, [])
+                            light_group = ob_mat.luxrender_emission.lightgroup
 
+                        area_light = None
                         if not ob_mat.luxrender_material.nodetree:
-                            self.lux_context.areaLightSource(*ob_mat.luxrender_emission.api_output(ob_mat))
-                        elif light_node is not None:
-                            # texture exporting
-                            tex_maker = luxrender_texture_maker(self.lux_context, ob_mat.luxrender_material.nodetree)
-                            self.lux_context.areaLightSource(*light_node.export(tex_maker.make_texture))
+                            area_light = ob_mat.luxrender_emission.api_output(ob_mat)
+
+                        emission = (light_group, area_light, light_node)
                     else:
                         object_is_emitter = False
 
                 int_v, ext_v = get_material_volume_defs(ob_mat)
-                if int_v:
-                    self.lux_context.interior(int_v)
-                elif self.geometry_scene.luxrender_world.default_interior_volume:
-                    self.lux_context.interior(self.geometry_scene.luxrender_world.default_interior_volume)
-                if ext_v:
-                    self.lux_context.exterior(ext_v)
-                elif self.geometry_scene.luxrender_world.default_exterior_volume:
-                    self.lux_context.exterior(self.geometry_scene.luxrender_world.default_exterior_volume)
-
-            else:
-                object_is_emitter = False
+                if not int_v:
+                    int_v = self.geometry_scene.luxrender_world.default_interior_volume
+                if not ext_v:
+                    ext_v = self.geometry_scene.luxrender_world.default_exterior_volume
 
             self.have_emitting_object |= object_is_emitter
 
-            # If instancing is forbidden, just export the Shape
-            if not self.allow_instancing(mat_object):
-                self.lux_context.shape(me_shape_type, me_shape_params)
-            # motionInstance for motion blur
-            # elif is_object_animated:
-            # handled by ordinary object instance
-            # ordinary mesh instance
-            else:
-                self.lux_context.objectInstance(me_name)
+            attributes.append((me_name, me_shape_type, me_shape_params, ob_mat, named_material, emission, int_v,
+                               ext_v, instanced))
 
-            if use_inner_scope:
-                self.lux_context.attributeEnd()
+        return attributes
 
-        self.lux_context.attributeEnd()
+    def exportInstanceAttributes(self, attributes):
+        """
+        Emit the material, emission, volumes and shape of one instance of a
+        mesh definition, as resolved by buildInstanceAttributes
+        """
 
-    def BSpline(self, points, dimension, degree, u):
-        controlpoints = []
+        me_name, me_shape_type, me_shape_params, ob_mat, named_material, emission, int_v, ext_v, instanced = \
+            attributes
+
+        if named_material is not None:
+            self.lux_context.namedMaterial(named_material)
+        elif ob_mat is not None and self.lux_context.API_TYPE == 'PURE':
+            ob_mat.luxrender_material.export(self.visibility_scene, self.lux_context, ob_mat, mode='direct')
+
+        if emission is not None:
+            light_group, area_light, light_node = emission
+
+            if light_group is not None:
+                self.lux_context.lightGroup(light_group, [])
+
+            if area_light is not None:
+                self.lux_context.areaLightSource(*area_light)
+            elif light_node is not None:
+                # texture exporting
+                tex_maker = luxrender_texture_maker(self.lux_context, ob_mat.luxrender_material.nodetree)
+                self.lux_context.areaLightSource(*light_node.export(tex_maker.make_texture))
+
+        if int_v:
+            self.lux_context.interior(int_v)
+        if ext_v:
+            self.lux_context.exterior(ext_v)
+
+        # If instancing is forbidden, just export the Shape
+        if not instanced:
+            self.lux_context.shape(me_shape_type, me_shape_params)
+        # motionInstance for motion blur
+        # elif is_object_animated:
+        # handled by ordinary object instance
+        # ordinary mesh instance
+        else:
+            self.lux_context.objectInstance(me_name)
 
-        def Basispolynom(controlpoints, i, u, degree):
-            if degree == 0:
-                _temp = 0
-                if (controlpoints[i] <= u) and (u < controlpoints[i + 1]):
-                    _temp = 1
-            else:
-                N0 = Basispolynom(controlpoints, i, u, degree - 1)
-                N1 = Basispolynom(controlpoints, i + 1, u, degree - 1)
-
-                if N0 == 0:
-                    sum1 = 0
-                else:
-                    sum1 = (u - controlpoints[i]) / (controlpoints[i + degree] - controlpoints[i]) * N0
-                if N1 == 0:
-                    sum2 = 0
-                else:
-                    sum2 = (controlpoints[i + 1 + degree] - u) / (
-                        controlpoints[i + 1 + degree] - controlpoints[i + 1]) * N1
-
-                _temp = sum1 + sum2
-            return _temp
-
-        for i in range(len(points) + degree + 1):
-            if i <= degree:
-                controlpoints.append(0)
-            elif i >= len(points):
-                controlpoints.append(len(points) - degree)
-            else:
-                controlpoints.append(i - degree)
+    def exportShapeInstanceTable(self, obj, mesh_definitions, matrices, parent=None):
+        """
+        obj					Object the instances are exported for
+        mesh_definitions	list of mesh definitions from buildMesh
+        matrices			list of [matrix, next_matrix] pairs, one per instance
+        parent				Object to take the materials from, defaults to obj
 
-        if dimension == 2:
-            temp = mathutils.Vector((0.0, 0.0))
-        elif dimension == 3:
-            temp = mathutils.Vector((0.0, 0.0, 0.0))
+        Export one instance of mesh_definitions per entry in matrices. The
+        materials, emission and volumes are resolved once for all instances.
+        """
 
-        for i in range(len(points)):
-            temp = temp + Basispolynom(controlpoints, i, u, degree) * points[i]
-        return temp
+        # Don't export instances of portal meshes
+        if obj.type == 'MESH' and obj.data.luxrender_mesh.portal:
+            return
+
+        # or empty definitions
+        if len(mesh_definitions) < 1 or len(matrices) < 1:
+            return
+
+        attributes = self.buildInstanceAttributes(obj, mesh_definitions, parent)
+        is_object_animated, next_matrices = self.is_object_animated(obj, matrices[0])
+
+        step_times = None
+        if is_object_animated:
+            num_steps = len(next_matrices)
+            fsps = float(num_steps) * self.visibility_scene.render.fps / self.visibility_scene.render.fps_base
+            step_times = [i / fsps for i in range(0, num_steps + 1)]
+
+        next_transforms = [matrix_to_list(next_matrix, apply_worldscale=True) for next_matrix in next_matrices]
+        use_inner_scope = len(attributes) > 1
+
+        for matrix in matrices:
+            self.lux_context.attributeBegin(comment=obj.name, file=Files.GEOM)
+
+            # object translation/rotation/scale
+            if is_object_animated:
+                self.lux_context.motionBegin(step_times)
+
+            # then export first matrix as normal
+            self.lux_context.transform(matrix_to_list(matrix[0], apply_worldscale=True))
+
+            # export rest of the frames matrices
+            if is_object_animated:
+                for next_transform in next_transforms:
+                    self.lux_context.transform(next_transform)
+                self.lux_context.motionEnd()
+
+            for instance_attributes in attributes:
+                if use_inner_scope:
+                    self.lux_context.attributeBegin()
+
+                self.exportInstanceAttributes(instance_attributes)
+
+                if use_inner_scope:
+                    self.lux_context.attributeEnd()
+
+            self.lux_context.attributeEnd()
 
     def handler_Duplis_PATH(self, obj, *args, **kwargs):
         if not 'particle_system' in kwargs.keys():
@@ -1029,116 +1061,160 @@ class GeometryExporter(object):
             else:
                 thicknessflag = 1
 
-            for pindex in range(start, num_parents + num_children):
-                det.exported_objects += 1
-                point_count = 0
-                i = 0
+            if NUMPY_AVAILABLE:
+                profile = None
+                if thicknessflag:
+                    profile = thickness_profile(steps, root_width, tip_width, width_offset, hair_size)
 
-                if num_children == 0:
-                    i = pindex
+                image = None
+                if psys.settings.luxrender_hair.export_color == 'uv_texture_map' and not len(image_pixels) == 0:
+                    image = (image_pixels, image_width, image_height)
 
-                # A small optimization in order to speedup the export
-                # process: cache the uv_co and color value
-                uv_co = None
-                col = None
-                seg_length = 1.0
+                hair_writer = HairFileWriter(hair_file_path, steps, hair_size, transform, profile,
+                                             bool(colorflag), bool(uvflag), image)
+                batch_points, batch_uvs, batch_colors = hair_writer.new_batch()
+                batch_count = 0
 
-                for step in range(0, steps):
-                    # blender api change in r60251 - removed modifier argument
-                    co = psys.co_hair(obj, mod, pindex, step) if bpy.app.version < (2, 68, 5 ) else psys.co_hair(obj,
-                                                                                                                 pindex,
-                                                                                                                 step)
-                    if step > 0:
-                        seg_length = (co - obj.matrix_world * points[len(points) - 1]).length_squared
+                for pindex in range(start, num_parents + num_children):
+                    det.exported_objects += 1
+                    i = 0
 
-                    if not (co.length_squared == 0 or seg_length == 0):
-                        points.append(transform * co)
+                    if num_children == 0:
+                        i = pindex
 
-                        if thicknessflag:
-                            if step > steps * width_offset:
-                                thick = (root_width * (steps - step - 1) + tip_width * (
-                                            step - steps * width_offset)) / (
-                                            steps * (1 - width_offset) - 1)
-                            else:
-                                thick = root_width
+                    for step in range(0, steps):
+                        # blender api change in r60251 - removed modifier argument
+                        co = psys.co_hair(obj, mod, pindex, step) if bpy.app.version < (2, 68, 5) else \
+                            psys.co_hair(obj, pindex, step)
+                        batch_points.extend(co)
 
-                            thickness.append(thick * hair_size)
+                    if uvflag:
+                        batch_uvs.extend(psys.uv_on_emitter(mod, psys.particles[i], pindex, uv_textures.active_index))
 
-                        point_count += + 1
+                    if colorflag and image is None:
+                        batch_colors.extend(
+                            psys.mcol_on_emitter(mod, psys.particles[i], pindex, vertex_color.active_index))
 
-                        if uvflag:
-                            if not uv_co:
-                                uv_co = psys.uv_on_emitter(mod, psys.particles[i], pindex, uv_textures.active_index)
+                    batch_count += 1
 
-                            uv_coords.append(uv_co)
+                    if batch_count == HairFileWriter.BATCH_SIZE:
+                        hair_writer.add_strands(batch_points, batch_uvs, batch_colors)
+                        batch_points, batch_uvs, batch_colors = hair_writer.new_batch()
+                        batch_count = 0
 
-                        if psys.settings.luxrender_hair.export_color == 'uv_texture_map' and not len(image_pixels) == 0:
-                            if not col:
-                                x_co = round(uv_co[0] * (image_width - 1))
-                                y_co = round(uv_co[1] * (image_height - 1))
+                hair_writer.add_strands(batch_points, batch_uvs, batch_colors)
+                hair_writer.close()
+            else:
+                for pindex in range(start, num_parents + num_children):
+                    det.exported_objects += 1
+                    point_count = 0
+                    i = 0
+
+                    if num_children == 0:
+                        i = pindex
+
+                    # A small optimization in order to speedup the export
+                    # process: cache the uv_co and color value
+                    uv_co = None
+                    col = None
+                    seg_length = 1.0
+
+                    for step in range(0, steps):
+                        # blender api change in r60251 - removed modifier argument
+                        co = psys.co_hair(obj, mod, pindex, step) if bpy.app.version < (2, 68, 5 ) else psys.co_hair(obj,
+                                                                                                                     pindex,
+                                                                                                                     step)
+                        if step > 0:
+                            seg_length = (co - obj.matrix_world * points[len(points) - 1]).length_squared
+
+                        if not (co.length_squared == 0 or seg_length == 0):
+                            points.append(transform * co)
+
+                            if thicknessflag:
+                                if step > steps * width_offset:
+                                    thick = (root_width * (steps - step - 1) + tip_width * (
+                                                step - steps * width_offset)) / (
+                                                steps * (1 - width_offset) - 1)
+                                else:
+                                    thick = root_width
 
-                                pixelnumber = (image_width * y_co) + x_co
+                                thickness.append(thick * hair_size)
 
-                                r = image_pixels[pixelnumber * 4]
-                                g = image_pixels[pixelnumber * 4 + 1]
-                                b = image_pixels[pixelnumber * 4 + 2]
-                                col = (r, g, b)
+                            point_count += + 1
 
-                            colors.append(col)
-                        elif psys.settings.luxrender_hair.export_color == 'vertex_color' and has_vertex_colors:
-                            if not col:
-                                col = psys.mcol_on_emitter(mod, psys.particles[i], pindex, vertex_color.active_index)
+                            if uvflag:
+                                if not uv_co:
+                                    uv_co = psys.uv_on_emitter(mod, psys.particles[i], pindex, uv_textures.active_index)
 
-                            colors.append(col)
+                                uv_coords.append(uv_co)
 
-                if point_count == 1:
-                    points.pop()
+                            if psys.settings.luxrender_hair.export_color == 'uv_texture_map' and not len(image_pixels) == 0:
+                                if not col:
+                                    x_co = round(uv_co[0] * (image_width - 1))
+                                    y_co = round(uv_co[1] * (image_height - 1))
 
-                    if thicknessflag:
-                        thickness.pop()
-                    point_count -= 1
-                elif point_count > 1:
-                    segments.append(point_count - 1)
-                    total_strand_count += 1
-                    total_segments_count = total_segments_count + point_count - 1
-
-            with open(hair_file_path, 'wb') as hair_file:
-                # Binary hair file format from
-                # http://www.cemyuksel.com/research/hairmodels/
-
-                # File header
-                hair_file.write(b'HAIR')  # magic number
-                hair_file.write(struct.pack('<I', total_strand_count))  # total strand count
-                hair_file.write(struct.pack('<I', len(points)))  # total point count
-                # bit array for configuration
-                hair_file.write(struct.pack('<I',
-                                            1 + 2 + 4 * thicknessflag + 16 * colorflag + 32 * uvflag))
-                hair_file.write(struct.pack('<I', steps))  # default segments count
-                hair_file.write(struct.pack('<f', hair_size))  # default thickness
-                hair_file.write(struct.pack('<f', 0.0))  # default transparency
-                color = (0.65, 0.65, 0.65)
-                hair_file.write(struct.pack('<3f', *color))  # default color
-                hair_file.write(struct.pack('<88s', info.encode()))  # information
-
-                # hair data
-                hair_file.write(struct.pack('<%dH' % (len(segments)), *segments))
-
-                for point in points:
-                    hair_file.write(struct.pack('<3f', *point))
+                                    pixelnumber = (image_width * y_co) + x_co
 
-                if thicknessflag:
-                    for thickn in thickness:
-                        hair_file.write(struct.pack('<1f', thickn))
+                                    r = image_pixels[pixelnumber * 4]
+                                    g = image_pixels[pixelnumber * 4 + 1]
+                                    b = image_pixels[pixelnumber * 4 + 2]
+                                    col = (r, g, b)
+
+                                colors.append(col)
+                            elif psys.settings.luxrender_hair.export_color == 'vertex_color' and has_vertex_colors:
+                                if not col:
+                                    col = psys.mcol_on_emitter(mod, psys.particles[i], pindex, vertex_color.active_index)
+
+                                colors.append(col)
+
+                    if point_count == 1:
+                        points.pop()
+
+                        if thicknessflag:
+                            thickness.pop()
+                        point_count -= 1
+                    elif point_count > 1:
+                        segments.append(point_count - 1)
+                        total_strand_count += 1
+                        total_segments_count = total_segments_count + point_count - 1
+
+                with open(hair_file_path, 'wb') as hair_file:
+                    # Binary hair file format from
+                    # http://www.cemyuksel.com/research/hairmodels/
+
+                    # File header
+                    hair_file.write(b'HAIR')  # magic number
+                    hair_file.write(struct.pack('<I', total_strand_count))  # total strand count
+                    hair_file.write(struct.pack('<I', len(points)))  # total point count
+                    # bit array for configuration
+                    hair_file.write(struct.pack('<I',
+                                                1 + 2 + 4 * thicknessflag + 16 * colorflag + 32 * uvflag))
+                    hair_file.write(struct.pack('<I', steps))  # default segments count
+                    hair_file.write(struct.pack('<f', hair_size))  # default thickness
+                    hair_file.write(struct.pack('<f', 0.0))  # default transparency
+                    color = (0.65, 0.65, 0.65)
+                    hair_file.write(struct.pack('<3f', *color))  # default color
+                    hair_file.write(struct.pack('<88s', info.encode()))  # information
+
+                    # hair data
+                    hair_file.write(struct.pack('<%dH' % (len(segments)), *segments))
+
+                    for point in points:
+                        hair_file.write(struct.pack('<3f', *point))
+
+                    if thicknessflag:
+                        for thickn in thickness:
+                            hair_file.write(struct.pack('<1f', thickn))
 
-                if colorflag:
-                    for col in colors:
-                        hair_file.write(struct.pack('<3f', *col))
+                    if colorflag:
+                        for col in colors:
+                            hair_file.write(struct.pack('<3f', *col))
 
-                if uvflag:
-                    for uv in uv_coords:
-                        hair_file.write(struct.pack('<2f', *uv))
+                    if uvflag:
+                        for uv in uv_coords:
+                            hair_file.write(struct.pack('<2f', *uv))
 
-            LuxLog('Binary hair file written: %s' % (hair_file_path))
+                LuxLog('Binary hair file written: %s' % (hair_file_path))
 
             hair_mat = obj.material_slots[psys.settings.material - 1].material
 
@@ -1220,6 +1296,8 @@ class GeometryExporter(object):
                 self.lux_context.shape(st, sp)
                 self.lux_context.objectEnd()
 
+            strands = []
+
             for pindex in range(num_parents + num_children):
                 det.exported_objects += 1
                 points = []
@@ -1232,19 +1310,12 @@ class GeometryExporter(object):
                     if not co.length_squared == 0:
                         points.append(co)
 
-                if psys.settings.use_hair_bspline:
-                    temp = []
-                    degree = 2
-                    dimension = 3
-                    for i in range(math.trunc(math.pow(2, psys.settings.render_step))):
-                        if i > 0:
-                            u = i * (len(points) - degree) / math.trunc(
-                                math.pow(2, psys.settings.render_step) - 1) - 0.0000000000001
-                        else:
-                            u = i * (len(points) - degree) / math.trunc(math.pow(2, psys.settings.render_step) - 1)
-                        temp.append(self.BSpline(points, dimension, degree, u))
-                    points = temp
+                strands.append(points)
+
+            if psys.settings.use_hair_bspline:
+                strands = bspline_strands(strands, 2, math.trunc(math.pow(2, psys.settings.render_step)))
 
+            for points in strands:
                 for j in range(len(points) - 1):
                     # transpose SB so we can extract columns
                     # TODO - change when matrix.col is available
@@ -1312,56 +1383,55 @@ class GeometryExporter(object):
             if not obj.dupli_list:
                 raise Exception('cannot create dupli list for object %s' % obj.name)
 
-            # Create our own DupliOb list to work around incorrect layers
-            # attribute when inside create_dupli_list()..free_dupli_list()
-            duplis = []
+            # Create our own instance table (dupli object -> dupli matrices) to work
+            # around incorrect layers attribute when inside create_dupli_list()..free_dupli_list()
+            instance_table = collections.OrderedDict()
+            num_duplis = 0
             for dupli_ob in obj.dupli_list:
-                # metaballs are omitted from this function intentionally. Adding them causes recursion when building
-                # the ball. (add 'META' to this if you actually want that bug, it makes for some fun glitch
-                # art with particles)
-                if dupli_ob.object.type not in ['MESH', 'SURFACE', 'FONT', 'CURVE']:
-                    continue
+                do = dupli_ob.object
+
+                if do not in instance_table:
+                    # metaballs are omitted from this function intentionally. Adding them causes recursion when
+                    # building the ball. (add 'META' to this if you actually want that bug, it makes for some fun
+                    # glitch art with particles)
+                    if do.type not in ['MESH', 'SURFACE', 'FONT', 'CURVE']:
+                        instance_table[do] = None
                     # if not dupli_ob.object.is_visible(self.visibility_scene) or dupli_ob.object.hide_render:
-                if not is_obj_visible(self.visibility_scene, dupli_ob.object, is_dupli=True):
-                    continue
+                    elif not is_obj_visible(self.visibility_scene, do, is_dupli=True):
+                        instance_table[do] = None
+                    else:
+                        self.objects_used_as_duplis.add(do)
+                        instance_table[do] = []
 
-                self.objects_used_as_duplis.add(dupli_ob.object)
-                duplis.append(
-                    (
-                        dupli_ob.object,
-                        dupli_ob.matrix.copy()
-                    )
-                )
+                if instance_table[do] is not None:
+                    instance_table[do].append([dupli_ob.matrix.copy(), None])
+                    num_duplis += 1
 
             obj.dupli_list_clear()
 
             det = DupliExportProgressThread()
-            det.start(len(duplis))
+            det.start(num_duplis)
 
             self.exporting_duplis = True
 
-            # dupli object, dupli matrix
-            for do, dm in duplis:
-
-                det.exported_objects += 1
-
-                # Check for group layer visibility, if the object is in a group
-                gviz = len(do.users_group) == 0
+            # dupli object, dupli matrices
+            for do, dupli_matrices in instance_table.items():
+                if dupli_matrices is None:
+                    continue
 
-                for grp in do.users_group:
-                    gviz |= True in [a & b for a, b in zip(do.layers, grp.layers)]
+                det.exported_objects += len(dupli_matrices)
 
-                if not gviz:
+                if not is_obj_group_visible(do):
                     continue
 
-                self.exportShapeInstances(
+                self.exportShapeInstanceTable(
                     obj,
                     self.buildMesh(do),
-                    matrix=[dm, None],
+                    dupli_matrices,
                     parent=do
                 )
 
-            del duplis
+            del instance_table
 
             self.exporting_duplis = False
 
@@ -1397,71 +1467,76 @@ class GeometryExporter(object):
         tot_objects = len(geometry_scene.objects)
         progress_thread.start(tot_objects)
 
-        export_originals = {}
+        try:
+            export_originals = {}
 
-        for obj in geometry_scene.objects:
-            progress_thread.exported_objects += 1
+            for obj in geometry_scene.objects:
+                progress_thread.exported_objects += 1
 
-            if self.visibility_scene.luxrender_testing.object_analysis:
-                print('Analysing object %s : %s' % (obj, obj.type))
+                if self.visibility_scene.luxrender_testing.object_analysis:
+                    print('Analysing object %s : %s' % (obj, obj.type))
 
-            try:
-                # Export only objects which are enabled for render (in the outliner) and visible on a render layer
-                if not is_obj_visible(self.visibility_scene, obj):
-                    raise UnexportableObjectException(' -> not visible')
+                try:
+                    # Export only objects which are enabled for render (in the outliner) and visible on a render layer
+                    if not is_obj_visible(self.visibility_scene, obj):
+                        raise UnexportableObjectException(' -> not visible')
 
-                if obj.parent and obj.parent.is_duplicator:
-                    raise UnexportableObjectException(' -> parent is duplicator')
+                    if obj.parent and obj.parent.is_duplicator:
+                        raise UnexportableObjectException(' -> parent is duplicator')
 
-                number_psystems = len(obj.particle_systems)
+                    number_psystems = len(obj.particle_systems)
 
-                if obj.is_duplicator and number_psystems < 1:
-                    if self.visibility_scene.luxrender_testing.object_analysis:
-                        print(' -> is duplicator without particle systems')
-                    if obj.dupli_type in self.valid_duplis_callbacks:
-                        self.callbacks['duplis'][obj.dupli_type](obj)
-                    elif self.visibility_scene.luxrender_testing.object_analysis:
-                        print(' -> Unsupported Dupli type: %s' % obj.dupli_type)
-
-                # Some dupli types should hide the original
-                if obj.is_duplicator and obj.dupli_type in ('VERTS', 'FACES', 'GROUP'):
-                    export_originals[obj] = False
-                else:
-                    export_originals[obj] = True
-
-                if number_psystems > 0 and bpy.context.scene.luxrender_engine.export_particles:
-                    export_originals[obj] = False
-                    if self.visibility_scene.luxrender_testing.object_analysis:
-                        print(' -> has %i particle systems' % number_psystems)
-                    for psys in obj.particle_systems:
-                        export_originals[obj] = export_originals[obj] or psys.settings.use_render_emitter
-                        if psys.settings.render_type in self.valid_particles_callbacks:
-                            self.callbacks['particles'][psys.settings.render_type](obj, particle_system=psys)
+                    if obj.is_duplicator and number_psystems < 1:
+                        if self.visibility_scene.luxrender_testing.object_analysis:
+                            print(' -> is duplicator without particle systems')
+                        if obj.dupli_type in self.valid_duplis_callbacks:
+                            self.callbacks['duplis'][obj.dupli_type](obj)
                         elif self.visibility_scene.luxrender_testing.object_analysis:
-                            print(' -> Unsupported Particle system type: %s' % psys.settings.render_type)
+                            print(' -> Unsupported Dupli type: %s' % obj.dupli_type)
 
-            except UnexportableObjectException as err:
-                if self.visibility_scene.luxrender_testing.object_analysis:
-                    print(' -> Unexportable object: %s : %s : %s' % (obj, obj.type, err))
+                    # Some dupli types should hide the original
+                    if obj.is_duplicator and obj.dupli_type in ('VERTS', 'FACES', 'GROUP'):
+                        export_originals[obj] = False
+                    else:
+                        export_originals[obj] = True
+
+                    if number_psystems > 0 and bpy.context.scene.luxrender_engine.export_particles:
+                        export_originals[obj] = False
+                        if self.visibility_scene.luxrender_testing.object_analysis:
+                            print(' -> has %i particle systems' % number_psystems)
+                        for psys in obj.particle_systems:
+                            export_originals[obj] = export_originals[obj] or psys.settings.use_render_emitter
+                            if psys.settings.render_type in self.valid_particles_callbacks:
+                                self.callbacks['particles'][psys.settings.render_type](obj, particle_system=psys)
+                            elif self.visibility_scene.luxrender_testing.object_analysis:
+                                print(' -> Unsupported Particle system type: %s' % psys.settings.render_type)
+
+                except UnexportableObjectException as err:
+                    if self.visibility_scene.luxrender_testing.object_analysis:
+                        print(' -> Unexportable object: %s : %s : %s' % (obj, obj.type, err))
 
-        export_originals_keys = export_originals.keys()
+            export_originals_keys = export_originals.keys()
 
-        for obj in geometry_scene.objects:
-            try:
-                if obj not in export_originals_keys:
-                    continue
+            for obj in geometry_scene.objects:
+                try:
+                    if obj not in export_originals_keys:
+                        continue
 
-                if not export_originals[obj]:
-                    raise UnexportableObjectException('export_original_object=False')
+                    if not export_originals[obj]:
+                        raise UnexportableObjectException('export_original_object=False')
 
-                if not obj.type in self.valid_objects_callbacks:
-                    raise UnexportableObjectException('Unsupported object type')
+                    if not obj.type in self.valid_objects_callbacks:
+                        raise UnexportableObjectException('Unsupported object type')
 
-                self.callbacks['objects'][obj.type](obj)
+                    self.callbacks['objects'][obj.type](obj)
 
-            except UnexportableObjectException as err:
-                if self.visibility_scene.luxrender_testing.object_analysis:
-                    print(' -> Unexportable object: %s : %s : %s' % (obj, obj.type, err))
+                except UnexportableObjectException as err:
+                    if self.visibility_scene.luxrender_testing.object_analysis:
+                        print(' -> Unexportable object: %s : %s : %s' % (obj, obj.type, err))
+        finally:
+            # The scene files must not reference PLY files that are still being written, and the writer
+            # threads must not outlive a failed export
+            self.waitForPLYFiles()
 
         progress_thread.stop()
         progress_thread.join()
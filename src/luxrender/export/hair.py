@@ -0,0 +1,345 @@
+# -*- coding: utf8 -*-
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# --------------------------------------------------------------------------
+# Blender 2.5 LuxRender Add-On
+# --------------------------------------------------------------------------
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ***** END GPL LICENCE BLOCK *****
+#
+"""
+Hair strand processing for the classic hair export
+"""
+import array, functools, shutil, struct, tempfile, time
+
+import mathutils
+
+from ..outputs import LuxLog
+from ..export.meshdata import NUMPY_AVAILABLE
+
+if NUMPY_AVAILABLE:
+    import numpy
+
+
+@functools.lru_cache(maxsize=64)
+def bspline_basis(num_points, degree, num_samples):
+    """
+    Values of the B-spline basis functions of the given degree over a
+    clamped uniform knot vector for num_points control points, sampled
+    at num_samples parameter values evenly spread over the whole curve.
+
+    Returns tuple of num_samples rows of num_points weights
+    """
+
+    knots = []
+    for i in range(num_points + degree + 1):
+        if i <= degree:
+            knots.append(0)
+        elif i >= num_points:
+            knots.append(num_points - degree)
+        else:
+            knots.append(i - degree)
+
+    rows = []
+    for sample in range(num_samples):
+        u = sample * (num_points - degree) / (num_samples - 1) if num_samples > 1 else 0.0
+
+        # Keep the last sample inside the last knot span
+        if sample > 0:
+            u -= 0.0000000000001
+
+        # Cox-de Boor recursion, evaluated bottom up for all functions at once
+        basis = [1 if knots[i] <= u < knots[i + 1] else 0 for i in range(num_points + degree)]
+
+        for d in range(1, degree + 1):
+            next_basis = []
+
+            for i in range(num_points + degree - d):
+                value = 0
+
+                if basis[i] != 0:
+                    value += (u - knots[i]) / (knots[i + d] - knots[i]) * basis[i]
+                if basis[i + 1] != 0:
+                    value += (knots[i + 1 + d] - u) / (knots[i + 1 + d] - knots[i + 1]) * basis[i + 1]
+
+                next_basis.append(value)
+
+            basis = next_basis
+
+        rows.append(tuple(float(b) for b in basis[:num_points]))
+
+    return tuple(rows)
+
+
+def bspline_strands(strands, degree, num_samples):
+    """
+    strands				list of lists of mathutils.Vector control points
+    degree				int
+    num_samples			int
+
+    Replace every strand by num_samples points on its B-spline curve.
+    Strands with the same number of control points are evaluated together
+    as one matrix product.
+
+    Returns list of lists of mathutils.Vector
+    """
+
+    by_point_count = {}
+    for index, points in enumerate(strands):
+        by_point_count.setdefault(len(points), []).append(index)
+
+    result = [None] * len(strands)
+
+    for num_points, indices in by_point_count.items():
+        basis = bspline_basis(num_points, degree, num_samples)
+
+        if NUMPY_AVAILABLE:
+            control_points = numpy.array([[p[:] for p in strands[i]] for i in indices], dtype=numpy.float64)
+            control_points.shape = (len(indices), num_points, 3)
+            samples = numpy.matmul(numpy.array(basis, dtype=numpy.float64).reshape(num_samples, num_points),
+                                   control_points)
+
+            for i, strand_samples in zip(indices, samples.tolist()):
+                result[i] = [mathutils.Vector(p) for p in strand_samples]
+        else:
+            for i in indices:
+                result[i] = [sum((w * p for w, p in zip(weights, strands[i])), mathutils.Vector((0.0, 0.0, 0.0)))
+                             for weights in basis]
+
+    return result
+
+
+def thickness_profile(steps, root_width, tip_width, width_offset, hair_size):
+    """
+    Thickness of the hair points at every step index, tapering from
+    root_width to tip_width behind width_offset
+
+    Returns list of steps floats
+    """
+
+    profile = []
+    for step in range(steps):
+        if step > steps * width_offset:
+            thick = (root_width * (steps - step - 1) + tip_width * (step - steps * width_offset)) / (
+                steps * (1 - width_offset) - 1)
+        else:
+            thick = root_width
+
+        profile.append(thick * hair_size)
+
+    return profile
+
+
+def filter_hair_points(co):
+    """
+    co					numpy array of the raw hair points, shape (strands, steps, 3)
+
+    Hair points at the origin and points which do not move away from the
+    last point of their strand are not used, strands with less than two
+    points left are dropped.
+
+    Returns tuple of the (strands, steps) mask of used points, the mask of
+    kept strands and the number of used points of every kept strand
+    """
+
+    num_strands, steps = co.shape[:2]
+    step_index = numpy.arange(steps)
+
+    nonzero = (co.astype(numpy.float64) ** 2).sum(axis=2) != 0
+
+    # Compare each point to the last non-zero point before it in its strand
+    last_nonzero = numpy.maximum.accumulate(numpy.where(nonzero, step_index, -1), axis=1)
+    previous = numpy.empty_like(last_nonzero)
+    previous[:, 0] = -1
+    previous[:, 1:] = last_nonzero[:, :-1]
+
+    previous_co = co[numpy.arange(num_strands)[:, None], numpy.maximum(previous, 0)]
+    repeated = (previous >= 0) & (co == previous_co).all(axis=2)
+
+    used = nonzero & ~repeated
+    point_counts = used.sum(axis=1)
+    kept = point_counts > 1
+    used &= kept[:, None]
+
+    return used, kept, point_counts[kept]
+
+
+def image_buffer(pixels, width, height):
+    """
+    pixels				flat sequence of RGBA floats, e.g. Image.pixels[:]
+    width				int
+    height				int
+
+    Returns tuple of the (width * height, 3) numpy array of RGB colors, width and height
+    """
+
+    return numpy.array(pixels, dtype=numpy.float32).reshape(-1, 4)[:, :3], width, height
+
+
+def sample_image_colors(image, uvs):
+    """
+    image				tuple returned by image_buffer()
+    uvs					numpy array of shape (n, 2)
+
+    Returns numpy array of the n colors of the pixels nearest to the UVs
+    """
+
+    pixels, width, height = image
+    x = numpy.rint(uvs[:, 0].astype(numpy.float64) * (width - 1)).astype(numpy.int64)
+    y = numpy.rint(uvs[:, 1].astype(numpy.float64) * (height - 1)).astype(numpy.int64)
+
+    return pixels[width * y + x]
+
+
+class HairFileWriter(object):
+    """
+    Streaming writer for the binary hair file format from
+    http://www.cemyuksel.com/research/hairmodels/
+
+    Strands are handed over in batches of raw hair points (see
+    add_strands). Every section of the file is spooled to its own
+    temporary file as soon as a batch is processed, and the sections are
+    joined behind the header in close(), so memory use only depends on the
+    batch size, not on the number of strands.
+    """
+
+    # Number of strands to collect before add_strands() should be called
+    BATCH_SIZE = 10000
+
+    INFO = b'Created by LuxBlend 2.6 exporter for LuxRender - www.luxrender.net'
+    DEFAULT_COLOR = (0.65, 0.65, 0.65)
+
+    def __init__(self, file_path, steps, hair_size, matrix, thickness_profile=None, use_colors=False,
+                 use_uvs=False, image=None):
+        """
+        file_path			string
+        steps				int, number of hair points per strand
+        hair_size			float, default thickness
+        matrix				4x4 matrix applied to the hair points
+        thickness_profile	list of one thickness per step, or None for the default thickness
+        use_colors			bool
+        use_uvs				bool
+        image				(pixels, width, height) to take the colors from at the strand UVs, or None
+        """
+
+        self.file_path = file_path
+        self.steps = steps
+        self.hair_size = hair_size
+        self.matrix = numpy.array([list(row) for row in matrix], dtype=numpy.float64)
+        self.thickness_profile = None
+        if thickness_profile is not None:
+            self.thickness_profile = numpy.array(thickness_profile, dtype=numpy.float32)
+        self.use_colors = use_colors
+        self.use_uvs = use_uvs
+
+        self.image = None
+        if image is not None:
+            self.image = image_buffer(*image)
+
+        self.section_names = ['segments', 'points']
+        if self.thickness_profile is not None:
+            self.section_names.append('thickness')
+        if use_colors:
+            self.section_names.append('colors')
+        if use_uvs:
+            self.section_names.append('uvs')
+
+        self.sections = {name: tempfile.TemporaryFile() for name in self.section_names}
+
+        self.strand_count = 0
+        self.point_count = 0
+        self.start_time = time.time()
+
+    @staticmethod
+    def new_batch():
+        """
+        Returns typed arrays for the raw hair points, strand UVs and
+        strand colors of one batch
+        """
+
+        return array.array('f'), array.array('f'), array.array('f')
+
+    def add_strands(self, points, uvs, colors):
+        """
+        points				array of all steps of all strands of the batch, 3 floats per step
+        uvs					array of 2 floats per strand (ignored if not use_uvs)
+        colors				array of 3 floats per strand (ignored if not use_colors or an image is used)
+
+        Hair points at the origin and points which do not move away from the
+        last point of their strand are skipped, strands with less than two
+        points left are dropped.
+        """
+
+        if len(points) == 0:
+            return
+
+        co = numpy.frombuffer(points, dtype=numpy.float32).reshape(-1, self.steps, 3)
+        used, kept, point_counts = filter_hair_points(co)
+
+        hair_points = co[used].astype(numpy.float64)
+        hair_points = hair_points.dot(self.matrix[:3, :3].T) + self.matrix[:3, 3]
+
+        self.write('segments', (point_counts - 1).astype('<u2'))
+        self.write('points', hair_points.astype('<f4'))
+
+        if self.thickness_profile is not None:
+            self.write('thickness', numpy.broadcast_to(self.thickness_profile, used.shape)[used].astype('<f4'))
+
+        strand_uvs = None
+        if self.use_uvs or self.image is not None:
+            strand_uvs = numpy.frombuffer(uvs, dtype=numpy.float32).reshape(-1, 2)[kept]
+
+        if self.use_colors:
+            if self.image is not None:
+                strand_colors = sample_image_colors(self.image, strand_uvs)
+            else:
+                strand_colors = numpy.frombuffer(colors, dtype=numpy.float32).reshape(-1, 3)[kept]
+
+            self.write('colors', numpy.repeat(strand_colors, point_counts, axis=0).astype('<f4'))
+
+        if self.use_uvs:
+            self.write('uvs', numpy.repeat(strand_uvs, point_counts, axis=0).astype('<f4'))
+
+        self.strand_count += len(point_counts)
+        self.point_count += int(point_counts.sum())
+
+    def write(self, section, data):
+        self.sections[section].write(data.tobytes())
+
+    def close(self):
+        flags = 1 + 2 + 4 * (self.thickness_profile is not None) + 16 * self.use_colors + 32 * self.use_uvs
+
+        with open(self.file_path, 'wb') as hair_file:
+            hair_file.write(b'HAIR')  # magic number
+            hair_file.write(struct.pack('<I', self.strand_count))  # total strand count
+            hair_file.write(struct.pack('<I', self.point_count))  # total point count
+            hair_file.write(struct.pack('<I', flags))  # bit array for configuration
+            hair_file.write(struct.pack('<I', self.steps))  # default segments count
+            hair_file.write(struct.pack('<f', self.hair_size))  # default thickness
+            hair_file.write(struct.pack('<f', 0.0))  # default transparency
+            hair_file.write(struct.pack('<3f', *self.DEFAULT_COLOR))  # default color
+            hair_file.write(struct.pack('<88s', self.INFO))  # information
+
+            for name in self.section_names:
+                section = self.sections[name]
+                section.seek(0)
+                shutil.copyfileobj(section, hair_file, 16 * 1024 * 1024)
+                section.close()
+
+        elapsed = max(time.time() - self.start_time, 0.001)
+        LuxLog('Binary hair file written: %s (%d strands, %d points, %0.0f strands/s)' % (
+            self.file_path, self.strand_count, self.point_count, self.strand_count / elapsed))
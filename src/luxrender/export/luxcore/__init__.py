@@ -25,16 +25,17 @@
 # ***** END GPL LICENCE BLOCK *****
 #
 
-import bpy, time, os
+import bpy, collections, time, os
 
 from ...outputs import LuxManager
 from ...outputs.luxcore_api import pyluxcore
 from ...extensions_framework import util as efutil
+from ...export import VisibilityIndex, WorldScale, TransformBuffer, MotionSampleCache, is_obj_visible
 from ...export.volumes import SmokeCache
 
 from .camera import CameraExporter
 from .config import ConfigExporter
-from .duplis import DupliExporter
+from .duplis import DupliExporter, HairStrandCache
 from .lights import LightExporter       # ported to new interface, but crucial refactoring/cleanup still missing
 from .materials import MaterialExporter
 from .meshes import MeshExporter
@@ -42,6 +43,8 @@ from .objects import ObjectExporter
 from .textures import TextureExporter
 from .volumes import VolumeExporter
 from .utils import get_elem_key, LightgroupCache, is_lightgroup_opencl_compatible, ErrorCache
+from .utils import is_animated, is_material_animated, is_mesh_animated
+from .utils import rna_fingerprint
 
 
 class LuxCoreExporter(object):
@@ -59,10 +62,25 @@ class LuxCoreExporter(object):
         self.context = context
         self.is_material_preview = is_material_preview
 
+        # Keep the scene between the frames of an animation, see convert_frame_update()
+        self.persistent = False
+
         self.config_properties = pyluxcore.Properties()
-        self.scene_properties = pyluxcore.Properties()
-        # All property changes since last pop_updated_scene_properties()
-        self.updated_scene_properties = pyluxcore.Properties()
+
+        # Scene properties are stored per owner, so replacing or deleting an element only touches its own entries.
+        # The owner of a cached element is (exporter class, cache key), see __set_scene_properties().
+        # Structure: {owner: pyluxcore.Properties}
+        self.element_properties = collections.OrderedDict()
+        # All property changes since last pop_updated_scene_properties(), same structure
+        self.updated_element_properties = collections.OrderedDict()
+        self.updated_property_count = 0
+        # Ownership index, structure: {owner: set of property name prefixes, e.g. 'scene.objects.<name>'}
+        self.property_prefixes = {}
+
+        # Scene that the properties are parsed into in chunks during the export of final renders,
+        # see __set_scene_properties(). element_properties is not filled while streaming.
+        self.stream_scene = None
+        self.stream_chunk_size = 0
 
         # List of objects that are distributed via particle systems or dupliverts/frames/...
         self.instanced_duplis = set()
@@ -81,6 +99,12 @@ class LuxCoreExporter(object):
         # Cache defined passes to avoid multiple definitions
         self.passes_cache = set()
 
+        # Sampled strands of hair systems that are not animated
+        self.hair_strand_cache = HairStrandCache()
+
+        # Transformation of every converted object, to find the objects that moved in the next frame
+        self.frame_transforms = {}
+
         # Temporary (only used during export) caches to avoid multiple exporting
         self.temp_material_cache = set()
         self.temp_texture_cache = set()
@@ -96,12 +120,24 @@ class LuxCoreExporter(object):
         self.error_cache = ErrorCache()
 
 
+    @property
+    def scene_properties(self):
+        """
+        All scene properties of the converted elements (empty after streaming exports)
+        """
+        properties = pyluxcore.Properties()
+
+        for element_properties in self.element_properties.values():
+            properties.Set(element_properties)
+
+        return properties
+
+
     def pop_updated_scene_properties(self):
         """
         Get changed scene properties since last call of this function
         """
-        updated_properties = pyluxcore.Properties(self.updated_scene_properties)
-        self.updated_scene_properties = pyluxcore.Properties()
+        updated_properties = self.__pop_updated_element_properties()
 
         # Clear temporary caches
         self.temp_material_cache = set()
@@ -115,89 +151,251 @@ class LuxCoreExporter(object):
         """
         Convert the whole scene
         """
-        print('\nStarting export...')
-        start_time = time.time()
+        # Layers cannot change during the export, so visibility is only computed once per object
+        VisibilityIndex.begin(self.blender_scene)
+
+        try:
+            WorldScale.begin()
 
-        if luxcore_scene is None:
-            image_scale = self.blender_scene.luxcore_scenesettings.imageScale / 100.0
-            if image_scale < 0.99:
-                print('All textures will be scaled down by factor %.2f' % image_scale)
+            print('\nStarting export...')
+            start_time = time.time()
+
+            # Step through the motion blur subframes once for all objects and the camera
+            MotionSampleCache.begin(self.blender_scene)
+
+            if luxcore_scene is None:
+                image_scale = self.blender_scene.luxcore_scenesettings.imageScale / 100.0
+                if image_scale < 0.99:
+                    print('All textures will be scaled down by factor %.2f' % image_scale)
+                else:
+                    image_scale = 1
+
+                luxcore_scene = pyluxcore.Scene(image_scale)
+
+            # Convert camera and add it to the scene. This needs to be done before object conversion because e.g.
+            # hair export needs a valid defined camera object in case it is view-dependent
+            self.convert_camera()
+            luxcore_scene.Parse(self.pop_updated_scene_properties())
+
+            translator_settings = self.blender_scene.luxcore_translatorsettings
+            if translator_settings.stream_properties and not (self.is_viewport_render or self.is_material_preview
+                                                              or translator_settings.print_scn):
+                self.stream_scene = luxcore_scene
+                self.stream_chunk_size = translator_settings.stream_chunk_size
+
+            SmokeCache.reset()
+            self.convert_all_volumes()
+
+            if self.is_viewport_render and self.context.space_data.local_view:
+                # In local view, only export "local" objects and add a white background light
+                for blender_object in self.context.visible_objects:
+                    self.convert_object(blender_object, luxcore_scene)
+
+                background_props = pyluxcore.Properties()
+                background_props.Set(pyluxcore.Property('scene.lights.LOCALVIEW_BACKGROUND.type', 'constantinfinite'))
+
+                self.__set_scene_properties('localview_background', background_props)
             else:
-                image_scale = 1
+                # Materials, textures, lights and meshes are all converted by their respective Blender object
+                object_amount = len(self.blender_scene.objects)
+                object_counter = 0
+
+                # Flatten the world matrices of all objects at once
+                transforms = TransformBuffer([blender_object.matrix_world for blender_object in self.blender_scene.objects],
+                                             apply_worldscale=True)
+
+                for blender_object in self.blender_scene.objects:
+                    if self.renderengine.test_break():
+                        print('EXPORT CANCELLED BY USER')
+                        return None
+
+                    object_counter += 1
+                    self.renderengine.update_stats('Exporting...', 'Object: ' + blender_object.name)
+                    self.renderengine.update_progress(object_counter / object_amount)
+
+                    transform = transforms[object_counter - 1]
+                    self.convert_object(blender_object, luxcore_scene, transform=transform)
+
+                    if self.persistent:
+                        self.frame_transforms[get_elem_key(blender_object)] = transform
+
+            # Convert config at last because all lightgroups and passes have to be already defined
+            self.convert_config(film_width, film_height)
+            self.convert_imagepipeline()
+            self.convert_lightgroup_scales(verbose=True)
+
+            # Debug output
+            if self.blender_scene.luxcore_translatorsettings.print_cfg:
+                print('\nConfig Properties:')
+                print(self.config_properties)
+            if self.blender_scene.luxcore_translatorsettings.print_scn:
+                print('\nScene Properties:')
+                print(self.scene_properties)
+
+            # Show message in Blender UI
+            export_time = time.time() - start_time
+            print('Export finished (%.1fs)' % export_time)
+
+            if self.blender_scene.luxcore_translatorsettings.export_type == 'luxcoreui':
+                message = 'Starting LuxCoreUI...'
+            elif self.config_exporter.get_engine().endswith('CPU'):
+                message = 'Starting LuxRender...'
+            else:
+                message = 'Compiling OpenCL Kernels...'
+            self.renderengine.update_stats('Export Finished (%.1fs)' % export_time, message)
 
-            luxcore_scene = pyluxcore.Scene(image_scale)
+            # Create luxcore scene and config
+            luxcore_scene.Parse(self.pop_updated_scene_properties())
+            luxcore_config = pyluxcore.RenderConfig(self.config_properties, luxcore_scene)
 
-        # Convert camera and add it to the scene. This needs to be done before object conversion because e.g.
-        # hair export needs a valid defined camera object in case it is view-dependent
-        self.convert_camera()
-        luxcore_scene.Parse(self.pop_updated_scene_properties())
+            return luxcore_config
+        finally:
+            self.stream_scene = None
 
-        SmokeCache.reset()
-        self.convert_all_volumes()
+            VisibilityIndex.end()
+            WorldScale.end()
+            MotionSampleCache.end()
 
-        if self.is_viewport_render and self.context.space_data.local_view:
-            # In local view, only export "local" objects and add a white background light
-            for blender_object in self.context.visible_objects:
-                self.convert_object(blender_object, luxcore_scene)
 
-            background_props = pyluxcore.Properties()
-            background_props.Set(pyluxcore.Property('scene.lights.LOCALVIEW_BACKGROUND.type', 'constantinfinite'))
+    def convert_frame_update(self, luxcore_scene):
+        """
+        Convert the changes of the current frame against the cached exporters, for animations that are rendered
+        with one persistent rendersession. Only objects that moved, objects with possibly deforming meshes, lights,
+        duplis and animated materials/textures are converted again.
 
-            self.__set_scene_properties(background_props)
-        else:
-            # Materials, textures, lights and meshes are all converted by their respective Blender object
-            object_amount = len(self.blender_scene.objects)
-            object_counter = 0
+        The returned properties have to be parsed into luxcore_scene between BeginSceneEdit() and EndSceneEdit().
+        Returns None if the update was cancelled by the user.
+        """
+        VisibilityIndex.begin(self.blender_scene)
+
+        try:
+            WorldScale.begin()
+
+            print('\nUpdating frame %d...' % self.blender_scene.frame_current)
+            start_time = time.time()
+
+            MotionSampleCache.begin(self.blender_scene)
+            self.error_cache = ErrorCache()
+
+            self.convert_camera()
+
+            SmokeCache.reset()
+            self.convert_all_volumes()
 
-            for blender_object in self.blender_scene.objects:
+            objects = list(self.blender_scene.objects)
+            transforms = TransformBuffer([blender_object.matrix_world for blender_object in objects],
+                                         apply_worldscale=True)
+            motion_samples = MotionSampleCache.active
+            update_count = 0
+
+            for index, blender_object in enumerate(objects):
                 if self.renderengine.test_break():
                     print('EXPORT CANCELLED BY USER')
                     return None
 
-                object_counter += 1
-                self.renderengine.update_stats('Exporting...', 'Object: ' + blender_object.name)
-                self.renderengine.update_progress(object_counter / object_amount)
+                key = get_elem_key(blender_object)
+                transform = transforms[index]
 
-                self.convert_object(blender_object, luxcore_scene)
+                if not is_obj_visible(self.blender_scene, blender_object):
+                    self.delete_object(blender_object, luxcore_scene)
+                    continue
 
-        # Convert config at last because all lightgroups and passes have to be already defined
-        self.convert_config(film_width, film_height)
-        self.convert_imagepipeline()
-        self.convert_lightgroup_scales(verbose=True)
+                if key in self.dupli_cache:
+                    # Particles and dupli instances are exported again as a whole
+                    self.delete_owned_objects((DupliExporter, key), luxcore_scene)
+                    self.convert_duplis(luxcore_scene, blender_object)
 
-        # Debug output
-        if self.blender_scene.luxcore_translatorsettings.print_cfg:
-            print('\nConfig Properties:')
-            print(self.config_properties)
-        if self.blender_scene.luxcore_translatorsettings.print_scn:
-            print('\nScene Properties:')
-            print(self.scene_properties)
+                is_new = key not in self.object_cache and key not in self.light_cache
+                update_mesh = is_mesh_animated(blender_object)
+                moved = transform != self.frame_transforms.get(key) or (
+                    motion_samples is not None and blender_object in motion_samples and motion_samples[blender_object])
 
-        # Show message in Blender UI
-        export_time = time.time() - start_time
-        print('Export finished (%.1fs)' % export_time)
+                if is_new or update_mesh or moved or blender_object.type == 'LAMP':
+                    self.renderengine.update_stats('Exporting...', 'Object: ' + blender_object.name)
+                    self.convert_object(blender_object, luxcore_scene, update_mesh=update_mesh or is_new,
+                                        update_material=is_new, transform=transform)
+                    update_count += 1
 
-        if self.blender_scene.luxcore_translatorsettings.export_type == 'luxcoreui':
-            message = 'Starting LuxCoreUI...'
-        elif self.config_exporter.get_engine().endswith('CPU'):
-            message = 'Starting LuxRender...'
-        else:
-            message = 'Compiling OpenCL Kernels...'
-        self.renderengine.update_stats('Export Finished (%.1fs)' % export_time, message)
+                self.frame_transforms[key] = transform
 
-        # Create luxcore scene and config
-        luxcore_scene.Parse(self.pop_updated_scene_properties())
-        luxcore_config = pyluxcore.RenderConfig(self.config_properties, luxcore_scene)
+            # Values of materials and textures can be animated, too
+            for material_key in list(self.material_cache.keys()):
+                material = material_key[0] if isinstance(material_key, tuple) else material_key
 
-        return luxcore_config
+                if material is not None and is_material_animated(material):
+                    self.convert_material(material)
 
+            for texture_key in list(self.texture_cache.keys()):
+                texture = texture_key[0] if isinstance(texture_key, tuple) else texture_key
 
-    def convert_camera(self):
-        camera_props_keys = self.camera_exporter.properties.GetAllNames()
-        self.scene_properties.DeleteAll(camera_props_keys)
+                if texture is not None and is_animated(texture):
+                    self.convert_texture(texture)
+
+            self.convert_lightgroup_scales()
+
+            print('Frame update finished (%.1fs, %d objects updated)' % (time.time() - start_time, update_count))
+
+            return self.pop_updated_scene_properties()
+        finally:
+            VisibilityIndex.end()
+            WorldScale.end()
+            MotionSampleCache.end()
+
+
+    def delete_object(self, blender_object, luxcore_scene):
+        """
+        Remove the LuxCore objects and lights of a Blender object (and of its duplis) from luxcore_scene and the caches
+        """
+        key = get_elem_key(blender_object)
+
+        if key in self.dupli_cache:
+            self.dupli_cache.pop(key)
+            self.delete_owned_objects((DupliExporter, key), luxcore_scene)
+
+        if key in self.light_cache:
+            exporter = self.light_cache.pop(key)
+
+            # In case of sunsky there might be multiple light sources, loop through them
+            for exported_light in exporter.exported_lights:
+                if exported_light.type == 'AREA':
+                    # Area lights are meshlights and treated like objects with glowing materials
+                    luxcore_scene.DeleteObject(exported_light.luxcore_name)
+                else:
+                    luxcore_scene.DeleteLight(exported_light.luxcore_name)
+
+            self.__delete_scene_properties((LightExporter, key))
+
+        if key in self.object_cache:
+            exporter = self.object_cache.pop(key)
+
+            # loop through object components (split by materials)
+            for exported_object in exporter.exported_objects:
+                luxcore_scene.DeleteObject(exported_object.luxcore_object_name)
+
+            self.__delete_scene_properties((ObjectExporter, key))
 
+        self.frame_transforms.pop(key, None)
+
+
+    def delete_owned_objects(self, owner, luxcore_scene):
+        """
+        Remove all objects and lights of an owner (see __set_scene_properties) from luxcore_scene
+        """
+        for prefix in self.property_prefixes.get(owner, ()):
+            parts = prefix.split('.')
+
+            if len(parts) == 3 and parts[0] == 'scene':
+                if parts[1] == 'objects':
+                    luxcore_scene.DeleteObject(parts[2])
+                elif parts[1] == 'lights':
+                    luxcore_scene.DeleteLight(parts[2])
+
+        self.__delete_scene_properties(owner)
+
+
+    def convert_camera(self):
         self.camera_exporter.convert()
-        self.__set_scene_properties(self.camera_exporter.properties)
+        self.__set_scene_properties((CameraExporter, None), self.camera_exporter.properties)
 
 
     def convert_config(self, film_width, film_height):
@@ -404,7 +602,57 @@ class LuxCoreExporter(object):
         return temp_properties
 
 
-    def convert_object(self, blender_object, luxcore_scene, update_mesh=True, update_material=True):
+    # The fingerprint methods return hashable summaries of the Blender settings that the corresponding convert
+    # methods depend on. The viewport render compares them between updates and only converts what changed.
+
+    def camera_fingerprint(self):
+        return self.camera_exporter.fingerprint()
+
+
+    def config_fingerprint(self, film_width, film_height):
+        return self.config_exporter.fingerprint(film_width, film_height)
+
+
+    def material_fingerprint(self, material):
+        return MaterialExporter(self, self.blender_scene, material).fingerprint()
+
+
+    def volumes_fingerprint(self):
+        # The names allow to find out which volumes were added or removed
+        return tuple((volume.name, VolumeExporter(self, self.blender_scene, volume).fingerprint())
+                     for volume in self.blender_scene.luxrender_volumes.volumes)
+
+
+    def session_fingerprint(self):
+        """
+        Summary of the settings used by convert_imagepipeline() and convert_lightgroup_scales()
+        """
+        scene = self.blender_scene
+        imagepipeline = None
+
+        if scene.camera is not None:
+            lux_camera = scene.camera.data.luxrender_camera
+            imagepipeline_settings = lux_camera.luxcore_imagepipeline
+            background_image = None
+
+            if imagepipeline_settings.use_background_image:
+                path = efutil.filesystem_path(imagepipeline_settings.background_image)
+                show_in_view = (not self.is_viewport_render or not imagepipeline_settings.background_camera_view_only
+                                or self.context.region_data.view_perspective == 'CAMERA')
+                background_image = (os.path.isfile(path), show_in_view)
+
+            imagepipeline = (rna_fingerprint(imagepipeline_settings), lux_camera.sensitivity, lux_camera.fstop,
+                             lux_camera.exposure_time(), background_image, 'ALPHA' in self.passes_cache)
+
+        lightgroups = None
+
+        if not scene.luxrender_lightgroups.ignore:
+            lightgroups = tuple((id, rna_fingerprint(lg)) for lg, id in self.lightgroup_cache.get_lightgroup_id_pairs())
+
+        return imagepipeline, lightgroups, scene.luxcore_translatorsettings.export_type
+
+
+    def convert_object(self, blender_object, luxcore_scene, update_mesh=True, update_material=True, transform=None):
         cache = self.object_cache
         exporter = ObjectExporter(self, self.blender_scene, self.is_viewport_render, blender_object)
 
@@ -412,14 +660,14 @@ class LuxCoreExporter(object):
 
         if obj_key in cache:
             exporter = cache[obj_key]
-            old_properties = exporter.properties.GetAllNames()
 
-            # Delete old scene properties
-            self.scene_properties.DeleteAll(old_properties)
-            self.updated_scene_properties.DeleteAll(old_properties)
+        new_properties = exporter.convert(update_mesh, update_material, luxcore_scene, transform=transform)
+        # Replaces the old scene properties of the object
+        self.__set_scene_properties((ObjectExporter, obj_key), new_properties)
 
-        new_properties = exporter.convert(update_mesh, update_material, luxcore_scene)
-        self.__set_scene_properties(new_properties)
+        if self.stream_scene is not None:
+            # The values were handed over to the scene, deletions only need the ownership index
+            exporter.properties = pyluxcore.Properties()
 
         cache[obj_key] = exporter
 
@@ -453,9 +701,10 @@ class LuxCoreExporter(object):
         self.__convert_element(tex_key, self.texture_cache, exporter)
 
 
-    def convert_light(self, blender_object, luxcore_scene):
+    def convert_light(self, blender_object, luxcore_scene, transform=None):
         exporter = LightExporter(self, self.blender_scene, blender_object)
-        self.__convert_element(get_elem_key(blender_object), self.light_cache, exporter, luxcore_scene)
+        self.__convert_element(get_elem_key(blender_object), self.light_cache, exporter, luxcore_scene,
+                               transform=transform)
 
 
     def convert_volume(self, volume):
@@ -483,24 +732,67 @@ class LuxCoreExporter(object):
                 self.convert_volume(volume)
 
 
-    def __convert_element(self, cache_key, cache, exporter, luxcore_scene=None):
+    def __convert_element(self, cache_key, cache, exporter, luxcore_scene=None, **kwargs):
         if cache_key in cache:
             exporter = cache[cache_key]
-            old_properties = exporter.properties.GetAllNames()
 
-            # Delete old scene properties
-            self.scene_properties.DeleteAll(old_properties)
-            self.updated_scene_properties.DeleteAll(old_properties)
+        new_properties = exporter.convert(luxcore_scene, **kwargs) if luxcore_scene else exporter.convert(**kwargs)
+        # Replaces the old scene properties of the element
+        self.__set_scene_properties((type(exporter), cache_key), new_properties)
 
-        new_properties = exporter.convert(luxcore_scene) if luxcore_scene else exporter.convert()
-        self.__set_scene_properties(new_properties)
+        if self.stream_scene is not None:
+            # The values were handed over to the scene, deletions only need the ownership index
+            exporter.properties = pyluxcore.Properties()
 
         cache[cache_key] = exporter
 
 
-    def __set_scene_properties(self, properties):
-        self.updated_scene_properties.Set(properties)
-        self.scene_properties.Set(properties)
+    def __set_scene_properties(self, owner, properties):
+        """
+        Replace all scene properties of owner with properties. Only the entries of this owner are touched, no
+        matter how many properties the whole scene has.
+
+        :param owner: (exporter class, cache key) for cached elements, a string for single properties
+        """
+        self.property_prefixes[owner] = {'.'.join(name.split('.', 3)[:3]) for name in properties.GetAllNames()}
+
+        self.__discard_updated_element_properties(owner)
+        self.updated_element_properties[owner] = properties
+        self.updated_property_count += properties.GetSize()
+
+        if self.stream_scene is None:
+            # Re-insert, so the elements stay in the order they were converted in
+            self.element_properties.pop(owner, None)
+            self.element_properties[owner] = properties
+        elif self.updated_property_count >= self.stream_chunk_size:
+            # Elements are always added as a whole after the elements they reference,
+            # so every chunk can be parsed on its own
+            self.stream_scene.Parse(self.__pop_updated_element_properties())
+
+
+    def __delete_scene_properties(self, owner):
+        self.element_properties.pop(owner, None)
+        self.property_prefixes.pop(owner, None)
+        self.__discard_updated_element_properties(owner)
+
+
+    def __discard_updated_element_properties(self, owner):
+        properties = self.updated_element_properties.pop(owner, None)
+
+        if properties is not None:
+            self.updated_property_count -= properties.GetSize()
+
+
+    def __pop_updated_element_properties(self):
+        updated_properties = pyluxcore.Properties()
+
+        for properties in self.updated_element_properties.values():
+            updated_properties.Set(properties)
+
+        self.updated_element_properties = collections.OrderedDict()
+        self.updated_property_count = 0
+
+        return updated_properties
 
 
     def __convert_world_volume(self):
@@ -517,7 +809,7 @@ class LuxCoreExporter(object):
 
                 volume_exporter = self.volume_cache[cam_exterior]
                 properties.Set(pyluxcore.Property('scene.world.volume.default', volume_exporter.luxcore_name))
-                self.__set_scene_properties(properties)
+                self.__set_scene_properties('world_volume', properties)
                 return
 
         # No valid camera volume found, try world exterior
@@ -529,8 +821,8 @@ class LuxCoreExporter(object):
 
             volume_exporter = self.volume_cache[world_exterior]
             properties.Set(pyluxcore.Property('scene.world.volume.default', volume_exporter.luxcore_name))
-            self.__set_scene_properties(properties)
+            self.__set_scene_properties('world_volume', properties)
             return
 
         # Fallback: no valid world default volume found, delete old world default
-        self.scene_properties.Delete('scene.world.volume.default')
+        self.__delete_scene_properties('world_volume')
@@ -34,7 +34,7 @@ from ...export import object_anim_matrices
 from ...export import fix_matrix_order
 from ...export import matrix_to_list
 
-from .utils import calc_shutter
+from .utils import calc_shutter, rna_fingerprint, matrix_fingerprint
 
 
 class CameraExporter(object):
@@ -57,6 +57,40 @@ class CameraExporter(object):
         return self.properties
 
 
+    def fingerprint(self):
+        """
+        Returns a hashable summary of the viewport and camera settings convert() depends on, so viewport redraws
+        only export the camera when it changed. None if there is no view to export.
+        """
+        if self.context.region_data is None:
+            return None
+
+        region_data = self.context.region_data
+        view = (region_data.view_perspective, matrix_fingerprint(region_data.view_matrix),
+                self.context.space_data.lens, region_data.view_camera_zoom, tuple(region_data.view_camera_offset),
+                self.context.space_data.region_3d.view_distance, self.context.region.width,
+                self.context.region.height, get_worldscale(as_scalematrix=False))
+
+        blCamera = self.context.scene.camera
+
+        if blCamera is None:
+            return view, None
+
+        # The imagepipeline is updated in the session, see LuxCoreExporter.session_fingerprint()
+        camera_settings = rna_fingerprint(blCamera.data, skip={'luxcore_imagepipeline'})
+        dof_object = blCamera.data.dof_object
+        dof_location = tuple(dof_object.location) if dof_object is not None else None
+
+        render = self.blender_scene.render
+        render_settings = (render.resolution_x, render.resolution_y, render.resolution_percentage, render.use_border,
+                           render.border_min_x, render.border_max_x, render.border_min_y, render.border_max_y,
+                           render.fps, render.fps_base)
+
+        camera = (matrix_fingerprint(blCamera.matrix_world), tuple(blCamera.location), camera_settings, dof_location,
+                  render_settings)
+        return view, camera
+
+
     def __calc_screenwindow(self, dx, dy, xaspect, yaspect, zoom):
         scr_left = -xaspect * zoom
         scr_right = xaspect * zoom
@@ -30,10 +30,17 @@ import os
 from ...outputs.luxcore_api import pyluxcore
 from ...extensions_framework import util as efutil
 from ...export import get_output_filename
-from .utils import is_lightgroup_opencl_compatible
+from .utils import is_lightgroup_opencl_compatible, rna_fingerprint
 
 
 class ConfigExporter(object):
+    # Engine settings that do not change the config: UI toggles and the halt conditions of the viewport render,
+    # which are checked in core/__init__.py
+    FINGERPRINT_IGNORED_SETTINGS = {'advanced', 'biaspath_show_sample_estimates', 'show_halt_conditions',
+                                    'use_halt_samples', 'halt_samples', 'use_halt_samples_preview',
+                                    'halt_samples_preview', 'use_halt_time', 'halt_time', 'use_halt_time_preview',
+                                    'halt_time_preview'}
+
     def __init__(self, luxcore_exporter, blender_scene, is_viewport_render=False):
         self.luxcore_exporter = luxcore_exporter
         self.blender_scene = blender_scene
@@ -68,6 +75,30 @@ class ConfigExporter(object):
         return self.properties
 
 
+    def fingerprint(self, film_width, film_height):
+        """
+        Returns a hashable summary of the settings convert() depends on, so the viewport render only converts
+        the config and restarts the rendering when it changed
+        """
+        scene = self.blender_scene
+        engine_settings = rna_fingerprint(scene.luxcore_enginesettings, self.FINGERPRINT_IGNORED_SETTINGS)
+
+        if scene.camera is not None:
+            imagepipeline_settings = scene.camera.data.luxrender_camera.luxcore_imagepipeline
+            camera_settings = (imagepipeline_settings.transparent_film, imagepipeline_settings.output_switcher_pass)
+        else:
+            camera_settings = None
+
+        # See __convert_seed()
+        frame = scene.frame_current if scene.luxcore_enginesettings.use_animated_seed else None
+
+        # See __convert_lightgroups(), lights can add lightgroups to the cache during the export
+        lightgroups = (scene.luxrender_lightgroups.ignore, len(self.luxcore_exporter.lightgroup_cache.cache))
+
+        return (film_width, film_height, engine_settings, scene.luxcore_translatorsettings.export_type,
+                camera_settings, rna_fingerprint(scene.luxrender_channels), lightgroups, frame)
+
+
     def convert_channel(self, channelName, id=-1, lightgroup_name=''):
         """
         Sets configuration properties for LuxCore AOV output
@@ -25,17 +25,271 @@
 # ***** END GPL LICENCE BLOCK *****
 #
 
-import math, mathutils, time
+import array, hashlib, math, time
+
+import bpy, mathutils
+
 from ...outputs.luxcore_api import pyluxcore
 from ...outputs.luxcore_api import ToValidLuxCoreName
-from ...export import matrix_to_list, is_obj_visible
+from ...export import matrix_to_list, is_obj_visible, is_obj_group_visible, TransformBuffer
+from ...export.hair import thickness_profile, filter_hair_points, image_buffer, sample_image_colors
+from ...export.meshdata import NUMPY_AVAILABLE
 
 from .objects import ObjectExporter
 from .lights import LightExporter
-from .utils import log_exception
+from .utils import is_hair_animated, log_exception, rna_fingerprint
+
+if NUMPY_AVAILABLE:
+    import numpy
+
+
+class HairStrands(object):
+    """
+    Strand geometry of one hair system in compact typed arrays (numpy arrays if numpy is available), converted
+    to the lists that Scene.DefineStrands() expects only when the shape is defined
+    """
+
+    def __init__(self, strand_count, points, segments, thickness, colors, uvs):
+        """
+        strand_count		int
+        points				3 floats per point, in object space
+        segments			number of segments of every strand
+        thickness			1 float per point, or float for all points
+        colors				3 floats per point, or None
+        uvs					2 floats per point, or None
+        """
+
+        self.strand_count = strand_count
+        self.points = points
+        self.segments = segments
+        self.thickness = thickness
+        self.colors = colors
+        self.uvs = uvs
+
+    @property
+    def point_count(self):
+        return len(self.points) // 3
+
+    @staticmethod
+    def build(points, steps, matrix, profile, hair_size, strand_uvs, strand_colors, image):
+        """
+        points				array of all steps of all strands, 3 floats per step, in world space
+        steps				int
+        matrix				4x4 matrix from world space to object space
+        profile				list of one thickness per step, or None for hair_size everywhere
+        hair_size			float
+        strand_uvs			array of 2 floats per strand, or None
+        strand_colors		array of 3 floats per strand, or None
+        image				buffer to take the colors from at the strand UVs (see export.hair.image_buffer), or None
+
+        Hair points at the origin and points which do not move away from the
+        last point of their strand are skipped, strands with less than two
+        points left are dropped.
+        """
+
+        if NUMPY_AVAILABLE:
+            co = numpy.frombuffer(points, dtype=numpy.float32).reshape(-1, steps, 3)
+            used, kept, point_counts = filter_hair_points(co)
+
+            matrix = numpy.array([list(row) for row in matrix], dtype=numpy.float64)
+            hair_points = co[used].astype(numpy.float64).dot(matrix[:3, :3].T) + matrix[:3, 3]
+
+            thickness = hair_size
+            if profile is not None:
+                thickness = numpy.broadcast_to(numpy.array(profile, dtype=numpy.float32), used.shape)[used]
+
+            uvs = None
+            if strand_uvs is not None:
+                uvs = numpy.frombuffer(strand_uvs, dtype=numpy.float32).reshape(-1, 2)[kept]
+
+            colors = None
+            if image is not None:
+                colors = sample_image_colors(image, uvs)
+            elif strand_colors is not None:
+                colors = numpy.frombuffer(strand_colors, dtype=numpy.float32).reshape(-1, 3)[kept]
+
+            if colors is not None:
+                colors = numpy.repeat(colors, point_counts, axis=0).ravel()
+            if uvs is not None:
+                uvs = numpy.repeat(uvs, point_counts, axis=0).ravel()
+
+            return HairStrands(len(point_counts), hair_points.astype(numpy.float32).ravel(), point_counts - 1,
+                               thickness, colors, uvs)
+
+        hair_points = array.array('f')
+        segments = []
+        thickness = hair_size if profile is None else array.array('f')
+        colors = None if image is None and strand_colors is None else array.array('f')
+        uvs = None if strand_uvs is None else array.array('f')
+
+        for strand in range(len(points) // (3 * steps)):
+            used_steps = []
+            last_co = None
+
+            for step in range(steps):
+                offset = 3 * (strand * steps + step)
+                co = mathutils.Vector(points[offset:offset + 3])
+
+                if co.length_squared == 0 or co == last_co:
+                    continue
+
+                used_steps.append(step)
+                last_co = co
+
+            if len(used_steps) < 2:
+                continue
+
+            for step in used_steps:
+                offset = 3 * (strand * steps + step)
+                hair_points.extend(matrix * mathutils.Vector(points[offset:offset + 3]))
+
+            segments.append(len(used_steps) - 1)
+
+            if profile is not None:
+                thickness.extend(profile[step] for step in used_steps)
+
+            if uvs is not None:
+                uvs.extend(strand_uvs[2 * strand:2 * strand + 2] * len(used_steps))
+
+            if image is not None:
+                pixels, width, height = image
+                x = round(strand_uvs[2 * strand] * (width - 1))
+                y = round(strand_uvs[2 * strand + 1] * (height - 1))
+                pixel = 4 * (width * y + x)
+                colors.extend(pixels[pixel:pixel + 3] * len(used_steps))
+            elif colors is not None:
+                colors.extend(strand_colors[3 * strand:3 * strand + 3] * len(used_steps))
+
+        return HairStrands(len(segments), hair_points, segments, thickness, colors, uvs)
+
+    @staticmethod
+    def as_tuples(values, width):
+        if NUMPY_AVAILABLE and isinstance(values, numpy.ndarray):
+            return list(map(tuple, values.reshape(-1, width).tolist()))
+
+        return list(zip(*[iter(values)] * width))
+
+    def define(self, luxcore_scene, shape_name, settings):
+        """
+        settings			luxrender_hair settings of the particle system
+        """
+
+        thickness = self.thickness
+        if not isinstance(thickness, float):
+            thickness = thickness.tolist()
+
+        colors = (1.0, 1.0, 1.0) if self.colors is None else self.as_tuples(self.colors, 3)
+        uvs = None if self.uvs is None else self.as_tuples(self.uvs, 2)
+        segments = self.segments if isinstance(self.segments, list) else self.segments.tolist()
+
+        # Documentation: http://www.luxrender.net/forum/viewtopic.php?f=8&t=12116&sid=03a16c5c345db3ee0f8126f28f1063c8#p112819
+        luxcore_scene.DefineStrands(shape_name, self.strand_count, self.point_count, self.as_tuples(self.points, 3),
+                                    segments, thickness, 0.0, colors, uvs,
+                                    settings.tesseltype, settings.adaptive_maxdepth, settings.adaptive_error,
+                                    settings.solid_sidecount, settings.solid_capbottom, settings.solid_captop,
+                                    True)
+
+
+class HairStrandCache(object):
+    """
+    Strands of hair systems that are not animated, kept by the LuxCoreExporter (one viewport session or one
+    persistent animation session) so that viewport updates and the frames of an animation do not have to sample
+    them again. Every entry is stored with a fingerprint of the data the strands are computed from (particle
+    settings and textures, parent hair keys, emitter vertices, vertex group weights, UVs and vertex colors), so
+    edits in particle edit mode, on the emitter mesh or in weight paint mode are picked up although they are not
+    animated.
+    """
+
+    def __init__(self):
+        # (object name, library path, particle system name, is viewport render) -> (fingerprint, HairStrands)
+        self.entries = {}
+
+    @staticmethod
+    def get_key(obj, psys, is_viewport_render):
+        library_path = obj.library.filepath if obj.library else None
+        return obj.name, library_path, psys.name, is_viewport_render
+
+    def get(self, key, fingerprint):
+        entry = self.entries.get(key)
+
+        if entry is None or entry[0] != fingerprint:
+            return None
+
+        return entry[1]
+
+    def store(self, key, fingerprint, strands):
+        self.entries[key] = (fingerprint, strands)
+
+    def discard(self, key):
+        self.entries.pop(key, None)
+
+    @staticmethod
+    def fingerprint(obj, psys, steps):
+        """
+        Returns hex digest, or None if the strands cannot be cached (colors from an image with unsaved changes)
+        """
+
+        settings = [steps, rna_fingerprint(psys), rna_fingerprint(psys.settings)]
+        settings.extend(rna_fingerprint(mod) for mod in obj.modifiers)
+        # Particle textures can control density, length, roughness etc.
+        settings.extend((rna_fingerprint(slot), rna_fingerprint(slot.texture))
+                        for slot in psys.settings.texture_slots if slot is not None and slot.texture is not None)
+
+        digest = hashlib.sha1()
+        digest.update(repr(settings).encode())
+
+        for particle in psys.particles:
+            hair_keys = particle.hair_keys
+            co = array.array('f', bytes(12 * len(hair_keys)))
+            hair_keys.foreach_get('co', co)
+            digest.update(co.tobytes())
+
+        mesh = obj.data
+
+        # Children are interpolated on the emitter faces
+        vertices = array.array('f', bytes(12 * len(mesh.vertices)))
+        mesh.vertices.foreach_get('co', vertices)
+        digest.update(vertices.tobytes())
+
+        # Density and length can be controlled by vertex group weights
+        if len(obj.vertex_groups) > 0:
+            group_indices = array.array('i')
+            weights = array.array('f')
+
+            for vertex in mesh.vertices:
+                for element in vertex.groups:
+                    group_indices.extend((vertex.index, element.group))
+                    weights.append(element.weight)
+
+            digest.update(group_indices.tobytes())
+            digest.update(weights.tobytes())
+
+        if mesh.uv_layers.active is not None:
+            uvs = array.array('f', bytes(8 * len(mesh.loops)))
+            mesh.uv_layers.active.data.foreach_get('uv', uvs)
+            digest.update(uvs.tobytes())
+
+            uv_texture = mesh.uv_textures.active
+            image = uv_texture.data[0].image if uv_texture is not None and len(uv_texture.data) > 0 else None
+
+            if image is not None:
+                if image.is_dirty:
+                    return None
+
+                digest.update(repr((image.name, image.filepath, image.size[:])).encode())
+
+        if mesh.vertex_colors.active is not None:
+            colors = array.array('f', bytes(12 * len(mesh.loops)))
+            mesh.vertex_colors.active.data.foreach_get('color', colors)
+            digest.update(colors.tobytes())
+
+        return digest.hexdigest()
 
 
 class DupliExporter(object):
+    # Number of duplis whose object definitions are parsed at once
+    PROPERTY_CHUNK_SIZE = 10000
+
     def __init__(self, luxcore_exporter, blender_scene, duplicator, is_viewport_render=False):
         self.luxcore_exporter = luxcore_exporter
         self.blender_scene = blender_scene
@@ -45,6 +299,7 @@ class DupliExporter(object):
         self.properties = pyluxcore.Properties()
         self.dupli_number = 0
         self.dupli_amount = 1
+        self.image_buffers = {}
 
 
     def convert(self, luxcore_scene):
@@ -106,9 +361,12 @@ class DupliExporter(object):
 
         self.dupli_amount = len(self.duplicator.dupli_list)
 
-        # Create our own DupliOb list to work around incorrect layers
-        # attribute when inside create_dupli_list()..free_dupli_list()
-        duplis = []
+        # Collect the duplis column by column: the dupli list is freed below, and the layers
+        # attribute of its objects is incorrect inside create_dupli_list()..free_dupli_list()
+        dupli_objects = []
+        dupli_matrices = []
+        dupli_psys_names = []
+        dupli_persistent_ids = []
         non_invertible_count = 0
         for dupli_ob in obj.dupli_list:
             if not is_obj_visible(self.blender_scene, dupli_ob.object, True, self.is_viewport_render):
@@ -126,14 +384,10 @@ class DupliExporter(object):
             if dupli_ob.object not in self.luxcore_exporter.instanced_duplis:
                 self.luxcore_exporter.instanced_duplis.add(dupli_ob.object)
 
-            duplis.append(
-                (
-                    dupli_ob.object,
-                    dupli_ob.matrix.copy(),
-                    dupli_ob.particle_system.name if dupli_ob.particle_system else obj.name,
-                    dupli_ob.persistent_id[:]
-                )
-            )
+            dupli_objects.append(dupli_ob.object)
+            dupli_matrices.append(dupli_ob.matrix.copy())
+            dupli_psys_names.append(dupli_ob.particle_system.name if dupli_ob.particle_system else obj.name)
+            dupli_persistent_ids.append('_'.join([str(elem) for elem in dupli_ob.persistent_id]))
 
         if non_invertible_count > 0:
             print('WARNING: %d particles with non-invertible matrix were skipped.' % non_invertible_count)
@@ -143,25 +397,35 @@ class DupliExporter(object):
         # Preprocessing step to speed up particle export below.
         # Export all unique objects used by particle systems once, then only use their luxcore names in the main loop below
         unique_objs = {}
-        for do, dm, psys_name, persistent_id in duplis:
+        for do, dm in zip(dupli_objects, dupli_matrices):
             if do.name not in unique_objs:
                 # Note: the dupli_suffix does not matter here, we just have to pass anything so the visibility test works
                 object_exporter = ObjectExporter(self.luxcore_exporter, self.blender_scene, self.is_viewport_render, do, 'dupli')
                 object_exporter.convert(False, False, luxcore_scene, None, dm)
                 unique_objs[do.name] = object_exporter.exported_objects
 
-        # dupli object, dupli matrix
-        for do, dm, psys_name, persistent_id in duplis:
+        # Flatten all dupli matrices at once
+        transforms = TransformBuffer(dupli_matrices, apply_worldscale=True)
+
+        # The object definitions are generated as text and parsed in chunks, which is much
+        # cheaper than creating three pyluxcore.Property objects per dupli and material
+        use_property_strings = hasattr(self.properties, 'SetFromString')
+        definitions = []
+        chunk_count = 0
+
+        # Parts of the LuxCore object names and the group visibility only depend on the dupli object
+        name_prefixes = {}
+        group_visible = {}
+
+        for dupli_index, do in enumerate(dupli_objects):
             # Increment dupli number for progress display
             self.dupli_number += 1
 
             # Check for group layer visibility, if the object is in a group
-            gviz = len(do.users_group) == 0
-
-            for grp in do.users_group:
-                gviz |= True in [a & b for a, b in zip(do.layers, grp.layers)]
+            if do.name not in group_visible:
+                group_visible[do.name] = is_obj_group_visible(do)
 
-            if not gviz:
+            if not group_visible[do.name]:
                 continue
 
             # Make it possible to interrupt the export process and report status in the UI
@@ -172,21 +436,44 @@ class DupliExporter(object):
                 if self.luxcore_exporter.renderengine.test_break():
                     return
 
-            persistent_id_str = '_'.join([str(elem) for elem in persistent_id])
-            dupli_name_suffix = '%s_%s_%s' % (self.duplicator.name, psys_name, persistent_id_str)
+            psys_name = dupli_psys_names[dupli_index]
+            persistent_id_str = dupli_persistent_ids[dupli_index]
 
             if do.type == 'LAMP':
+                dupli_name_suffix = '%s_%s_%s' % (self.duplicator.name, psys_name, persistent_id_str)
                 light_exporter = LightExporter(self.luxcore_exporter, self.blender_scene, do, dupli_name_suffix)
-                self.properties.Set(light_exporter.convert(luxcore_scene, dm))
-            else:
-                exported_objects = unique_objs[do.name]
+                self.properties.Set(light_exporter.convert(luxcore_scene, dupli_matrices[dupli_index],
+                                                           transforms[dupli_index]))
+                continue
 
-                name = do.name + dupli_name_suffix
-                if do.library:
-                    name += do.library.name
-                name = ToValidLuxCoreName(name)
+            # The persistent ID only contains valid characters, so the name can be made
+            # valid in parts: do.name + duplicator.name + '_' + psys_name + '_' + ID + library name
+            prefix_key = (do.name, psys_name)
+            if prefix_key not in name_prefixes:
+                suffix = ToValidLuxCoreName(do.library.name) if do.library else ''
+                name_prefixes[prefix_key] = (ToValidLuxCoreName('%s%s_%s_' % (do.name, self.duplicator.name,
+                                                                              psys_name)), suffix)
 
-                transform = matrix_to_list(dm, apply_worldscale=True)
+            name_prefix, name_suffix = name_prefixes[prefix_key]
+            name = name_prefix + persistent_id_str + name_suffix
+
+            exported_objects = unique_objs[do.name]
+
+            if use_property_strings:
+                transform = transforms.as_string(dupli_index)
+
+                for mat_index, exp_obj in enumerate(exported_objects):
+                    prefix = 'scene.objects.%s%d' % (name, mat_index)
+                    definitions.append('%s.shape = "%s"\n%s.material = "%s"\n%s.transformation = %s\n' % (
+                        prefix, exp_obj.luxcore_shape_name, prefix, exp_obj.luxcore_material_name, prefix, transform))
+
+                chunk_count += 1
+                if chunk_count == self.PROPERTY_CHUNK_SIZE:
+                    self.properties.SetFromString(''.join(definitions))
+                    definitions = []
+                    chunk_count = 0
+            else:
+                transform = transforms[dupli_index]
 
                 for mat_index, exp_obj in enumerate(exported_objects):
                     prefix = 'scene.objects.%s%d' % (name, mat_index)
@@ -194,7 +481,12 @@ class DupliExporter(object):
                     self.properties.Set(pyluxcore.Property(prefix + '.material', exp_obj.luxcore_material_name))
                     self.properties.Set(pyluxcore.Property(prefix + '.transformation', transform))
 
-        del duplis
+        if definitions:
+            self.properties.SetFromString(''.join(definitions))
+
+        del dupli_objects
+        del dupli_matrices
+        del transforms
 
         time_elapsed = time.time() - time_start
         print('[%s] Particle export finished (%.3fs)' % (obj.name, time_elapsed))
@@ -220,8 +512,80 @@ class DupliExporter(object):
         print('[%s: %s] Exporting hair' % (self.duplicator.name, psys.name))
         time_start = time.time()
 
-        # Export code copied from export/geometry (line 947)
+        settings = psys.settings.luxrender_hair
+
+        if not self.is_viewport_render:
+            psys.set_resolution(self.blender_scene, obj, 'RENDER')
+        steps = 2 ** psys.settings.render_step
+
+        # Hair that is not animated is only sampled again if its source data was edited
+        cache_key = HairStrandCache.get_key(obj, psys, self.is_viewport_render)
+        hair_strand_cache = self.luxcore_exporter.hair_strand_cache
+        fingerprint = None
+        strands = None
+
+        if is_hair_animated(obj, psys):
+            hair_strand_cache.discard(cache_key)
+        else:
+            fingerprint = HairStrandCache.fingerprint(obj, psys, steps)
+            strands = hair_strand_cache.get(cache_key, fingerprint)
+
+        if strands is None:
+            strands = self.__sample_hair(psys, mod, steps)
+
+            if fingerprint is not None and strands is not None:
+                hair_strand_cache.store(cache_key, fingerprint, strands)
+        else:
+            print('[%s: %s] Using cached hair strands' % (obj.name, psys.name))
+
+        if not self.is_viewport_render:
+            # Resolution was changed to 'RENDER' for final renders, change it back
+            psys.set_resolution(self.blender_scene, obj, 'PREVIEW')
+
+        if strands is None:
+            # Export was cancelled
+            return
+
+        luxcore_shape_name = ToValidLuxCoreName(obj.name + '_' + psys.name)
+
+        self.luxcore_exporter.renderengine.update_stats('Exporting...', 'Refining Hair System %s' % psys.name)
+        strands.define(luxcore_scene, luxcore_shape_name, settings)
+
+        # For some reason this index is not starting at 0 but at 1 (Blender is strange)
+        material_index = psys.settings.material - 1
+
+        try:
+            material = obj.material_slots[material_index].material
+        except IndexError:
+            material = None
+            print('WARNING: material slot %d on object "%s" is unassigned!' % (material_index + 1, obj.name))
+
+        # Convert material
+        self.luxcore_exporter.convert_material(material)
+        material_exporter = self.luxcore_exporter.material_cache[material]
+        luxcore_material_name = material_exporter.luxcore_name
+
+        # The hair shape is located at world origin and implicitly instanced, so we have to
+        # move it to the correct position
+        transform = matrix_to_list(obj.matrix_world, apply_worldscale=True)
 
+        prefix = 'scene.objects.' + luxcore_shape_name
+        self.properties.Set(pyluxcore.Property(prefix + '.material', luxcore_material_name))
+        self.properties.Set(pyluxcore.Property(prefix + '.shape', luxcore_shape_name))
+        self.properties.Set(pyluxcore.Property(prefix + '.transformation', transform))
+
+        time_elapsed = time.time() - time_start
+        print('[%s: %s] Hair export finished (%.3fs)' % (obj.name, psys.name, time_elapsed))
+
+
+    def __sample_hair(self, psys, mod, steps):
+        """
+        Samples all hair points of a hair system into one preallocated array and builds the strands from it
+        (export code originally copied from export/geometry)
+
+        Returns HairStrands, or None if the export was cancelled
+        """
+        obj = self.duplicator
         settings = psys.settings.luxrender_hair
 
         hair_size = settings.hair_size
@@ -229,9 +593,6 @@ class DupliExporter(object):
         tip_width = settings.tip_width
         width_offset = settings.width_offset
 
-        if not self.is_viewport_render:
-            psys.set_resolution(self.blender_scene, obj, 'RENDER')
-        steps = 2 ** psys.settings.render_step
         num_parents = len(psys.particles)
         num_children = len(psys.child_particles)
 
@@ -243,180 +604,79 @@ class DupliExporter(object):
                 0.3 * psys.settings.virtual_parents * psys.settings.child_nbr * num_parents)
             start = num_parents + num_virtual_parents
 
-        segments = []
-        points = []
-        thickness = []
-        colors = []
-        uv_coords = []
-        total_segments_count = 0
-        uv_tex = None
-        colorflag = 0
-        uvflag = 0
-        thicknessflag = 0
-        image_width = 0
-        image_height = 0
-        image_pixels = []
-
         modifier_mode = 'PREVIEW' if self.is_viewport_render else 'RENDER'
         mesh = obj.to_mesh(self.blender_scene, True, modifier_mode)
         uv_textures = mesh.tessface_uv_textures
         vertex_color = mesh.tessface_vertex_colors
 
-        has_vertex_colors = vertex_color.active and vertex_color.active.data
+        uvflag = bool(uv_textures.active and uv_textures.active.data)
+        use_vertex_colors = settings.export_color == 'vertex_color' and bool(
+            vertex_color.active and vertex_color.active.data)
+        image = None
+
+        if uvflag and settings.export_color == 'uv_texture_map':
+            blender_image = uv_textures.active.data[0].image
 
-        if settings.export_color == 'vertex_color':
-            if has_vertex_colors:
-                colorflag = 1
+            if blender_image and blender_image.size[0] > 0 and blender_image.size[1] > 0:
+                image = self.__get_image_buffer(blender_image)
 
-        if uv_textures.active and uv_textures.active.data:
-            uv_tex = uv_textures.active.data
-            if settings.export_color == 'uv_texture_map':
-                if uv_tex[0].image:
-                    image_width = uv_tex[0].image.size[0]
-                    image_height = uv_tex[0].image.size[1]
-                    image_pixels = uv_tex[0].image.pixels[:]
-                    colorflag = 1
-            uvflag = 1
+        uv_index = uv_textures.active_index
+        vertex_color_index = vertex_color.active_index
 
-        transform = obj.matrix_world.inverted()
-        total_strand_count = 0
+        bpy.data.meshes.remove(mesh, do_unlink=False)
 
         if root_width == tip_width:
-            thicknessflag = 0
+            profile = None
             hair_size *= root_width
         else:
-            thicknessflag = 1
+            profile = thickness_profile(steps, root_width, tip_width, width_offset, hair_size)
 
+        strand_count = max(num_parents + num_children - start, 0)
         self.dupli_amount = num_parents + num_children
 
-        for pindex in range(start, num_parents + num_children):
+        # Preallocate all buffers, the loop below only fills them
+        points = array.array('f', bytes(4 * 3 * steps * strand_count))
+        strand_uvs = array.array('f', bytes(4 * 2 * strand_count)) if uvflag else None
+        strand_colors = array.array('f', bytes(4 * 3 * strand_count)) if use_vertex_colors else None
+        offset = 0
+
+        for strand, pindex in enumerate(range(start, num_parents + num_children)):
             self.dupli_number += 1
             # Make it possible to interrupt the export process
             if self.dupli_number % 10000 == 0:
                 self.__report_progress(psys)
 
                 if self.luxcore_exporter.renderengine.test_break():
-                    return
-
-            point_count = 0
-            i = 0
-
-            if num_children == 0:
-                i = pindex
-
-            # A small optimization in order to speedup the export
-            # process: cache the uv_co and color value
-            uv_co = None
-            col = None
-            seg_length = 1.0
-
-            for step in range(0, steps):
-                co = psys.co_hair(obj, pindex, step)
-                if step > 0:
-                    seg_length = (co - obj.matrix_world * points[len(points) - 1]).length_squared
-
-                if not (co.length_squared == 0 or seg_length == 0):
-                    points.append(transform * co)
+                    return None
 
-                    if thicknessflag:
-                        if step > steps * width_offset:
-                            thick = (root_width * (steps - step - 1) + tip_width * (
-                                        step - steps * width_offset)) / (
-                                        steps * (1 - width_offset) - 1)
-                        else:
-                            thick = root_width
+            i = pindex if num_children == 0 else 0
 
-                        thickness.append(thick * hair_size)
+            for step in range(steps):
+                points[offset], points[offset + 1], points[offset + 2] = psys.co_hair(obj, pindex, step)
+                offset += 3
 
-                    point_count += + 1
+            if uvflag:
+                strand_uvs[2 * strand], strand_uvs[2 * strand + 1] = psys.uv_on_emitter(mod, psys.particles[i],
+                                                                                        pindex, uv_index)
 
-                    if uvflag:
-                        if not uv_co:
-                            uv_co = psys.uv_on_emitter(mod, psys.particles[i], pindex, uv_textures.active_index)
+            if use_vertex_colors:
+                strand_colors[3 * strand:3 * strand + 3] = array.array('f', psys.mcol_on_emitter(
+                    mod, psys.particles[i], pindex, vertex_color_index))
 
-                        uv_coords.append(uv_co)
+        return HairStrands.build(points, steps, obj.matrix_world.inverted(), profile, hair_size, strand_uvs,
+                                 strand_colors, image)
 
-                    if settings.export_color == 'uv_texture_map' and not len(image_pixels) == 0:
-                        if not col:
-                            x_co = round(uv_co[0] * (image_width - 1))
-                            y_co = round(uv_co[1] * (image_height - 1))
 
-                            pixelnumber = (image_width * y_co) + x_co
-
-                            r = image_pixels[pixelnumber * 4]
-                            g = image_pixels[pixelnumber * 4 + 1]
-                            b = image_pixels[pixelnumber * 4 + 2]
-                            col = (r, g, b)
-
-                        colors.append(col)
-                    elif settings.export_color == 'vertex_color' and has_vertex_colors:
-                        if not col:
-                            col = psys.mcol_on_emitter(mod, psys.particles[i], pindex, vertex_color.active_index)
-
-                        colors.append(col)
-
-            if point_count == 1:
-                points.pop()
-
-                if thicknessflag:
-                    thickness.pop()
-                point_count -= 1
-            elif point_count > 1:
-                segments.append(point_count - 1)
-                total_strand_count += 1
-                total_segments_count = total_segments_count + point_count - 1
-
-        # LuxCore needs tuples, not vectors
-        points_as_tuples = [tuple(point) for point in points]
-
-        if not thicknessflag:
-            thickness = hair_size
-
-        if not colorflag:
-            colors = (1.0, 1.0, 1.0)
-
-        if not uvflag:
-            uvs_as_tuples = None
-        else:
-            # LuxCore needs tuples, not vectors
-            uvs_as_tuples = [tuple(uv) for uv in uv_coords]
-
-        luxcore_shape_name = ToValidLuxCoreName(obj.name + '_' + psys.name)
-
-        self.luxcore_exporter.renderengine.update_stats('Exporting...', 'Refining Hair System %s' % psys.name)
-        # Documentation: http://www.luxrender.net/forum/viewtopic.php?f=8&t=12116&sid=03a16c5c345db3ee0f8126f28f1063c8#p112819
-        luxcore_scene.DefineStrands(luxcore_shape_name, total_strand_count, len(points), points_as_tuples, segments,
-                                    thickness, 0.0, colors, uvs_as_tuples,
-                                    settings.tesseltype, settings.adaptive_maxdepth, settings.adaptive_error,
-                                    settings.solid_sidecount, settings.solid_capbottom, settings.solid_captop,
-                                    True)
-
-        # For some reason this index is not starting at 0 but at 1 (Blender is strange)
-        material_index = psys.settings.material - 1
-
-        try:
-            material = obj.material_slots[material_index].material
-        except IndexError:
-            material = None
-            print('WARNING: material slot %d on object "%s" is unassigned!' % (material_index + 1, obj.name))
-
-        # Convert material
-        self.luxcore_exporter.convert_material(material)
-        material_exporter = self.luxcore_exporter.material_cache[material]
-        luxcore_material_name = material_exporter.luxcore_name
-
-        # The hair shape is located at world origin and implicitly instanced, so we have to
-        # move it to the correct position
-        transform = matrix_to_list(obj.matrix_world, apply_worldscale=True)
-
-        prefix = 'scene.objects.' + luxcore_shape_name
-        self.properties.Set(pyluxcore.Property(prefix + '.material', luxcore_material_name))
-        self.properties.Set(pyluxcore.Property(prefix + '.shape', luxcore_shape_name))
-        self.properties.Set(pyluxcore.Property(prefix + '.transformation', transform))
+    def __get_image_buffer(self, image):
+        """
+        Pixels of an image, shared by all hair systems of the duplicator that take their colors from it
+        """
+        if image.name not in self.image_buffers:
+            width, height = image.size
 
-        if not self.is_viewport_render:
-            # Resolution was changed to 'RENDER' for final renders, change it back
-            psys.set_resolution(self.blender_scene, obj, 'PREVIEW')
+            if NUMPY_AVAILABLE:
+                self.image_buffers[image.name] = image_buffer(image.pixels[:], width, height)
+            else:
+                self.image_buffers[image.name] = (image.pixels[:], width, height)
 
-        time_elapsed = time.time() - time_start
-        print('[%s: %s] Hair export finished (%.3fs)' % (obj.name, psys.name, time_elapsed))
+        return self.image_buffers[image.name]
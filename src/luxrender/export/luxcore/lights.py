@@ -62,14 +62,17 @@ class LightExporter(object):
         self.exported_lights = set()
 
 
-    def convert(self, luxcore_scene, matrix=None):
+    def convert(self, luxcore_scene, matrix=None, transform=None):
+        """
+        transform is the already flattened, world scaled matrix (see TransformBuffer), if available
+        """
         # Remove old properties
         self.properties = pyluxcore.Properties()
 
         old_exported_lights = self.exported_lights.copy()
         self.exported_lights = set()
 
-        self.__convert_light(luxcore_scene, matrix)
+        self.__convert_light(luxcore_scene, matrix, transform)
 
         # Remove old lights
         diff = old_exported_lights - self.exported_lights
@@ -97,7 +100,7 @@ class LightExporter(object):
         return [main_gain * gain_r, main_gain * gain_g, main_gain * gain_b]
 
 
-    def __convert_light(self, luxcore_scene, matrix):
+    def __convert_light(self, luxcore_scene, matrix, transform=None):
         # TODO: refactor this horrible... thing (although it's a bit better now)
 
         obj = self.blender_object
@@ -113,6 +116,9 @@ class LightExporter(object):
         if matrix is None:
             matrix = obj.matrix_world
 
+        if transform is None:
+            transform = matrix_to_list(matrix, apply_worldscale=True)
+
         # Get lightgroup ID
         lightgroup = light.luxrender_lamp.lightgroup
         lightgroup_id =  self.luxcore_exporter.lightgroup_cache.get_id(lightgroup, self.blender_scene, self)
@@ -305,7 +311,6 @@ class LightExporter(object):
             if lux_lamp.flipz:
                 self.properties.Set(pyluxcore.Property('scene.lights.' + luxcore_name + '.flipz', lux_lamp.flipz))
 
-            transform = matrix_to_list(matrix, apply_worldscale=True)
             self.properties.Set(pyluxcore.Property('scene.lights.' + luxcore_name + '.transformation', transform))
             self.properties.Set(pyluxcore.Property('scene.lights.' + luxcore_name + '.position', [0.0, 0.0, 0.0]))
             self.properties.Set(pyluxcore.Property('scene.lights.' + luxcore_name + '.power', lux_lamp.power))
@@ -352,7 +357,6 @@ class LightExporter(object):
             if light.luxrender_lamp.luxrender_lamp_laser.is_laser:
                 self.exported_lights.add(ExportedLight(luxcore_name, 'LASER'))
                 # Laser lamp
-                transform = matrix_to_list(matrix, apply_worldscale=True)
                 self.properties.Set(pyluxcore.Property('scene.lights.' + luxcore_name + '.transformation', transform))
                 self.properties.Set(pyluxcore.Property('scene.lights.' + luxcore_name + '.position', [0.0, 0.0, 0.0]))
                 self.properties.Set(pyluxcore.Property('scene.lights.' + luxcore_name + '.type', 'laser'))
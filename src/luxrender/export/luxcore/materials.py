@@ -34,6 +34,7 @@ from ...export import get_expanded_file_name
 from ...properties import find_node
 
 from .utils import convert_texture_channel, get_elem_key, is_lightgroup_opencl_compatible, log_exception
+from .utils import rna_fingerprint, node_tree_fingerprint
 from .textures import TextureExporter
 
 
@@ -65,6 +66,19 @@ class MaterialExporter(object):
         return self.properties
 
 
+    def fingerprint(self):
+        """
+        Returns a hashable summary of the material settings, or of its node tree for node materials
+        """
+        override_materials = self.blender_scene.luxcore_translatorsettings.override_materials
+        nodetree_name = self.material.luxrender_material.nodetree
+
+        if nodetree_name and nodetree_name in bpy.data.node_groups:
+            return override_materials, node_tree_fingerprint(bpy.data.node_groups[nodetree_name])
+
+        return override_materials, rna_fingerprint(self.material.luxrender_material)
+
+
     def __convert_node_material(self):
         # Clay render handling
         if self.blender_scene.luxcore_translatorsettings.override_materials:
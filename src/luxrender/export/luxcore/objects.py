@@ -60,10 +60,13 @@ class ObjectExporter(object):
         self.exported_objects = []
 
 
-    def convert(self, update_mesh, update_material, luxcore_scene, anim_matrices=None, matrix=None):
+    def convert(self, update_mesh, update_material, luxcore_scene, anim_matrices=None, matrix=None, transform=None):
+        """
+        transform is the already flattened, world scaled matrix (see TransformBuffer), if available
+        """
         self.properties = pyluxcore.Properties()
 
-        self.__convert_object(luxcore_scene, update_mesh, update_material, anim_matrices, matrix)
+        self.__convert_object(luxcore_scene, update_mesh, update_material, anim_matrices, matrix, transform)
 
         return self.properties
 
@@ -79,9 +82,9 @@ class ObjectExporter(object):
         if anim_matrices and len(anim_matrices) > 1:
            return True
 
-        # Use instancing on every object when in viewport render, to be able to transform them without re-exporting
-        # the mesh
-        if self.is_viewport_render:
+        # Use instancing on every object when in viewport render or when the scene is kept between animation frames,
+        # to be able to transform them without re-exporting the mesh
+        if self.is_viewport_render or self.luxcore_exporter.persistent:
             return True
 
         # Duplis and proxies are always instanced
@@ -109,7 +112,7 @@ class ObjectExporter(object):
             return True
 
 
-    def __convert_object(self, luxcore_scene, update_mesh, update_material, anim_matrices, matrix):
+    def __convert_object(self, luxcore_scene, update_mesh, update_material, anim_matrices, matrix, transform):
         obj = self.blender_object
         is_visible = is_obj_visible(self.blender_scene, obj, self.is_dupli, self.is_viewport_render)
 
@@ -117,14 +120,15 @@ class ObjectExporter(object):
             return
 
         if obj.type == 'LAMP':
-            self.luxcore_exporter.convert_light(self.blender_object, luxcore_scene)
+            self.luxcore_exporter.convert_light(self.blender_object, luxcore_scene, transform)
             return
 
         # Transformation
-        if matrix is not None:
-            transform = matrix_to_list(matrix, apply_worldscale=True)
-        else:
-            transform = matrix_to_list(obj.matrix_world, apply_worldscale=True)
+        if transform is None:
+            if matrix is not None:
+                transform = matrix_to_list(matrix, apply_worldscale=True)
+            else:
+                transform = matrix_to_list(obj.matrix_world, apply_worldscale=True)
 
         # Motion Blur (duplis get their anim_matrices passed as argument)
         if not self.is_dupli:
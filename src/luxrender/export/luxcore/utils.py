@@ -27,10 +27,13 @@
 
 from  math import pi
 
+import bpy, collections
+
 from ...outputs.luxcore_api import pyluxcore
 from ...outputs.luxcore_api import ToValidLuxCoreName
 from ...export.materials import get_texture_from_scene
 from ...export import get_worldscale
+from ...properties import find_node
 
 def get_elem_key(elem):
         # Construct unique key for the object (respecting objects from libraries etc.)
@@ -130,6 +133,148 @@ def calc_shutter(blender_scene, lux_camera_settings):
     return shutter_open, shutter_close
 
 
+# Modifiers that only change the mesh when their settings or the base mesh change
+STATIC_MODIFIER_TYPES = {'BEVEL', 'DECIMATE', 'EDGE_SPLIT', 'MIRROR', 'MULTIRES', 'REMESH', 'SCREW', 'SKIN',
+                         'SOLIDIFY', 'SUBSURF', 'TRIANGULATE', 'WIREFRAME'}
+
+
+def is_animated(id_block):
+    """
+    Checks if an ID datablock has keyframes or drivers
+    """
+    return getattr(id_block, 'animation_data', None) is not None
+
+
+def is_material_animated(material):
+    if is_animated(material):
+        return True
+
+    nodetree = material.luxrender_material.nodetree
+    return bool(nodetree) and nodetree in bpy.data.node_groups and is_animated(bpy.data.node_groups[nodetree])
+
+
+def is_mesh_animated(obj, static_modifier_types=STATIC_MODIFIER_TYPES):
+    """
+    Checks if the mesh of an object can change from frame to frame (animated mesh data or shape keys, modifiers
+    that depend on time or other objects, animated modifier settings)
+    """
+    if obj.type in ('CAMERA', 'LAMP', 'EMPTY'):
+        return False
+
+    data = obj.data
+
+    if is_animated(data) or is_animated(getattr(data, 'shape_keys', None)):
+        return True
+
+    if any(mod.type not in static_modifier_types for mod in obj.modifiers):
+        return True
+
+    if is_animated(obj):
+        animation_data = obj.animation_data
+        fcurves = list(animation_data.drivers)
+
+        if animation_data.action:
+            fcurves.extend(animation_data.action.fcurves)
+
+        return any(fcurve.data_path.startswith('modifiers[') for fcurve in fcurves)
+
+    return False
+
+
+def is_hair_animated(obj, particle_system):
+    """
+    Checks if the strands of a hair system can change from frame to frame (hair dynamics, animated particle
+    settings or textures, animated emitter mesh)
+    """
+    settings = particle_system.settings
+
+    if particle_system.use_hair_dynamics or is_animated(settings):
+        return True
+
+    if any(slot is not None and slot.texture is not None and is_animated(slot.texture)
+           for slot in settings.texture_slots):
+        return True
+
+    # The particle system modifiers only change the mesh when their settings change
+    return is_mesh_animated(obj, STATIC_MODIFIER_TYPES | {'PARTICLE_SYSTEM'})
+
+
+# Node properties that only affect the node editor layout
+NODE_LAYOUT_PROPERTIES = {'location', 'width', 'width_hidden', 'height', 'dimensions', 'select', 'hide', 'label',
+                          'color', 'use_custom_color', 'show_options', 'show_preview', 'show_texture',
+                          'show_expanded'}
+
+
+def rna_fingerprint(block, skip=()):
+    """
+    Collects the editable values of a Blender data block into a hashable tuple. Property groups and collections
+    of property groups are followed, pointers to ID datablocks are represented by their name.
+
+    :param skip: identifiers of properties to leave out (on all levels)
+    """
+    values = []
+
+    for prop in block.bl_rna.properties:
+        identifier = prop.identifier
+
+        if identifier == 'rna_type' or identifier in skip:
+            continue
+
+        if prop.type == 'POINTER':
+            value = getattr(block, identifier)
+
+            if isinstance(value, bpy.types.PropertyGroup):
+                values.append((identifier, rna_fingerprint(value, skip)))
+            elif isinstance(value, bpy.types.ID) and not prop.is_readonly:
+                values.append((identifier, value.name))
+            elif value is None and not prop.is_readonly:
+                values.append((identifier, None))
+            continue
+
+        if prop.type == 'COLLECTION':
+            items = getattr(block, identifier)
+
+            if len(items) > 0 and isinstance(items[0], bpy.types.PropertyGroup):
+                values.append((identifier, tuple(rna_fingerprint(item, skip) for item in items)))
+            continue
+
+        # Read only properties are runtime state like is_updated
+        if prop.is_readonly or prop.type not in ('BOOLEAN', 'INT', 'FLOAT', 'ENUM', 'STRING'):
+            continue
+
+        value = getattr(block, identifier)
+
+        if prop.type == 'ENUM' and prop.is_enum_flag:
+            value = tuple(sorted(value))
+        elif prop.type != 'ENUM' and prop.type != 'STRING' and prop.array_length > 0:
+            value = tuple(tuple(item) if hasattr(item, '__len__') else item for item in value)
+
+        values.append((identifier, value))
+
+    return tuple(values)
+
+
+def node_tree_fingerprint(node_tree):
+    """
+    Hashable summary of the node settings, socket values and links of a node tree. Moving nodes around in the
+    node editor does not change it.
+    """
+    nodes = []
+
+    for node in node_tree.nodes:
+        sockets = tuple((socket.identifier, rna_fingerprint(socket, NODE_LAYOUT_PROPERTIES)) for socket in node.inputs)
+        nodes.append((node.name, node.bl_idname, rna_fingerprint(node, NODE_LAYOUT_PROPERTIES), sockets))
+
+    links = tuple((link.from_node.name, link.from_socket.identifier, link.to_node.name, link.to_socket.identifier)
+                  for link in node_tree.links)
+
+    return tuple(nodes), links
+
+
+def matrix_fingerprint(matrix):
+    return tuple(tuple(row) for row in matrix)
+
+
 def generate_volume_name(name):
     return ToValidLuxCoreName(name + '_vol')
 
@@ -189,6 +334,175 @@ class LightgroupCache(object):
         return [(exported_lightgroup.lightgroup, exported_lightgroup.id) for exported_lightgroup in self.cache.values()]
 
 
+class MaterialReferences(object):
+    def __init__(self, textures, nodetree, volumes, uses_pointiness):
+        """
+        :param textures: names of the Blender textures the material uses
+        :param nodetree: name of the node tree, or None
+        :param volumes: names of the interior/exterior volumes, including the default volumes of the scene
+        :param uses_pointiness: if the objects with this material need a pointiness shape
+        """
+        self.textures = textures
+        self.nodetree = nodetree
+        self.volumes = volumes
+        self.uses_pointiness = uses_pointiness
+
+
+class DependencyIndex(object):
+    """
+    Reverse dependencies between the elements of a viewport render session (texture -> materials, node tree ->
+    materials, volume -> materials, material -> objects), so that an update is resolved to the elements that
+    have to be converted again without searching all of bpy.data.
+    Elements are referenced by name. The entries of a material or object are refreshed when it is updated.
+    """
+
+    def __init__(self, blender_scene):
+        self.blender_scene = blender_scene
+
+        # Structure: {texture/node tree/volume name: set of material names}
+        self.texture_users = collections.defaultdict(set)
+        self.nodetree_users = collections.defaultdict(set)
+        self.volume_users = collections.defaultdict(set)
+        # Structure: {material name: set of object names}
+        self.material_users = collections.defaultdict(set)
+
+        # Forward references to remove outdated entries, structure: {material name: MaterialReferences}
+        self.material_references = {}
+        # Structure: {object name: set of material names}
+        self.object_materials = {}
+
+    def build(self):
+        for material in bpy.data.materials:
+            self.update_material(material)
+
+        for obj in self.blender_scene.objects:
+            self.update_object(obj)
+
+    def update_material(self, material):
+        """
+        Indexes the current references of the material.
+        Returns True if the objects using the material have to be converted again (pointiness shape changed).
+        """
+        name = material.name
+        old_references = self.material_references.get(name)
+
+        if old_references is not None:
+            for texture_name in old_references.textures:
+                self.texture_users[texture_name].discard(name)
+            if old_references.nodetree is not None:
+                self.nodetree_users[old_references.nodetree].discard(name)
+            for volume_name in old_references.volumes:
+                self.volume_users[volume_name].discard(name)
+
+        references = self.__find_material_references(material)
+        self.material_references[name] = references
+
+        for texture_name in references.textures:
+            self.texture_users[texture_name].add(name)
+        if references.nodetree is not None:
+            self.nodetree_users[references.nodetree].add(name)
+        for volume_name in references.volumes:
+            self.volume_users[volume_name].add(name)
+
+        return old_references is not None and old_references.uses_pointiness != references.uses_pointiness
+
+    def update_object(self, obj):
+        name = obj.name
+        self.remove_object(name)
+
+        material_names = {slot.material.name for slot in obj.material_slots if slot.material is not None}
+        self.object_materials[name] = material_names
+
+        for material_name in material_names:
+            self.material_users[material_name].add(name)
+
+    def remove_object(self, name):
+        for material_name in self.object_materials.pop(name, ()):
+            self.material_users[material_name].discard(name)
+
+    def get_texture_users(self, texture):
+        return self.__get_materials(self.texture_users.get(texture.name, ()))
+
+    def get_nodetree_users(self, nodetree):
+        return self.__get_materials(self.nodetree_users.get(nodetree.name, ()))
+
+    def get_volume_users(self, volume_names):
+        material_names = set()
+
+        for volume_name in volume_names:
+            material_names.update(self.volume_users.get(volume_name, ()))
+
+        return self.__get_materials(material_names)
+
+    def get_material_users(self, material):
+        objects = []
+
+        for object_name in self.material_users.get(material.name, ()):
+            obj = bpy.data.objects.get(object_name)
+
+            if obj is not None:
+                objects.append(obj)
+
+        return objects
+
+    @staticmethod
+    def __get_materials(material_names):
+        # Names of deleted or renamed materials are skipped
+        materials = []
+
+        for material_name in material_names:
+            material = bpy.data.materials.get(material_name)
+
+            if material is not None:
+                materials.append(material)
+
+        return materials
+
+    def __find_material_references(self, material):
+        lux_material = material.luxrender_material
+        textures = {slot.texture.name for slot in material.texture_slots
+                    if slot is not None and slot.texture is not None}
+        # Textured channels reference the textures by name, see convert_texture_channel()
+        textures.update(texture_name for texture_name in self.__find_texture_names(lux_material)
+                        if texture_name in bpy.data.textures)
+
+        world = self.blender_scene.luxrender_world
+        volumes = {world.default_interior_volume, world.default_exterior_volume}
+
+        if lux_material.nodetree:
+            nodetree = lux_material.nodetree
+            output_node = find_node(material, 'luxrender_material_output_node')
+
+            if output_node is not None:
+                volumes.update((output_node.interior_volume, output_node.exterior_volume))
+
+            # Same check as in ObjectExporter
+            uses_pointiness = find_node(material, 'luxrender_texture_pointiness_node') is not None
+        else:
+            nodetree = None
+            volumes.update((lux_material.Interior_volume, lux_material.Exterior_volume))
+            uses_pointiness = any(slot is not None and slot.texture is not None and
+                                  slot.texture.luxrender_texture.type == 'pointiness'
+                                  for slot in material.texture_slots)
+
+        volumes.discard('')
+        return MaterialReferences(textures, nodetree, volumes, uses_pointiness)
+
+    @staticmethod
+    def __find_texture_names(block):
+        for prop in block.bl_rna.properties:
+            if prop.type == 'STRING' and prop.identifier.endswith('texturename'):
+                texture_name = getattr(block, prop.identifier)
+
+                if texture_name:
+                    yield texture_name
+            elif prop.type == 'POINTER' and prop.identifier != 'rna_type':
+                value = getattr(block, prop.identifier)
+
+                if isinstance(value, bpy.types.PropertyGroup):
+                    yield from DependencyIndex.__find_texture_names(value)
+
+
 def log_exception(luxcore_exporter, message):
     print(message)
     import traceback
@@ -25,12 +25,12 @@
 # ***** END GPL LICENCE BLOCK *****
 #
 
-import math
+import bpy, math
 
 from ...outputs.luxcore_api import pyluxcore
 from ...properties import find_node_in_volume
 
-from .utils import convert_texture_channel, generate_volume_name, log_exception
+from .utils import convert_texture_channel, generate_volume_name, log_exception, rna_fingerprint, node_tree_fingerprint
 
 
 class VolumeExporter(object):
@@ -55,6 +55,29 @@ class VolumeExporter(object):
         return self.properties
 
 
+    def fingerprint(self):
+        """
+        Returns a hashable summary of the volume settings, its node tree and textures. Smoke domains are only
+        referenced by name, so the check does not need to export their densitygrid data.
+        """
+        volume = self.volume
+        node_tree = None
+
+        if volume.nodetree and volume.nodetree in bpy.data.node_groups:
+            node_tree = node_tree_fingerprint(bpy.data.node_groups[volume.nodetree])
+
+        textures = []
+
+        for prop in volume.bl_rna.properties:
+            if prop.type == 'STRING' and prop.identifier.endswith('texturename'):
+                texture_name = getattr(volume, prop.identifier)
+
+                if texture_name in bpy.data.textures:
+                    textures.append((texture_name, rna_fingerprint(bpy.data.textures[texture_name])))
+
+        return rna_fingerprint(volume), node_tree, tuple(textures)
+
+
     def __convert_node_volume(self):
         self.__generate_volume_name(self.volume.name)
 
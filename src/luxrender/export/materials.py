@@ -24,7 +24,7 @@
 #
 # ***** END GPL LICENCE BLOCK *****
 #
-import os
+import collections, os
 
 import bpy
 
@@ -54,23 +54,58 @@ class TextureCounter(object):
         TextureCounter.stack.pop()
 
 
+class ExportRegistry(object):
+    """
+    Ordered registry of named scene items (textures, materials). Items are
+    queued with add() and written by flush(), which only visits the items
+    queued since the last flush. The emitted names keep their export order
+    and support len(), indexing and constant time membership tests.
+    """
+
+    def __init__(self):
+        self.pending = collections.OrderedDict()  # name -> arguments of the export call
+        self.emitted = []
+        self.emitted_index = set()
+
+    def __contains__(self, name):
+        return name in self.emitted_index
+
+    def __len__(self):
+        return len(self.emitted)
+
+    def __getitem__(self, index):
+        return self.emitted[index]
+
+    def __iter__(self):
+        return iter(self.emitted)
+
+    def append(self, name):
+        self.emitted.append(name)
+        self.emitted_index.add(name)
+
+    def add(self, name, *args):
+        # The first definition queued for a name wins
+        if name not in self.emitted_index and name not in self.pending:
+            self.pending[name] = args
+
+    def flush(self, export_function):
+        pending = self.pending
+        self.pending = collections.OrderedDict()
+
+        for name, args in pending.items():
+            export_function(name, *args)
+            self.append(name)
+
+
 class ExportedTextures(object):
     # static class variables
-    texture_names = []  # Name
-    texture_types = []  # Float|Color
-    texture_texts = []  # Texture plugin name
-    texture_psets = []  # ParamSets
-    exported_texture_names = []
+    exported_texture_names = ExportRegistry()  # Name -> (Float|Color, texture plugin name, ParamSet)
     scalers_count = 0
 
     @staticmethod
     def clear():
         TextureCounter.reset()
-        ExportedTextures.texture_names = []
-        ExportedTextures.texture_types = []
-        ExportedTextures.texture_texts = []
-        ExportedTextures.texture_psets = []
-        ExportedTextures.exported_texture_names = []
+        ExportedTextures.exported_texture_names = ExportRegistry()
         ExportedTextures.scalers_count = 0
 
     @staticmethod
@@ -85,23 +120,12 @@ class ExportedTextures(object):
             ExportedTextures.exported_texture_names.append(name)
             return
 
-        if name not in ExportedTextures.exported_texture_names:
-            ExportedTextures.texture_names.append(name)
-            ExportedTextures.texture_types.append(type)
-            ExportedTextures.texture_texts.append(texture)
-            ExportedTextures.texture_psets.append(params)
+        ExportedTextures.exported_texture_names.add(name, type, texture, params)
 
     @staticmethod
     def export_new(lux_context):
-        for n, ty, tx, p in zip(
-                ExportedTextures.texture_names,
-                ExportedTextures.texture_types,
-                ExportedTextures.texture_texts,
-                ExportedTextures.texture_psets
-        ):
-            if lux_context.API_TYPE != 'PURE' and n not in ExportedTextures.exported_texture_names:
-                lux_context.texture(n, ty, tx, p)
-                ExportedTextures.exported_texture_names.append(n)
+        if lux_context.API_TYPE != 'PURE':
+            ExportedTextures.exported_texture_names.flush(lux_context.texture)
 
 
 class MaterialCounter(object):
@@ -126,16 +150,12 @@ class MaterialCounter(object):
 
 class ExportedMaterials(object):
     # Static class variables
-    material_names = []
-    material_psets = []
-    exported_material_names = []
+    exported_material_names = ExportRegistry()  # Name -> (ParamSet,)
 
     @staticmethod
     def clear():
         MaterialCounter.reset()
-        ExportedMaterials.material_names = []
-        ExportedMaterials.material_psets = []
-        ExportedMaterials.exported_material_names = []
+        ExportedMaterials.exported_material_names = ExportRegistry()
 
     @staticmethod
     def makeNamedMaterial(lux_context, name, paramset):
@@ -143,16 +163,12 @@ class ExportedMaterials(object):
             lux_context.makeNamedMaterial(name, paramset)
             return
 
-        if name not in ExportedMaterials.exported_material_names:
-            ExportedMaterials.material_names.append(name)
-            ExportedMaterials.material_psets.append(paramset)
+        ExportedMaterials.exported_material_names.add(name, paramset)
 
     @staticmethod
     def export_new_named(lux_context):
-        for n, p in zip(ExportedMaterials.material_names, ExportedMaterials.material_psets):
-            if lux_context.API_TYPE != 'PURE' and n not in ExportedMaterials.exported_material_names:
-                lux_context.makeNamedMaterial(n, p)
-                ExportedMaterials.exported_material_names.append(n)
+        if lux_context.API_TYPE != 'PURE':
+            ExportedMaterials.exported_material_names.flush(lux_context.makeNamedMaterial)
 
 
 def get_instance_materials(ob):
@@ -0,0 +1,653 @@
+# -*- coding: utf8 -*-
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# --------------------------------------------------------------------------
+# Blender 2.5 LuxRender Add-On
+# --------------------------------------------------------------------------
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ***** END GPL LICENCE BLOCK *****
+#
+"""
+Bulk (array based) access to tessellated mesh data for the mesh writers
+"""
+import array, contextlib, hashlib, os, struct, threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Only needs the standard library (and numpy, if available), so the PLY
+# encoding can be tested without Blender. The missing numpy warning is
+# logged by the export package.
+try:
+    import numpy
+
+    NUMPY_AVAILABLE = True
+    NUMPY_IMPORT_ERROR = None
+except ImportError as err:
+    NUMPY_AVAILABLE = False
+    NUMPY_IMPORT_ERROR = err
+
+
+PLY_COMMENT = b'comment Created by LuxBlend 2.6 exporter for LuxRender - www.luxrender.net\n'
+
+
+@contextlib.contextmanager
+def replace_file(file_path):
+    """
+    Open file_path for binary writing through a temporary file in the same
+    directory, which replaces file_path once it is completely written.
+
+    Writing in place would change every hard link of the old file, e.g. the
+    PLY cache entry and the other frames it was handed out to.
+    """
+
+    temp_path = '%s.%d.%d.tmp' % (file_path, os.getpid(), threading.get_ident())
+
+    try:
+        with open(temp_path, 'wb') as f:
+            yield f
+
+        os.replace(temp_path, file_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+        raise
+
+
+def ply_header(num_vertices, num_faces, has_uv=False, has_vertex_colors=False):
+    """
+    num_vertices		int
+    num_faces			int
+    has_uv				bool
+    has_vertex_colors	bool
+
+    Returns bytes, the header of a binary PLY file as written by the exporter
+    """
+
+    header = [
+        b'ply\n',
+        b'format binary_little_endian 1.0\n',
+        PLY_COMMENT,
+        ('element vertex %d\n' % num_vertices).encode(),
+        b'property float x\n',
+        b'property float y\n',
+        b'property float z\n',
+        b'property float nx\n',
+        b'property float ny\n',
+        b'property float nz\n',
+    ]
+
+    if has_uv:
+        header.append(b'property float s\n')
+        header.append(b'property float t\n')
+
+    if has_vertex_colors:
+        header.append(b'property uchar red\n')
+        header.append(b'property uchar green\n')
+        header.append(b'property uchar blue\n')
+
+    header.append(('element face %d\n' % num_faces).encode())
+    header.append(b'property list uchar uint vertex_indices\n')
+    header.append(b'end_header\n')
+
+    return b''.join(header)
+
+
+def triangle_mesh_ply_blocks(points, normals, uvs, indices):
+    """
+    points				sequence of 3 floats per vertex
+    normals				sequence of 3 floats per vertex
+    uvs					sequence of 2 floats per vertex, empty or None
+    indices				sequence of 3 vertex indices per triangle
+
+    Encode the arrays of a native "mesh" shape as binary PLY
+
+    Returns list of bytes blocks, to be written one after the other
+    """
+
+    num_vertices = len(points) // 3
+    num_triangles = len(indices) // 3
+    has_uv = uvs is not None and len(uvs) > 0
+
+    header = ply_header(num_vertices, num_triangles, has_uv)
+
+    if NUMPY_AVAILABLE:
+        columns = [numpy.asarray(points, dtype=numpy.float32).reshape(-1, 3),
+                   numpy.asarray(normals, dtype=numpy.float32).reshape(-1, 3)]
+        if has_uv:
+            columns.append(numpy.asarray(uvs, dtype=numpy.float32).reshape(-1, 2))
+
+        vertex_block = numpy.hstack(columns).astype('<f4').tobytes()
+
+        faces = numpy.empty(num_triangles, dtype=[('count', 'u1'), ('indices', '<u4', 3)])
+        faces['count'] = 3
+        faces['indices'] = numpy.asarray(indices, dtype=numpy.uint32).reshape(-1, 3)
+        face_block = faces.tobytes()
+    else:
+        vertex_values = []
+        for v in range(num_vertices):
+            vertex_values.extend(points[3 * v:3 * v + 3])
+            vertex_values.extend(normals[3 * v:3 * v + 3])
+            if has_uv:
+                vertex_values.extend(uvs[2 * v:2 * v + 2])
+
+        vertex_block = struct.pack('<%df' % len(vertex_values), *vertex_values)
+        face_block = b''.join(struct.pack('<B3I', 3, *indices[3 * t:3 * t + 3]) for t in range(num_triangles))
+
+    return [header, vertex_block, face_block]
+
+
+def split_by_material(material_indices):
+    """
+    Group face indices by material index with one stable sort
+
+    Returns dict of material index -> array of face indices in mesh order,
+    for the material indices that are used by at least one face
+    """
+
+    if len(material_indices) == 0:
+        return {}
+
+    order = numpy.argsort(material_indices, kind='mergesort')
+    counts = numpy.bincount(material_indices)
+    used = numpy.flatnonzero(counts)
+
+    return dict(zip(used.tolist(), numpy.split(order, numpy.cumsum(counts[used])[:-1])))
+
+
+def split_faces_by_material(mesh):
+    """
+    Group the tessfaces of a mesh by material index, reading only the
+    material indices of the faces
+
+    Returns dict of material index -> array of face indices in mesh order
+    """
+
+    material_indices = numpy.empty(len(mesh.tessfaces), dtype=numpy.int32)
+    mesh.tessfaces.foreach_get('material_index', material_indices)
+
+    return split_by_material(material_indices)
+
+
+class TessfaceArrays(object):
+    """
+    Copy of the tessface data of a mesh, read with foreach_get instead
+    of walking the faces one by one in Python.
+
+    uv_layer and vertex_color_layer are the .data collections of the
+    tessface UV / vertex color layers to export, or None.
+    """
+
+    def __init__(self, mesh, uv_layer=None, vertex_color_layer=None):
+        num_verts = len(mesh.vertices)
+        num_faces = len(mesh.tessfaces)
+
+        self.co = numpy.empty(num_verts * 3, dtype=numpy.float32)
+        mesh.vertices.foreach_get('co', self.co)
+        self.co.shape = (num_verts, 3)
+
+        self.normals = numpy.empty(num_verts * 3, dtype=numpy.float32)
+        mesh.vertices.foreach_get('normal', self.normals)
+        self.normals.shape = (num_verts, 3)
+
+        # vertices_raw always has 4 entries, the 4th vertex index of a
+        # triangle is 0 (Blender never stores a quad with v4 == 0)
+        self.face_verts = numpy.empty(num_faces * 4, dtype=numpy.int32)
+        mesh.tessfaces.foreach_get('vertices_raw', self.face_verts)
+        self.face_verts.shape = (num_faces, 4)
+        self.face_sizes = numpy.where(self.face_verts[:, 3] != 0, 4, 3)
+
+        self.face_normals = numpy.empty(num_faces * 3, dtype=numpy.float32)
+        mesh.tessfaces.foreach_get('normal', self.face_normals)
+        self.face_normals.shape = (num_faces, 3)
+
+        use_smooth = [False] * num_faces
+        mesh.tessfaces.foreach_get('use_smooth', use_smooth)
+        self.use_smooth = numpy.array(use_smooth, dtype=bool)
+
+        self.material_indices = numpy.empty(num_faces, dtype=numpy.int32)
+        mesh.tessfaces.foreach_get('material_index', self.material_indices)
+
+        self.uvs = None
+        if uv_layer is not None:
+            self.uvs = numpy.empty(num_faces * 8, dtype=numpy.float32)
+            uv_layer.foreach_get('uv_raw', self.uvs)
+            self.uvs.shape = (num_faces, 4, 2)
+
+        self.colors = None
+        if vertex_color_layer is not None:
+            # Same conversion as int(255 * c) on the single color values
+            colors = numpy.empty((4, num_faces * 3), dtype=numpy.float32)
+            for j in range(4):
+                vertex_color_layer.foreach_get('color%d' % (j + 1), colors[j])
+            colors = (colors.astype(numpy.float64) * 255).astype(numpy.uint8)
+            self.colors = colors.reshape(4, num_faces, 3).transpose(1, 0, 2)
+
+        self.mesh_digest = None
+
+    def part_digest(self, material_index):
+        """
+        Hash of all data that goes into the PLY file of one material part,
+        used as key for the PLY cache
+        """
+
+        if self.mesh_digest is None:
+            h = hashlib.sha1(PLY_COMMENT)
+
+            for a in (self.co, self.normals, self.face_verts, self.face_normals, self.use_smooth,
+                      self.material_indices, self.uvs, self.colors):
+                if a is None:
+                    h.update(b'-')
+                else:
+                    h.update(repr(a.shape).encode())
+                    h.update(numpy.ascontiguousarray(a).tobytes())
+
+            self.mesh_digest = h.digest()
+
+        h = hashlib.sha1(self.mesh_digest)
+        h.update(('m%d' % material_index).encode())
+
+        return h.hexdigest()
+
+
+class MeshPart(object):
+    """
+    The exported vertices and faces of a set of tessfaces (usually all faces
+    using one material index).
+
+    Vertices of smooth shaded faces are shared between faces if all of their
+    exported attributes are equal, vertices of flat shaded faces are never
+    shared. Vertices are numbered in order of first use, so the result is the
+    same as the one of the per-face export loop.
+    """
+
+    def __init__(self, arrays, faces):
+        self.faces = faces
+        self.face_sizes = arrays.face_sizes[faces]
+
+        # One entry per face corner
+        num_corners = int(self.face_sizes.sum())
+        face_starts = numpy.cumsum(self.face_sizes) - self.face_sizes
+        corner_face = numpy.repeat(faces, self.face_sizes)
+        corner_slot = numpy.arange(num_corners) - numpy.repeat(face_starts, self.face_sizes)
+        corner_vert = arrays.face_verts[corner_face, corner_slot]
+        corner_smooth = arrays.use_smooth[corner_face]
+
+        fields = [('co', '<f4', 3), ('no', '<f4', 3)]
+        if arrays.uvs is not None:
+            fields.append(('uv', '<f4', 2))
+        if arrays.colors is not None:
+            fields.append(('vc', 'u1', 3))
+
+        corners = numpy.empty(num_corners, dtype=numpy.dtype(fields))
+        corners['co'] = arrays.co[corner_vert]
+        corners['no'] = numpy.where(corner_smooth[:, None], arrays.normals[corner_vert],
+                                    arrays.face_normals[corner_face])
+        if arrays.uvs is not None:
+            corners['uv'] = arrays.uvs[corner_face, corner_slot]
+        if arrays.colors is not None:
+            corners['vc'] = arrays.colors[corner_face, corner_slot]
+
+        # Each corner points to the first corner with identical data
+        first_use = numpy.arange(num_corners)
+        smooth_corners = numpy.flatnonzero(corner_smooth)
+
+        if len(smooth_corners) > 0:
+            keys = corners[smooth_corners]
+            # Compare values rather than bits, so that -0.0 == 0.0
+            for name in ('co', 'no', 'uv'):
+                if name in keys.dtype.names:
+                    keys[name] += 0.0
+
+            keys = keys.view(numpy.dtype((numpy.void, keys.dtype.itemsize)))
+            _, first, inverse = numpy.unique(keys, return_index=True, return_inverse=True)
+            first_use[smooth_corners] = smooth_corners[first][inverse.ravel()]
+
+        is_new = first_use == numpy.arange(num_corners)
+        vert_indices = numpy.cumsum(is_new) - 1
+
+        self.vertices = corners[is_new]
+        self.corner_indices = vert_indices[first_use].astype(numpy.uint32)
+
+    def __len__(self):
+        return len(self.faces)
+
+    @property
+    def has_uv(self):
+        return 'uv' in self.vertices.dtype.names
+
+    @property
+    def has_vertex_colors(self):
+        return 'vc' in self.vertices.dtype.names
+
+    def triangle_indices(self):
+        """
+        Vertex indices of the faces split into triangles, a quad (0, 1, 2, 3)
+        becomes (0, 1, 2) and (0, 2, 3)
+        """
+
+        num_faces = len(self.faces)
+        face_starts = numpy.cumsum(self.face_sizes) - self.face_sizes
+
+        triangles = numpy.empty((num_faces, 2, 3), dtype=numpy.int64)
+        triangles[:, 0] = face_starts[:, None] + numpy.array([0, 1, 2])
+        triangles[:, 1] = face_starts[:, None] + numpy.array([0, 2, 3])
+
+        used = numpy.ones((num_faces, 2), dtype=bool)
+        used[:, 1] = self.face_sizes == 4
+
+        return self.corner_indices[triangles[used]].ravel()
+
+    def native_arrays(self):
+        """
+        Data for a LuxRender "mesh" shape
+
+        Returns array.array objects of points, normals, uvs (None if the
+        mesh has no UV layer) and triangle vertex indices
+        """
+
+        def to_array(typecode, values, dtype):
+            return array.array(typecode, numpy.ascontiguousarray(values, dtype=dtype).tobytes())
+
+        points = to_array('f', self.vertices['co'], numpy.float32)
+        normals = to_array('f', self.vertices['no'], numpy.float32)
+        uvs = to_array('f', self.vertices['uv'], numpy.float32) if self.has_uv else None
+        indices = to_array('i', self.triangle_indices(), numpy.int32)
+
+        return points, normals, uvs, indices
+
+    def ply_header(self):
+        return ply_header(len(self.vertices), len(self.faces), self.has_uv, self.has_vertex_colors)
+
+    def ply_vertex_block(self):
+        return self.vertices.tobytes()
+
+    def ply_face_block(self):
+        """
+        Every face is stored as uchar vertex count followed by the uint
+        vertex indices, so triangles and quads have a different size
+        """
+        record_sizes = 1 + 4 * self.face_sizes
+        record_starts = numpy.cumsum(record_sizes) - record_sizes
+
+        block = numpy.empty(int(record_sizes.sum()), dtype=numpy.uint8)
+        block[record_starts] = self.face_sizes
+
+        corner_starts = numpy.repeat(record_starts + 1, self.face_sizes)
+        corner_starts += 4 * (numpy.arange(len(self.corner_indices)) -
+                              numpy.repeat(numpy.cumsum(self.face_sizes) - self.face_sizes, self.face_sizes))
+        index_bytes = self.corner_indices.astype('<u4').view(numpy.uint8).reshape(-1, 4)
+        block[corner_starts[:, None] + numpy.arange(4)] = index_bytes
+
+        return block.tobytes()
+
+    def ply_blocks(self):
+        return [self.ply_header(), self.ply_vertex_block(), self.ply_face_block()]
+
+    def write_ply(self, ply_path):
+        with replace_file(ply_path) as ply:
+            for block in self.ply_blocks():
+                ply.write(block)
+
+
+class PLYFileWriter(object):
+    """
+    Write finished PLY file contents to disk on a pool of worker threads, so that
+    the exporter can go on with the next object while the last one is still
+    being written.
+
+    At most max_pending_bytes of data are held in memory, submit() blocks
+    until enough of the queued writes are done. Every written file is
+    reported through log.
+    """
+
+    def __init__(self, max_workers=None, max_pending_bytes=256 * 1024 * 1024, log=print):
+        if max_workers is None:
+            max_workers = min(4, os.cpu_count() or 1)
+
+        self.log = log
+        self.max_pending_bytes = max_pending_bytes
+        self.pending_bytes = 0
+        self.pending_lock = threading.Condition()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.jobs = []
+
+    def submit(self, file_path, blocks, owner=None):
+        """
+        file_path			string
+        blocks				list of bytes
+        owner				any object, handed back by wait() if the write fails
+
+        Queue the given blocks for writing to file_path
+
+        Returns None
+        """
+
+        size = sum(len(b) for b in blocks)
+
+        with self.pending_lock:
+            # A single file larger than the budget is still written, alone
+            while self.pending_bytes > 0 and self.pending_bytes + size > self.max_pending_bytes:
+                self.pending_lock.wait()
+
+            self.pending_bytes += size
+
+        future = self.executor.submit(self._write, file_path, blocks, size)
+        self.jobs.append((owner, file_path, future))
+
+    def _write(self, file_path, blocks, size):
+        try:
+            with replace_file(file_path) as f:
+                for block in blocks:
+                    f.write(block)
+        finally:
+            del blocks[:]
+
+            with self.pending_lock:
+                self.pending_bytes -= size
+                self.pending_lock.notify_all()
+
+        self.log('Binary PLY file written: %s' % file_path)
+
+    def wait(self):
+        """
+        Block until all queued files are written
+
+        Returns list of (owner, file_path, exception) for every failed write
+        """
+
+        failed = []
+
+        for owner, file_path, future in self.jobs:
+            err = future.exception()
+
+            if err is not None:
+                failed.append((owner, file_path, err))
+
+        self.jobs = []
+
+        return failed
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+def write_ply_per_face(mesh, faces, uv_layer, vertex_color_layer, ply_path):
+    """
+    Slow export of one mesh part to a binary PLY file, walking the faces one
+    by one. Only used if numpy is not available.
+    """
+    # Here we work out exactly which vert+normal combinations
+    # we need to export. This is done first, and the export
+    # combinations cached before writing to file because the
+    # number of verts needed needs to be written in the header
+    # and that number is not known before this is done.
+
+    # Export data
+    co_no_uv_vc_cache = []
+    face_vert_indices = {}  # mapping of face index to list of exported vert indices for that face
+
+    # Caches
+    # mapping of vert index to exported vert index for verts with vert normals
+
+    vert_vno_indices = {}
+    vert_use_vno = set()  # Set of vert indices that use vert normals
+    vert_index = 0  # exported vert index
+
+    c1 = c2 = c3 = c4 = None
+
+    for face in faces:
+        fvi = []
+        if vertex_color_layer:
+            c1 = vertex_color_layer[face.index].color1
+            c2 = vertex_color_layer[face.index].color2
+            c3 = vertex_color_layer[face.index].color3
+            c4 = vertex_color_layer[face.index].color4
+
+        for j, vertex in enumerate(face.vertices):
+            v = mesh.vertices[vertex]
+
+            if vertex_color_layer:
+                if j == 0:
+                    vert_col = c1
+                elif j == 1:
+                    vert_col = c2
+                elif j == 2:
+                    vert_col = c3
+                elif j == 3:
+                    vert_col = c4
+
+            if face.use_smooth:
+                if uv_layer:
+                    if vertex_color_layer:
+                        vert_data = (v.co[:], v.normal[:], uv_layer[face.index].uv[j][:],
+                                     (int(255 * vert_col[0]),
+                                      int(255 * vert_col[1]),
+                                      int(255 * vert_col[2]))[:])
+                    else:
+                        vert_data = (v.co[:], v.normal[:], uv_layer[face.index].uv[j][:])
+                else:
+                    if vertex_color_layer:
+                        vert_data = (v.co[:], v.normal[:],
+                                     (int(255 * vert_col[0]),
+                                      int(255 * vert_col[1]),
+                                      int(255 * vert_col[2]))[:])
+                    else:
+                        vert_data = (v.co[:], v.normal[:])
+
+                if vert_data not in vert_use_vno:
+                    vert_use_vno.add(vert_data)
+
+                    co_no_uv_vc_cache.append(vert_data)
+
+                    vert_vno_indices[vert_data] = vert_index
+                    fvi.append(vert_index)
+
+                    vert_index += 1
+                else:
+                    fvi.append(vert_vno_indices[vert_data])
+            else:
+                if uv_layer:
+                    if vertex_color_layer:
+                        vert_data = (v.co[:], face.normal[:], uv_layer[face.index].uv[j][:],
+                                     (int(255 * vert_col[0]),
+                                      int(255 * vert_col[1]),
+                                      int(255 * vert_col[2]))[:])
+                    else:
+                        vert_data = (v.co[:], face.normal[:], uv_layer[face.index].uv[j][:])
+                else:
+                    if vertex_color_layer:
+                        vert_data = (v.co[:], face.normal[:],
+                                     (int(255 * vert_col[0]),
+                                      int(255 * vert_col[1]),
+                                      int(255 * vert_col[2]))[:])
+                    else:
+                        vert_data = (v.co[:], face.normal[:])
+
+                # All face-vert-co-no are unique, we cannot
+                # cache them
+                co_no_uv_vc_cache.append(vert_data)
+                fvi.append(vert_index)
+                vert_index += 1
+
+        face_vert_indices[face.index] = fvi
+
+    del vert_vno_indices
+    del vert_use_vno
+
+    with replace_file(ply_path) as ply:
+        ply.write(b'ply\n')
+        ply.write(b'format binary_little_endian 1.0\n')
+        ply.write(b'comment Created by LuxBlend 2.6 exporter for LuxRender - www.luxrender.net\n')
+
+        # vert_index == the number of actual verts needed
+        ply.write(('element vertex %d\n' % vert_index).encode())
+        ply.write(b'property float x\n')
+        ply.write(b'property float y\n')
+        ply.write(b'property float z\n')
+
+        ply.write(b'property float nx\n')
+        ply.write(b'property float ny\n')
+        ply.write(b'property float nz\n')
+
+        if uv_layer:
+            ply.write(b'property float s\n')
+            ply.write(b'property float t\n')
+
+        if vertex_color_layer:
+            ply.write(b'property uchar red\n')
+            ply.write(b'property uchar green\n')
+            ply.write(b'property uchar blue\n')
+
+        ply.write(('element face %d\n' % len(faces)).encode())
+        ply.write(b'property list uchar uint vertex_indices\n')
+
+        ply.write(b'end_header\n')
+
+        # dump cached co/no/uv/vc
+        if uv_layer:
+            if vertex_color_layer:
+                for co, no, uv, vc in co_no_uv_vc_cache:
+                    ply.write(struct.pack('<3f', *co))
+                    ply.write(struct.pack('<3f', *no))
+                    ply.write(struct.pack('<2f', *uv))
+                    ply.write(struct.pack('<3B', *vc))
+            else:
+                for co, no, uv in co_no_uv_vc_cache:
+                    ply.write(struct.pack('<3f', *co))
+                    ply.write(struct.pack('<3f', *no))
+                    ply.write(struct.pack('<2f', *uv))
+        else:
+            if vertex_color_layer:
+                for co, no, vc in co_no_uv_vc_cache:
+                    ply.write(struct.pack('<3f', *co))
+                    ply.write(struct.pack('<3f', *no))
+                    ply.write(struct.pack('<3B', *vc))
+            else:
+                for co, no in co_no_uv_vc_cache:
+                    ply.write(struct.pack('<3f', *co))
+                    ply.write(struct.pack('<3f', *no))
+
+        # dump face vert indices
+        for face in faces:
+            lfvi = len(face_vert_indices[face.index])
+            ply.write(struct.pack('<B', lfvi))
+            ply.write(struct.pack('<%dI' % lfvi, *face_vert_indices[face.index]))
+
+        del co_no_uv_vc_cache
+        del face_vert_indices
@@ -0,0 +1,167 @@
+# -*- coding: utf8 -*-
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# --------------------------------------------------------------------------
+# Blender 2.5 LuxRender Add-On
+# --------------------------------------------------------------------------
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ***** END GPL LICENCE BLOCK *****
+#
+"""
+Content addressed store of exported PLY files, shared by all frames and
+Blender sessions that export to the same directory
+"""
+import collections, json, os, shutil
+
+
+class PLYCache(object):
+    """
+    PLY files are stored as <key>.ply in cache_dir, where key is a hash
+    of the mesh data they were written from. The index file keeps the
+    entries in least recently used order; the oldest entries are dropped
+    when the total size grows above max_size bytes.
+
+    Files are handed out as hard links (or copies, if the filesystem does
+    not support links), so evicting an entry never breaks the scene files
+    of earlier exports.
+
+    Warnings are reported through log, so the cache does not depend on
+    Blender (see tests/test_plycache.py).
+    """
+
+    INDEX_FILENAME = 'index.json'
+    INDEX_VERSION = 1
+
+    # One instance per cache directory, kept for the whole Blender session
+    caches = {}
+
+    @staticmethod
+    def get(cache_dir, max_size, log=print):
+        cache_dir = os.path.normpath(cache_dir)
+
+        if cache_dir not in PLYCache.caches:
+            PLYCache.caches[cache_dir] = PLYCache(cache_dir, log)
+
+        cache = PLYCache.caches[cache_dir]
+        cache.max_size = max_size
+
+        return cache
+
+    def __init__(self, cache_dir, log=print):
+        self.cache_dir = cache_dir
+        self.log = log
+        self.max_size = 0
+        self.entries = collections.OrderedDict()  # key -> file size, least recently used first
+        self.load()
+
+    def file_path(self, key):
+        return os.path.join(self.cache_dir, '%s.ply' % key)
+
+    def load(self):
+        self.entries.clear()
+
+        try:
+            with open(os.path.join(self.cache_dir, self.INDEX_FILENAME), 'r') as index_file:
+                index = json.load(index_file)
+        except (OSError, ValueError):
+            return
+
+        if index.get('version') != self.INDEX_VERSION:
+            return
+
+        for key, size in index.get('entries', []):
+            if os.path.exists(self.file_path(key)):
+                self.entries[key] = size
+
+    def save(self):
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        index_path = os.path.join(self.cache_dir, self.INDEX_FILENAME)
+        temp_path = index_path + '.tmp'
+
+        with open(temp_path, 'w') as index_file:
+            json.dump({
+                'version': self.INDEX_VERSION,
+                'entries': [[key, size] for key, size in self.entries.items()],
+            }, index_file)
+
+        os.replace(temp_path, index_path)
+
+    def fetch(self, key, ply_path):
+        """
+        Place the cached file for key at ply_path
+
+        Returns True on a cache hit
+        """
+
+        if key not in self.entries:
+            return False
+
+        try:
+            self.link(self.file_path(key), ply_path)
+        except OSError as err:
+            self.log('WARNING: cannot reuse cached PLY file %s: %s' % (self.file_path(key), err))
+            del self.entries[key]
+            return False
+
+        self.entries.move_to_end(key)
+        return True
+
+    def store(self, key, ply_path):
+        """
+        Add an already written PLY file to the cache
+        """
+
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return
+
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        try:
+            self.link(ply_path, self.file_path(key))
+        except OSError as err:
+            self.log('WARNING: cannot add %s to the PLY cache: %s' % (ply_path, err))
+            return
+
+        self.entries[key] = os.path.getsize(ply_path)
+        self.evict()
+
+    def evict(self):
+        total_size = sum(self.entries.values())
+
+        # Never drop the entry that was just added
+        while total_size > self.max_size and len(self.entries) > 1:
+            key, size = self.entries.popitem(last=False)
+            total_size -= size
+
+            try:
+                os.remove(self.file_path(key))
+            except OSError:
+                pass
+
+    @staticmethod
+    def link(src_path, dest_path):
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+
+        try:
+            os.link(src_path, dest_path)
+        except OSError:
+            shutil.copyfile(src_path, dest_path)
@@ -433,54 +433,58 @@ def preview_scene(scene, lux_context, obj=None, mat=None, tex=None):
             GE.is_preview = True
             GE.geometry_scene = scene
 
-            for mesh_mat, mesh_name, mesh_type, mesh_params in GE.buildNativeMesh(obj):
-                if tex is not None:
-                    lux_context.transformBegin()
-                    lux_context.identity()
-                    texture_name = export_preview_texture(lux_context, tex)
-                    lux_context.transformEnd()
-
-                    lux_context.material('matte', ParamSet().add_texture('Kd', texture_name))
-                else:
-                    mat.luxrender_material.export(scene, lux_context, mat, mode='direct')
-                    int_v, ext_v = get_material_volume_defs(mat)
+            try:
+                for mesh_mat, mesh_name, mesh_type, mesh_params in GE.buildNativeMesh(obj):
+                    if tex is not None:
+                        lux_context.transformBegin()
+                        lux_context.identity()
+                        texture_name = export_preview_texture(lux_context, tex)
+                        lux_context.transformEnd()
+
+                        lux_context.material('matte', ParamSet().add_texture('Kd', texture_name))
+                    else:
+                        mat.luxrender_material.export(scene, lux_context, mat, mode='direct')
+                        int_v, ext_v = get_material_volume_defs(mat)
 
-                    if int_v or ext_v:
-                        if int_v:
-                            lux_context.interior(int_v)
+                        if int_v or ext_v:
+                            if int_v:
+                                lux_context.interior(int_v)
 
-                        if ext_v:
-                            lux_context.exterior(ext_v)
+                            if ext_v:
+                                lux_context.exterior(ext_v)
 
-                    if not int_v and bl_scene.luxrender_world.default_interior_volume:
-                        lux_context.interior(bl_scene.luxrender_world.default_interior_volume)
+                        if not int_v and bl_scene.luxrender_world.default_interior_volume:
+                            lux_context.interior(bl_scene.luxrender_world.default_interior_volume)
 
-                    if not ext_v and bl_scene.luxrender_world.default_exterior_volume:
-                        lux_context.exterior(bl_scene.luxrender_world.default_exterior_volume)
+                        if not ext_v and bl_scene.luxrender_world.default_exterior_volume:
+                            lux_context.exterior(bl_scene.luxrender_world.default_exterior_volume)
 
-                    output_node = find_node(mat, 'luxrender_material_output_node')
+                        output_node = find_node(mat, 'luxrender_material_output_node')
 
-                    if mat.luxrender_material.nodetree:
-                        object_is_emitter = False
+                        if mat.luxrender_material.nodetree:
+                            object_is_emitter = False
 
-                        if output_node is not None:
-                            light_socket = output_node.inputs['Emission']
+                            if output_node is not None:
+                                light_socket = output_node.inputs['Emission']
 
-                            if light_socket.is_linked:
-                                light_node = light_socket.links[0].from_node
-                                object_is_emitter = light_socket.is_linked
-                    else:
-                        object_is_emitter = hasattr(mat, 'luxrender_emission') and mat.luxrender_emission.use_emission
-
-                    if object_is_emitter:
-                        if not mat.luxrender_material.nodetree:
-                            # lux_context.lightGroup(mat.luxrender_emission.lightgroup, [])
-                            lux_context.areaLightSource(*mat.luxrender_emission.api_output(obj))
+                                if light_socket.is_linked:
+                                    light_node = light_socket.links[0].from_node
+                                    object_is_emitter = light_socket.is_linked
                         else:
-                            tex_maker = luxrender_texture_maker(lux_context, mat.luxrender_material.nodetree)
-                            lux_context.areaLightSource(*light_node.export(tex_maker.make_texture))
-
-                lux_context.shape(mesh_type, mesh_params)
+                            object_is_emitter = hasattr(mat, 'luxrender_emission') and mat.luxrender_emission.use_emission
+
+                        if object_is_emitter:
+                            if not mat.luxrender_material.nodetree:
+                                # lux_context.lightGroup(mat.luxrender_emission.lightgroup, [])
+                                lux_context.areaLightSource(*mat.luxrender_emission.api_output(obj))
+                            else:
+                                tex_maker = luxrender_texture_maker(lux_context, mat.luxrender_material.nodetree)
+                                lux_context.areaLightSource(*light_node.export(tex_maker.make_texture))
+
+                    lux_context.shape(mesh_type, mesh_params)
+            finally:
+                # Large meshes are written to PLY files in the background
+                GE.waitForPLYFiles()
         else:
             lux_context.shape('sphere', ParamSet().add_float('radius', 1.0))
 
@@ -39,7 +39,7 @@ from ..export import materials    as export_materials
 from ..export import geometry        as export_geometry
 from ..export import volumes        as export_volumes
 from ..export import fix_matrix_order
-from ..export import is_obj_visible
+from ..export import is_obj_visible, VisibilityIndex, WorldScale, MotionSampleCache
 from ..outputs import LuxManager, LuxLog
 from ..outputs.file_api import Files
 from ..outputs.pure_api import LUXRENDER_VERSION
@@ -149,6 +149,9 @@ class SceneExporter(object):
             # Force scene update; NB, scene.update() doesn't work
             scene.frame_set(scene.frame_current)
 
+            # Layers cannot change from here on, so visibility is only computed once per object
+            VisibilityIndex.begin(scene)
+
             # Set up the rendering context
             self.report({'INFO'}, 'Creating LuxRender context')
             created_lux_manager = False
@@ -163,6 +166,12 @@ class SceneExporter(object):
             LuxManager.SetCurrentScene(scene)
             lux_context = LuxManager.GetActive().lux_context
 
+            # The world scale cannot change during the export either
+            WorldScale.begin()
+
+            # Step through the motion blur subframes once for all objects and the camera
+            MotionSampleCache.begin(scene)
+
             GE = export_geometry.GeometryExporter(lux_context, scene)
 
             if not self.scene_is_lit(GE):
@@ -315,3 +324,7 @@ class SceneExporter(object):
                 raise err
 
             return {'CANCELLED'}
+        finally:
+            VisibilityIndex.end()
+            WorldScale.end()
+            MotionSampleCache.end()
@@ -26,12 +26,14 @@
 #
 # Blender Libs
 import bpy, bl_operators
-import os, struct, mathutils
+import os, mathutils
 
 # LuxRender Libs
 from .. import LuxRenderAddon
 from ..outputs import LuxManager
 from ..export.scene import SceneExporter
+from ..export.meshdata import NUMPY_AVAILABLE, TessfaceArrays, MeshPart
+from ..export.meshdata import split_faces_by_material, write_ply_per_face
 
 from ..extensions_framework import util as efutil
 
@@ -277,15 +279,17 @@ class LUXRENDER_OT_export_luxrender_proxy(bpy.types.Operator):
             print('[Object: %s] Exporting PLY...' % obj.name)
 
             # Collate faces by mat index
-            ffaces_mats = {}
-            mesh_faces = mesh.tessfaces
+            if NUMPY_AVAILABLE:
+                ffaces_mats = split_faces_by_material(mesh)
+            else:
+                ffaces_mats = {}
 
-            for f in mesh_faces:
-                mi = f.material_index
+                for f in mesh.tessfaces:
+                    mi = f.material_index
 
-                if mi not in ffaces_mats.keys():
-                    ffaces_mats[mi] = []
-                ffaces_mats[mi].append(f)
+                    if mi not in ffaces_mats.keys():
+                        ffaces_mats[mi] = []
+                    ffaces_mats[mi].append(f)
 
             material_indices = ffaces_mats.keys()
             number_of_mats = len(mesh.materials)
@@ -323,165 +327,11 @@ class LUXRENDER_OT_export_luxrender_proxy(bpy.types.Operator):
                         if vertex_color:
                             vertex_color_layer = vertex_color.data
 
-                        # Here we work out exactly which vert+normal combinations
-                        # we need to export. This is done first, and the export
-                        # combinations cached before writing to file because the
-                        # number of verts needed needs to be written in the header
-                        # and that number is not known before this is done.
-
-                        # Export data
-                        co_no_uv_vc_cache = []
-                        face_vert_indices = {}  # mapping of face index to list of exported vert indices for that face
-
-                        # Caches
-                        # mapping of vert index to exported vert index for verts with vert normals
-
-                        vert_vno_indices = {}
-                        vert_use_vno = set()  # Set of vert indices that use vert normals
-                        vert_index = 0  # exported vert index
-
-                        c1 = c2 = c3 = c4 = None
-
-                        for fidx, face in enumerate(ffaces_mats[i]):
-                            fvi = []
-                            if vertex_color_layer:
-                                c1 = vertex_color_layer[fidx].color1
-                                c2 = vertex_color_layer[fidx].color2
-                                c3 = vertex_color_layer[fidx].color3
-                                c4 = vertex_color_layer[fidx].color4
-
-                            for j, vertex in enumerate(face.vertices):
-                                v = mesh.vertices[vertex]
-
-                                if vertex_color_layer:
-                                    if j == 0:
-                                        vert_col = c1
-                                    elif j == 1:
-                                        vert_col = c2
-                                    elif j == 2:
-                                        vert_col = c3
-                                    elif j == 3:
-                                        vert_col = c4
-
-                                if face.use_smooth:
-                                    if uv_layer:
-                                        if vertex_color_layer:
-                                            vert_data = (v.co[:], v.normal[:], uv_layer[face.index].uv[j][:],
-                                                         (int(255 * vert_col[0]),
-                                                          int(255 * vert_col[1]),
-                                                          int(255 * vert_col[2]))[:])
-                                        else:
-                                            vert_data = (v.co[:], v.normal[:], uv_layer[face.index].uv[j][:])
-                                    else:
-                                        if vertex_color_layer:
-                                            vert_data = (v.co[:], v.normal[:],
-                                                         (int(255 * vert_col[0]),
-                                                          int(255 * vert_col[1]),
-                                                          int(255 * vert_col[2]))[:])
-                                        else:
-                                            vert_data = (v.co[:], v.normal[:])
-
-                                    if vert_data not in vert_use_vno:
-                                        vert_use_vno.add(vert_data)
-
-                                        co_no_uv_vc_cache.append(vert_data)
-
-                                        vert_vno_indices[vert_data] = vert_index
-                                        fvi.append(vert_index)
-
-                                        vert_index += 1
-                                    else:
-                                        fvi.append(vert_vno_indices[vert_data])
-                                else:
-                                    if uv_layer:
-                                        if vertex_color_layer:
-                                            vert_data = (v.co[:], face.normal[:], uv_layer[face.index].uv[j][:],
-                                                         (int(255 * vert_col[0]),
-                                                          int(255 * vert_col[1]),
-                                                          int(255 * vert_col[2]))[:])
-                                        else:
-                                            vert_data = (v.co[:], face.normal[:], uv_layer[face.index].uv[j][:])
-                                    else:
-                                        if vertex_color_layer:
-                                            vert_data = (v.co[:], face.normal[:],
-                                                         (int(255 * vert_col[0]),
-                                                          int(255 * vert_col[1]),
-                                                          int(255 * vert_col[2]))[:])
-                                        else:
-                                            vert_data = (v.co[:], face.normal[:])
-
-                                    # All face-vert-co-no are unique, we cannot
-                                    # cache them
-                                    co_no_uv_vc_cache.append(vert_data)
-                                    fvi.append(vert_index)
-                                    vert_index += 1
-
-                            face_vert_indices[face.index] = fvi
-
-                        del vert_vno_indices
-                        del vert_use_vno
-
-                        with open(ply_path, 'wb') as ply:
-                            ply.write(b'ply\n')
-                            ply.write(b'format binary_little_endian 1.0\n')
-                            ply.write(b'comment Created by LuxBlend 2.6 exporter for LuxRender - www.luxrender.net\n')
-
-                            # vert_index == the number of actual verts needed
-                            ply.write(('element vertex %d\n' % vert_index).encode())
-                            ply.write(b'property float x\n')
-                            ply.write(b'property float y\n')
-                            ply.write(b'property float z\n')
-
-                            ply.write(b'property float nx\n')
-                            ply.write(b'property float ny\n')
-                            ply.write(b'property float nz\n')
-
-                            if uv_layer:
-                                ply.write(b'property float s\n')
-                                ply.write(b'property float t\n')
-
-                            if vertex_color_layer:
-                                ply.write(b'property uchar red\n')
-                                ply.write(b'property uchar green\n')
-                                ply.write(b'property uchar blue\n')
-
-                            ply.write(('element face %d\n' % len(ffaces_mats[i])).encode())
-                            ply.write(b'property list uchar uint vertex_indices\n')
-
-                            ply.write(b'end_header\n')
-
-                            # dump cached co/no/uv/vc
-                            if uv_layer:
-                                if vertex_color_layer:
-                                    for co, no, uv, vc in co_no_uv_vc_cache:
-                                        ply.write(struct.pack('<3f', *co))
-                                        ply.write(struct.pack('<3f', *no))
-                                        ply.write(struct.pack('<2f', *uv))
-                                        ply.write(struct.pack('<3B', *vc))
-                                else:
-                                    for co, no, uv in co_no_uv_vc_cache:
-                                        ply.write(struct.pack('<3f', *co))
-                                        ply.write(struct.pack('<3f', *no))
-                                        ply.write(struct.pack('<2f', *uv))
-                            else:
-                                if vertex_color_layer:
-                                    for co, no, vc in co_no_uv_vc_cache:
-                                        ply.write(struct.pack('<3f', *co))
-                                        ply.write(struct.pack('<3f', *no))
-                                        ply.write(struct.pack('<3B', *vc))
-                                else:
-                                    for co, no in co_no_uv_vc_cache:
-                                        ply.write(struct.pack('<3f', *co))
-                                        ply.write(struct.pack('<3f', *no))
-
-                            # dump face vert indices
-                            for face in ffaces_mats[i]:
-                                lfvi = len(face_vert_indices[face.index])
-                                ply.write(struct.pack('<B', lfvi))
-                                ply.write(struct.pack('<%dI' % lfvi, *face_vert_indices[face.index]))
-
-                            del co_no_uv_vc_cache
-                            del face_vert_indices
+                        if NUMPY_AVAILABLE:
+                            mesh_arrays = TessfaceArrays(mesh, uv_layer, vertex_color_layer)
+                            MeshPart(mesh_arrays, ffaces_mats[i]).write_ply(ply_path)
+                        else:
+                            write_ply_per_face(mesh, ffaces_mats[i], uv_layer, vertex_color_layer, ply_path)
 
                         print('[Object: %s] Binary PLY file written: %s' % (obj.name, ply_path))
                         return mesh, ply_path
@@ -24,7 +24,7 @@
 #
 # ***** END GPL LICENCE BLOCK *****
 #
-import os
+import collections, gzip, hashlib, io, os, shutil, tempfile, threading
 
 import bpy
 
@@ -56,6 +56,261 @@ class RenderingServerInfo(object):
         self.name = name
 
 
+class AsyncFileWriter(object):
+    """
+    Background thread writing the data queued by AsyncFile objects, so
+    that the exporter does not have to wait for the disk. At most
+    max_pending_bytes of data are queued, put() blocks while the limit
+    is exceeded.
+    """
+
+    def __init__(self, max_pending_bytes=64 * 1024 * 1024):
+        self.max_pending_bytes = max_pending_bytes
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+        self.pending_bytes = 0
+        self.unfinished = 0
+        self.error = None
+
+        self.thread = threading.Thread(target=self.run, name='LuxRender scene file writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, target, data):
+        """
+        target				file object
+        data				string to write, or None to close target
+
+        Returns None
+        """
+
+        size = len(data) if data is not None else 0
+
+        with self.condition:
+            while self.pending_bytes > self.max_pending_bytes and self.error is None:
+                self.condition.wait()
+
+            if self.error is not None:
+                raise self.error
+
+            self.queue.append((target, data))
+            self.pending_bytes += size
+            self.unfinished += 1
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while len(self.queue) == 0:
+                    self.condition.wait()
+
+                target, data = self.queue.popleft()
+
+            if target is None:
+                return
+
+            try:
+                if self.error is not None:
+                    # Discard the rest of the data, but still close the files
+                    if data is None:
+                        target.close()
+                elif data is None:
+                    target.close()
+                else:
+                    target.write(data)
+            except Exception as err:
+                LuxLog('Error writing scene file %s: %s' % (target.name, err))
+                self.error = err
+
+            with self.condition:
+                if data is not None:
+                    self.pending_bytes -= len(data)
+                self.unfinished -= 1
+                self.condition.notify_all()
+
+    def barrier(self):
+        """
+        Wait until everything queued so far has been written
+
+        Returns None
+        """
+
+        with self.condition:
+            while self.unfinished > 0:
+                self.condition.wait()
+
+        if self.error is not None:
+            raise self.error
+
+    def shutdown(self):
+        with self.condition:
+            self.queue.append((None, None))
+            self.condition.notify_all()
+
+        self.thread.join()
+
+
+class AsyncFile(object):
+    """
+    File object that collects writes into chunks of CHUNK_SIZE characters
+    and hands them to an AsyncFileWriter
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, writer, target, name):
+        self.writer = writer
+        self.target = target
+        self.name = name
+        self.buffer = []
+        self.buffer_size = 0
+        self.closed = False
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.buffer_size += len(data)
+
+        if self.buffer_size >= self.CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.buffer_size > 0:
+            self.writer.put(self.target, ''.join(self.buffer))
+            self.buffer = []
+            self.buffer_size = 0
+
+    def close(self):
+        if not self.closed:
+            self.flush()
+            self.writer.put(self.target, None)
+            self.closed = True
+
+
+class SharedBlockFile(object):
+    """
+    Scene file whose blocks are moved to content addressed include files
+    in a directory shared by all frames of an animation. Every block is
+    hashed while it is written; a block that an earlier frame already
+    wrote is not written again, the frame file only includes it in place.
+
+    Blocks are either the whole file (materials, volumes) or the top level
+    ObjectBegin and AttributeBegin blocks of the geometry file (see
+    begin_block). Small blocks stay in the frame file.
+    """
+
+    MIN_BLOCK_SIZE = 64 * 1024
+
+    def __init__(self, target, shared_dir, extension, compress=False, whole_file=False):
+        self.target = target
+        self.name = target.name
+        self.shared_dir = shared_dir
+        self.extension = extension + ('.gz' if compress else '')
+        self.compress = compress
+        self.whole_file = whole_file
+
+        self.depth = 0
+        self.block = None
+        self.spool = None
+        self.spool_path = None
+        self.block_hash = None
+        self.block_size = 0
+
+        if whole_file:
+            self.begin_block()
+
+    def begin_block(self):
+        self.depth += 1
+
+        if self.depth == 1:
+            self.block = io.StringIO()
+            self.spool = None
+            self.block_hash = hashlib.sha1()
+            self.block_size = 0
+
+    def end_block(self):
+        if self.depth == 0:
+            return
+
+        self.depth -= 1
+
+        if self.depth == 0:
+            self.finish_block()
+
+    def write(self, data):
+        if self.block is None and self.spool is None:
+            self.target.write(data)
+            return
+
+        encoded = data.encode('utf-8')
+        self.block_hash.update(encoded)
+        self.block_size += len(encoded)
+
+        if self.spool is not None:
+            self.spool.write(encoded)
+            return
+
+        self.block.write(data)
+
+        # Keep big blocks out of memory
+        if self.block_size > self.MIN_BLOCK_SIZE:
+            fd, self.spool_path = tempfile.mkstemp(suffix='.tmp', dir=self.shared_dir)
+            self.spool = os.fdopen(fd, 'wb')
+            self.spool.write(self.block.getvalue().encode('utf-8'))
+            self.block = None
+
+    def finish_block(self):
+        block, spool = self.block, self.spool
+        self.block = self.spool = None
+
+        if spool is None and self.block_size < self.MIN_BLOCK_SIZE and not self.whole_file:
+            self.target.write(block.getvalue())
+            return
+
+        path = os.path.join(self.shared_dir, self.block_hash.hexdigest() + self.extension)
+
+        if spool is not None:
+            spool.close()
+            self.store(path, self.spool_path)
+        elif not os.path.exists(path):
+            fd, spool_path = tempfile.mkstemp(suffix='.tmp', dir=self.shared_dir)
+            with os.fdopen(fd, 'wb') as spool:
+                spool.write(block.getvalue().encode('utf-8'))
+            self.store(path, spool_path)
+
+        self.target.write('\nInclude "%s"\n' % efutil.path_relative_to_export(path))
+
+    def store(self, path, spool_path):
+        """
+        Move a spooled block to its shared path, unless an earlier frame
+        already wrote the same block
+        """
+
+        if os.path.exists(path):
+            os.remove(spool_path)
+            return
+
+        if self.compress:
+            compressed_path = spool_path + '.gz'
+
+            with open(spool_path, 'rb') as spool, gzip.open(compressed_path, 'wb',
+                                                           compresslevel=Custom_Context.GZIP_LEVEL) as f:
+                shutil.copyfileobj(spool, f, 16 * 1024 * 1024)
+
+            os.remove(spool_path)
+            spool_path = compressed_path
+
+        os.replace(spool_path, path)
+
+    def flush(self):
+        self.target.flush()
+
+    def close(self):
+        if self.block is not None or self.spool is not None:
+            self.finish_block()
+
+        self.target.close()
+
+
 class Custom_Context(object):
     """
     Imitate the real pylux Context object so that we can
@@ -70,6 +325,22 @@ class Custom_Context(object):
     current_file = Files.MAIN
     parse_at_worldend = True
 
+    # Scene files are written through large buffers and only flushed when closed
+    WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+
+    # Significant digits for large float arrays, 0 writes exact values
+    float_precision = 0
+
+    # Background writer thread, or None to write from the exporter thread
+    writer = None
+
+    # Compress the material, geometry and volume files
+    compress_files = False
+    GZIP_LEVEL = 1
+
+    # Directory for blocks shared by several frames (see SharedBlockFile), or None
+    shared_dir = None
+
     def __init__(self, name):
         self.context_name = name
         self.has_volumes_file = False
@@ -86,6 +357,34 @@ class Custom_Context(object):
         Returns None
         """
 
+        self.get_file(ind).write('%s%s\n' % ('\t' * tabs, st))
+
+    def wp(self, ind, params):
+        """
+        ind					int
+        params				ParamSet
+
+        Write the parameters to file index ind, one indented parameter
+        per line. Large arrays are streamed to the file in chunks.
+
+        Returns None
+        """
+
+        f = self.get_file(ind)
+
+        for p in params:
+            f.write('\t')
+            p.write(f, self.float_precision)
+            f.write('\n')
+
+    def get_file(self, ind):
+        """
+        ind					int
+
+        Returns the open file for index ind, or the main file if that
+        file is not open
+        """
+
         if len(self.files) == 0:
             scene = object()
             scene.name = 'untitled'
@@ -96,8 +395,20 @@ class Custom_Context(object):
         if self.files[ind] is None:
             ind = 0
 
-        self.files[ind].write('%s%s\n' % ('\t' * tabs, st))
-        self.files[ind].flush()
+        return self.files[ind]
+
+    @staticmethod
+    def format_floats(values):
+        """
+        values				list of float
+
+        Format floats with the shortest representation that parses back
+        to the same value
+
+        Returns string
+        """
+
+        return ' '.join(map(repr, map(float, values)))
 
     def set_filename(self, scene, name, LXV=True):
         """
@@ -110,35 +421,118 @@ class Custom_Context(object):
         """
 
         # If any files happen to be open, close them and start again
-        for f in self.files:
-            if f is not None:
-                f.close()
+        self.close_files()
 
         self.files = []
         self.file_names = []
 
+        if hasattr(scene, 'luxrender_engine'):
+            self.float_precision = scene.luxrender_engine.float_precision
+            self.compress_files = scene.luxrender_engine.compress_scene_files
+
+            if scene.luxrender_engine.async_write:
+                self.writer = AsyncFileWriter()
+
+            self.share_blocks = scene.luxrender_engine.share_frame_files
+        else:
+            self.share_blocks = False
+
         self.file_names.append('%s.lxs' % name)
-        self.files.append(open(self.file_names[Files.MAIN], 'w'))
+        self.files.append(self.open_file(self.file_names[Files.MAIN]))
         self.wf(Files.MAIN, '# Main Scene File')
 
-        subdir = '%s%s/%s/%05d' % (efutil.export_path, efutil.scene_filename(), bpy.path.clean_name(scene.name),
-                                   scene.frame_current)
+        self.subdir = '%s%s/%s/%05d' % (efutil.export_path, efutil.scene_filename(),
+                                        bpy.path.clean_name(scene.name), scene.frame_current)
+
+        if not os.path.exists(self.subdir):
+            os.makedirs(self.subdir)
+
+        self.shared_dir = None
 
-        if not os.path.exists(subdir):
-            os.makedirs(subdir)
+        if self.share_blocks:
+            self.shared_dir = os.path.join(os.path.dirname(self.subdir), 'shared')
 
-        self.file_names.append('%s/LuxRender-Materials.lxm' % subdir)
-        self.files.append(open(self.file_names[Files.MATS], 'w'))
+            if not os.path.exists(self.shared_dir):
+                os.makedirs(self.shared_dir)
+
+        suffix = '.gz' if self.compress_files else ''
+
+        self.file_names.append('%s/LuxRender-Materials.lxm%s' % (self.subdir, suffix))
+        self.files.append(self.open_file(self.file_names[Files.MATS], self.compress_files, '.lxm', True))
         self.wf(Files.MATS, '# Materials File')
 
-        self.file_names.append('%s/LuxRender-Geometry.lxo' % subdir)
-        self.files.append(open(self.file_names[Files.GEOM], 'w'))
+        self.file_names.append('%s/LuxRender-Geometry.lxo%s' % (self.subdir, suffix))
+        self.files.append(self.open_file(self.file_names[Files.GEOM], self.compress_files, '.lxo'))
         self.wf(Files.GEOM, '# Geometry File')
 
         self.files.append(None)
 
         self.set_output_file(Files.MAIN)
 
+    def open_file(self, file_name, compress=False, shared_extension=None, whole_file=False):
+        """
+        file_name			string
+        compress			bool
+        shared_extension	None, or the extension of shared blocks if this file shares blocks with other frames
+        whole_file			bool, share the file as one block
+
+        Open a scene file for writing, through the background writer if
+        there is one
+
+        Returns file object
+        """
+
+        if compress:
+            f = gzip.open(file_name, 'wt', compresslevel=self.GZIP_LEVEL)
+        else:
+            f = open(file_name, 'w', buffering=self.WRITE_BUFFER_SIZE)
+
+        if self.writer is not None:
+            f = AsyncFile(self.writer, f, file_name)
+
+        if self.shared_dir is not None and shared_extension is not None:
+            f = SharedBlockFile(f, self.shared_dir, shared_extension, compress, whole_file)
+
+        return f
+
+    def begin_block(self, file=None):
+        """
+        file				None or int
+
+        Start a block that may be shared with other frames, if the output
+        file supports that
+        """
+
+        f = self.get_file(self.current_file if file is None else file)
+
+        if isinstance(f, SharedBlockFile):
+            f.begin_block()
+
+    def end_block(self):
+        f = self.get_file(self.current_file)
+
+        if isinstance(f, SharedBlockFile):
+            f.end_block()
+
+    def close_files(self):
+        """
+        Close all open files and wait until the background writer, if
+        any, has written them completely
+
+        Returns None
+        """
+
+        for f in self.files:
+            if f is not None:
+                f.close()
+
+        if self.writer is not None:
+            try:
+                self.writer.barrier()
+            finally:
+                self.writer.shutdown()
+                self.writer = None
+
     def set_output_file(self, file):
         """
         file				int
@@ -170,16 +564,17 @@ class Custom_Context(object):
         # name is a string, and params a list
         name, params = args
         self.wf(self.current_file, '\n%s "%s"' % (identifier, name))
-        for p in params:
-            self.wf(self.current_file, p.to_string(), 1)
+        self.wp(self.current_file, params)
 
     # Wrapped pylux.Context API calls follow ...
 
     def objectBegin(self, name, file=None):
+        self.begin_block(file)
         self._api('ObjectBegin ', [name, []], file=file)
 
     def objectEnd(self, comment=''):
         self._api('ObjectEnd # ', [comment, []])
+        self.end_block()
 
     def objectInstance(self, name):
         self._api('ObjectInstance ', [name, []])
@@ -254,10 +649,12 @@ class Custom_Context(object):
         geometry to LXO.
         """
 
+        self.begin_block(file)
         self._api('AttributeBegin # ', [comment, []], file=file)
 
     def attributeEnd(self):
         self._api('AttributeEnd #', ['', []])
+        self.end_block()
 
     def transformBegin(self, comment='', file=None):
         """
@@ -273,22 +670,22 @@ class Custom_Context(object):
         self._api('TransformEnd #', ['', []])
 
     def motionBegin(self, time_values):
-        self.wf(self.current_file, '\nMotionBegin [%s]' % ' '.join(['%0.15f' % i for i in time_values]))
+        self.wf(self.current_file, '\nMotionBegin [%s]' % self.format_floats(time_values))
 
     def motionEnd(self):
         self.wf(self.current_file, '\nMotionEnd')
 
     def concatTransform(self, values):
-        self.wf(self.current_file, '\nConcatTransform [%s]' % ' '.join(['%0.15f' % i for i in values]))
+        self.wf(self.current_file, '\nConcatTransform [%s]' % self.format_floats(values))
 
     def transform(self, values):
-        self.wf(self.current_file, '\nTransform [%s]' % ' '.join(['%0.15f' % i for i in values]))
+        self.wf(self.current_file, '\nTransform [%s]' % self.format_floats(values))
 
     def scale(self, x, y, z):
-        self.wf(self.current_file, '\nScale %s' % ' '.join(['%0.15f' % i for i in [x, y, z]]))
+        self.wf(self.current_file, '\nScale %s' % self.format_floats([x, y, z]))
 
     def rotate(self, a, x, y, z):
-        self.wf(self.current_file, '\nRotate %s' % ' '.join(['%0.15f' % i for i in [a, x, y, z]]))
+        self.wf(self.current_file, '\nRotate %s' % self.format_floats([a, x, y, z]))
 
     def shape(self, *args):
         self._api('Shape', args, file=self.current_file)
@@ -304,15 +701,11 @@ class Custom_Context(object):
 
     def makeNamedMaterial(self, name, params):
         self.wf(Files.MATS, '\nMakeNamedMaterial "%s"' % name)
-
-        for p in params:
-            self.wf(Files.MATS, p.to_string(), 1)
+        self.wp(Files.MATS, params)
 
     def makeNamedVolume(self, name, type, params):
         self.wf(Files.MATS, '\nMakeNamedVolume "%s" "%s"' % (name, type))
-
-        for p in params:
-            self.wf(Files.MATS, p.to_string(), 1)
+        self.wp(Files.MATS, params)
 
     def interior(self, name):
         self._api('Interior ', [name, []])
@@ -322,21 +715,18 @@ class Custom_Context(object):
 
     def volume(self, type, params):
         if not self.has_volumes_file:
-            self.file_names.append('%s/LuxRender-Volumes.lxv' % subdir)
-            self.files.insert(-1, open(self.file_names[Files.VOLM], 'w'))
+            suffix = '.gz' if self.compress_files else ''
+            self.file_names.append('%s/LuxRender-Volumes.lxv%s' % (self.subdir, suffix))
+            self.files.insert(-1, self.open_file(self.file_names[Files.VOLM], self.compress_files, '.lxv', True))
             self.wf(Files.VOLM, '# Volume File')
             self.has_volumes_file = True
 
         self.wf(Files.VOLM, '\nVolume "%s"' % type)
-
-        for p in params:
-            self.wf(Files.VOLM, p.to_string(), 1)
+        self.wp(Files.VOLM, params)
 
     def texture(self, name, type, texture, params):
         self.wf(Files.MATS, '\nTexture "%s" "%s" "%s"' % (name, type, texture))
-
-        for p in params:
-            self.wf(Files.MATS, p.to_string(), 1)
+        self.wp(Files.MATS, params)
 
     def worldEnd(self):
         """
@@ -348,11 +738,12 @@ class Custom_Context(object):
             # End of the world as we know it
             self.wf(Files.MAIN, 'WorldEnd')
 
-        # Close files
+        # Close files, and wait for the background writer to finish them
+        self.close_files()
+
         LuxLog('Wrote scene files')
         for f in self.files:
             if f is not None:
-                f.close()
                 LuxLog(' %s' % f.name)
 
         # Reset the volume redundancy check
@@ -363,9 +754,7 @@ class Custom_Context(object):
 
     def exit(self):
         # If any files happen to be open, close them and start again
-        for f in self.files:
-            if f is not None:
-                f.close()
+        self.close_files()
 
     def wait(self):
         pass
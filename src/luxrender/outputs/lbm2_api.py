@@ -24,7 +24,7 @@
 #
 # ***** END GPL LICENCE BLOCK *****
 #
-import collections, json
+import array, collections, json
 
 from .. import LuxRenderAddon
 
@@ -126,7 +126,8 @@ class Custom_Context(object):
             obj['paramset'].append({
                 'type': p.type,
                 'name': p.name,
-                'value': p.value
+                # Large numeric values are held in typed arrays, which json cannot encode
+                'value': p.value.tolist() if isinstance(p.value, array.array) else p.value
             })
 
         self.lbm2_objects.append(obj)
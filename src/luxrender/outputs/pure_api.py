@@ -24,6 +24,8 @@
 #
 # ***** END GPL LICENCE BLOCK *****
 #
+import array
+
 from ..outputs import LuxLog
 from .. import import_bindings_module
 
@@ -49,6 +51,9 @@ if not 'PYLUX_AVAILABLE' in locals():
             PYLUX = pylux
             API_TYPE = 'PURE'
 
+            # Whether pylux takes array.array parameter values, None until tried
+            ARRAY_PARAMS = None
+
             def attributeBegin(self, comment='', file=None):
                 """
                 Added for compatibility with file_api
@@ -63,6 +68,30 @@ if not 'PYLUX_AVAILABLE' in locals():
 
                 pylux.Context.transformBegin(self)
 
+            def shape(self, type, params):
+                """
+                Mesh data may be held in array.array objects instead of lists,
+                pass them as buffers if this pylux build accepts that, else
+                convert them to lists
+                """
+
+                has_arrays = any(isinstance(p[1], array.array) for p in params)
+
+                if has_arrays and Custom_Context.ARRAY_PARAMS is not False:
+                    try:
+                        pylux.Context.shape(self, type, params)
+                        Custom_Context.ARRAY_PARAMS = True
+                        return
+                    except TypeError:
+                        # Boost.Python argument errors are TypeErrors
+                        Custom_Context.ARRAY_PARAMS = False
+                        LuxLog('pylux does not accept array parameters, converting mesh data to lists')
+
+                if has_arrays:
+                    params = [[p[0], p[1].tolist() if isinstance(p[1], array.array) else p[1]] for p in params]
+
+                pylux.Context.shape(self, type, params)
+
             def logVerbosity(self, verbosity):
                 """
                 verbose, default, quiet, very-quiet
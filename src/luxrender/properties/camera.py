@@ -841,11 +841,12 @@ class luxrender_film(declarative_property_group):
 
             local_crf_filepath = efutil.filesystem_path(local_crf_filepath)
             if scene.luxrender_engine.allow_file_embed():
-                from ..util import bencode_file2string
+                from ..util import bencode_file2lines_with_size
 
                 params.add_string('cameraresponse', os.path.basename(local_crf_filepath))
-                encoded_data = bencode_file2string(local_crf_filepath)
-                params.add_string('cameraresponse_data', encoded_data.splitlines())
+                encoded_lines = bencode_file2lines_with_size(local_crf_filepath,
+                                                             scene.luxrender_engine.embed_compression)[0]
+                params.add_string('cameraresponse_data', encoded_lines)
             else:
                 params.add_string('cameraresponse', local_crf_filepath)
 
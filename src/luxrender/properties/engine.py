@@ -135,9 +135,13 @@ class luxrender_engine(declarative_property_group):
         #       'binary_name',
         #       'write_files',
         ['export_particles', 'export_hair'],
-        'embed_filedata',
+        ['embed_filedata', 'embed_compression'],
         'mesh_type',
         'partial_ply',
+        ['ply_cache', 'ply_cache_size'],
+        ['float_precision', 'inline_mesh_limit'],
+        ['async_write', 'compress_scene_files'],
+        'share_frame_files',
         ['render', 'monitor_external'],
         'fixed_seed',
         # ['threads_auto', 'fixed_seed'],
@@ -149,12 +153,21 @@ class luxrender_engine(declarative_property_group):
     visibility = {
         'write_files': {'export_type': 'INT'},
         'embed_filedata': O([{'export_type': 'EXT'}, A([{'export_type': 'INT'}, {'write_files': True}])]),
+        'embed_compression': A([{'embed_filedata': True}, O([{'export_type': 'EXT'},
+                                                             A([{'export_type': 'INT'}, {'write_files': True}])])]),
         'mesh_type': O([{'export_type': 'EXT'}, A([{'export_type': 'INT'}, {'write_files': True}])]),
         'binary_name': {'export_type': 'EXT'},
         'render': O([{'write_files': True}, {'export_type': 'EXT'}]),
         # We need run renderer unless we are set for internal-pipe mode, which is the only time both of these are false
         'monitor_external': {'export_type': 'EXT', 'binary_name': 'luxrender', 'render': True},
         'partial_ply': O([{'export_type': 'EXT'}, A([{'export_type': 'INT'}, {'write_files': True}])]),
+        'ply_cache': O([{'export_type': 'EXT'}, A([{'export_type': 'INT'}, {'write_files': True}])]),
+        'ply_cache_size': O([{'export_type': 'EXT'}, A([{'export_type': 'INT'}, {'write_files': True}])]),
+        'float_precision': O([{'export_type': 'EXT'}, A([{'export_type': 'INT'}, {'write_files': True}])]),
+        'inline_mesh_limit': O([{'export_type': 'EXT'}, A([{'export_type': 'INT'}, {'write_files': True}])]),
+        'async_write': O([{'export_type': 'EXT'}, A([{'export_type': 'INT'}, {'write_files': True}])]),
+        'compress_scene_files': O([{'export_type': 'EXT'}, A([{'export_type': 'INT'}, {'write_files': True}])]),
+        'share_frame_files': O([{'export_type': 'EXT'}, A([{'export_type': 'INT'}, {'write_files': True}])]),
         'threads_auto': O([A([{'write_files': False}, {'export_type': 'INT'}]),
                            A([O([{'write_files': True}, {'export_type': 'EXT'}]), {'render': True}])]),
         # The flag options must be present for any condition where run renderer is present and checked,
@@ -248,6 +261,74 @@ class luxrender_engine(declarative_property_group):
             'default': True,
             'save_in_preset': True
         },
+        {
+            'type': 'bool',
+            'attr': 'ply_cache',
+            'name': 'Share Identical PLY Files',
+            'description': 'Keep a cache of exported PLY files in the export directory and reuse them for meshes \
+            with identical data, also across frames and Blender sessions',
+            'default': True,
+            'save_in_preset': True
+        },
+        {
+            'type': 'int',
+            'attr': 'ply_cache_size',
+            'name': 'Cache Size (MB)',
+            'description': 'Maximum size of the PLY cache, least recently used files are removed first',
+            'default': 4096,
+            'min': 1,
+            'soft_min': 64,
+            'soft_max': 65536,
+            'save_in_preset': True
+        },
+        {
+            'type': 'int',
+            'attr': 'float_precision',
+            'name': 'Mesh Float Digits',
+            'description': 'Significant digits for large float arrays, e.g. inline mesh vertices, written to the \
+            scene files. 0 writes every value exactly',
+            'default': 0,
+            'min': 0,
+            'max': 17,
+            'save_in_preset': True
+        },
+        {
+            'type': 'int',
+            'attr': 'inline_mesh_limit',
+            'name': 'Inline Mesh Limit',
+            'description': 'Native meshes with more point coordinates or triangle indices than this are written \
+            to binary PLY files next to the geometry file. 0 writes all meshes inline',
+            'default': 300000,
+            'min': 0,
+            'soft_max': 10000000,
+            'save_in_preset': True
+        },
+        {
+            'type': 'bool',
+            'attr': 'async_write',
+            'name': 'Background File Writing',
+            'description': 'Write the scene files from a background thread, so the export does not wait for slow \
+            storage',
+            'default': False,
+            'save_in_preset': True
+        },
+        {
+            'type': 'bool',
+            'attr': 'compress_scene_files',
+            'name': 'Compress Scene Files',
+            'description': 'Write the material, geometry and volume files gzip compressed',
+            'default': False,
+            'save_in_preset': True
+        },
+        {
+            'type': 'bool',
+            'attr': 'share_frame_files',
+            'name': 'Share Unchanged Blocks Between Frames',
+            'description': 'Write materials, volumes and geometry blocks that are identical in several frames of \
+            an animation only once, to include files shared by all frames',
+            'default': False,
+            'save_in_preset': True
+        },
         {
             'type': 'enum',
             'attr': 'binary_name',
@@ -290,6 +371,17 @@ class luxrender_engine(declarative_property_group):
             'default': False,
             'save_in_preset': True
         },
+        {
+            'type': 'int',
+            'attr': 'embed_compression',
+            'name': 'Compression',
+            'description': 'zlib compression level of embedded files, lower levels are faster but give larger \
+            scene files',
+            'default': 9,
+            'min': 0,
+            'max': 9,
+            'save_in_preset': True
+        },
         {
             'type': 'bool',
             'attr': 'is_saving_lbm2',
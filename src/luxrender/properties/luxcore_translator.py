@@ -41,6 +41,8 @@ class luxcore_translatorsettings(declarative_property_group):
 
     controls = [
         ['export_particles', 'export_hair', 'export_proxies'],
+        'persistent_animation',
+        ['stream_properties', 'stream_chunk_size'],
         'override_materials',
         ['override_glass', 'override_lights', 'override_null'],
         ['label_debug', 'print_cfg', 'print_scn'],
@@ -51,6 +53,7 @@ class luxcore_translatorsettings(declarative_property_group):
         'override_glass': {'override_materials': True},
         'override_lights': {'override_materials': True},
         'override_null': {'override_materials': True},
+        'stream_chunk_size': {'stream_properties': True},
     }
 
     alert = {}
@@ -80,6 +83,35 @@ class luxcore_translatorsettings(declarative_property_group):
             'default': True,
             'save_in_preset': True
         },
+        {
+            'type': 'bool',
+            'attr': 'persistent_animation',
+            'name': 'Keep Scene Between Frames',
+            'description': 'When rendering animations, keep the exported scene and the rendersession between frames '
+                           'and only update what changed, instead of exporting every frame from scratch',
+            'default': False,
+            'save_in_preset': True
+        },
+        {
+            'type': 'bool',
+            'attr': 'stream_properties',
+            'name': 'Stream Scene Properties',
+            'description': 'Parse the scene properties into the LuxCore scene in chunks during the export of final '
+                           'renders instead of collecting them all first, to reduce the memory usage of huge scenes '
+                           '(disabled when printing the SCN)',
+            'default': True,
+            'save_in_preset': True
+        },
+        {
+            'type': 'int',
+            'attr': 'stream_chunk_size',
+            'name': 'Chunk Size',
+            'description': 'Number of properties that are collected before they are parsed into the scene',
+            'default': 100000,
+            'min': 1000,
+            'max': 10000000,
+            'save_in_preset': True
+        },
         {
             'type': 'bool',
             'attr': 'override_materials',
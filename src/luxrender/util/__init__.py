@@ -38,15 +38,24 @@ def dict_merge(*args):
     return vis
 
 
-import base64, io, os, time, zlib
+import base64, collections, io, os, threading, time, zlib
 
 
 class bEncoder(object):
     """
     Encode binary files to text using base64(zlib.compress(file))
+
+    The file is read, compressed and encoded in chunks of CHUNK_SIZE
+    bytes, so only the encoded text is ever held in memory.
     """
 
-    def __init__(self):
+    CHUNK_SIZE = 4 * 1024 * 1024
+
+    # base64.encodebytes() writes one line for every 57 input bytes
+    LINE_INPUT_SIZE = 57
+
+    def __init__(self, level=9):
+        self.level = level
         self.last_encode_size = 0
 
     def Encode_File2File(self, fSrc_name, fDes_name):
@@ -62,6 +71,13 @@ class bEncoder(object):
 
                 return fDes.getvalue()
 
+    def Encode_File2Bytes(self, fSrc_name):
+        """
+        Returns the encoded file as one bytes object (base64 is ASCII)
+        """
+
+        return self.Encode_File2String(fSrc_name).encode('ascii')
+
     def _Encode(self, fSrc, fDes):
         """
         Assumes that fSrc and fDes are already-opened file-like objects
@@ -76,33 +92,105 @@ class bEncoder(object):
 
         # Compress with a specific set of parameters
         comp_obj = zlib.compressobj(
-            9,  # compression level
+            self.level,  # compression level
         )
 
-        deflated = comp_obj.compress(
-            fSrc.read()
-        )
-        deflated += comp_obj.flush()
+        deflated_size = 0
+        encoded_size = 0
+        pending = b''
 
-        fDes.write(
-            base64.encodebytes(
-                deflated
-            ).decode()
-        )
+        while True:
+            chunk = fSrc.read(self.CHUNK_SIZE)
 
-        self.last_encode_size = fDes.tell()
-        elapsed = time.time() - start_time
+            if chunk:
+                deflated = comp_obj.compress(chunk)
+            else:
+                deflated = comp_obj.flush()
+
+            deflated_size += len(deflated)
+            pending += deflated
+
+            # Encode whole lines only, so the result is the same as encoding everything at once
+            if chunk:
+                usable = len(pending) - len(pending) % self.LINE_INPUT_SIZE
+            else:
+                usable = len(pending)
+
+            if usable > 0:
+                encoded = base64.encodebytes(pending[:usable]).decode()
+                fDes.write(encoded)
+                encoded_size += len(encoded)
+                pending = pending[usable:]
+
+            if not chunk:
+                break
+
+        self.last_encode_size = encoded_size
+        elapsed = max(time.time() - start_time, 0.001)
         print('bEncode %s : %d bytes -> %d bytes -> %d bytes: %0.2f%% : %0.2f sec : %0.2f kb/sec' % (
             input_filename,
             filelen,
-            len(deflated),
+            deflated_size,
             self.last_encode_size,
-            100 * self.last_encode_size / filelen,
+            100 * self.last_encode_size / max(filelen, 1),
             elapsed,
             filelen / elapsed / 1024)
         )
 
 
+class EncodedFileCache(object):
+    """
+    Encoded file data, keyed by path, size, modification time and
+    compression level, so files that did not change are only encoded
+    once per loaded .blend file (the export package clears the cache on
+    load_pre). Every entry is one bytes object, the least recently used
+    entries are dropped when the cache holds more than MAX_SIZE bytes.
+    """
+
+    MAX_SIZE = 128 * 1024 * 1024
+
+    entries = collections.OrderedDict()
+    total_size = 0
+    lock = threading.Lock()
+
+    @staticmethod
+    def key(file_name, level):
+        file_name = os.path.abspath(file_name)
+        stat = os.stat(file_name)
+        return file_name, stat.st_size, stat.st_mtime_ns, level
+
+    @classmethod
+    def encode(cls, file_name, level=9):
+        """
+        Returns bytes, the encoded file
+        """
+
+        key = cls.key(file_name, level)
+
+        with cls.lock:
+            if key in cls.entries:
+                cls.entries.move_to_end(key)
+                return cls.entries[key]
+
+        encoded = bEncoder(level).Encode_File2Bytes(file_name)
+
+        with cls.lock:
+            if key not in cls.entries:
+                cls.entries[key] = encoded
+                cls.total_size += len(encoded)
+
+            while cls.total_size > cls.MAX_SIZE and len(cls.entries) > 1:
+                cls.total_size -= len(cls.entries.popitem(last=False)[1])
+
+        return encoded
+
+    @classmethod
+    def clear(cls):
+        with cls.lock:
+            cls.entries.clear()
+            cls.total_size = 0
+
+
 class bDecoder(object):
     """
     Decode binary files from text using base64(zlib.compress(file))
@@ -178,6 +266,18 @@ def bencode_file2string_with_size(in_filename):
     return en, sz
 
 
+def bencode_file2lines_with_size(in_filename, level=9):
+    """
+    Encode a file, or take the result of an earlier call for the same,
+    unchanged file from the cache
+
+    Returns tuple of the list of encoded lines and the encoded size
+    """
+
+    encoded = EncodedFileCache.encode(in_filename, level)
+    return encoded.decode('ascii').splitlines(), len(encoded)
+
+
 def bdecode_file2file(in_filename, out_filename):
     be = bDecoder()
     be.Decode_File2File(in_filename, out_filename)
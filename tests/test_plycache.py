@@ -0,0 +1,197 @@
+# -*- coding: utf8 -*-
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# --------------------------------------------------------------------------
+# Blender 2.5 LuxRender Add-On
+# --------------------------------------------------------------------------
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ***** END GPL LICENCE BLOCK *****
+#
+"""
+PLY cache tests. The PLY cache and the PLY encoding do not depend on
+Blender, their modules are loaded from the source files so that importing
+the add-on package (which needs bpy) is not necessary:
+
+    python -m pytest tests
+"""
+import importlib.util, os, tempfile, unittest
+
+EXPORT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'luxrender', 'export')
+
+
+def load_export_module(name):
+    spec = importlib.util.spec_from_file_location('luxrender_export_' + name, os.path.join(EXPORT_DIR, name + '.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+meshdata = load_export_module('meshdata')
+plycache = load_export_module('plycache')
+
+
+def write(path, content):
+    with meshdata.replace_file(path) as f:
+        f.write(content)
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+class PLYCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.log_messages = []
+        self.cache = self.open_cache()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def open_cache(self):
+        cache = plycache.PLYCache(os.path.join(self.temp_dir.name, 'cache'), self.log_messages.append)
+        cache.max_size = 1024 * 1024
+        return cache
+
+    def path(self, file_name):
+        return os.path.join(self.temp_dir.name, file_name)
+
+    def store(self, key, content):
+        write(self.path(key + '.ply'), content)
+        self.cache.store(key, self.path(key + '.ply'))
+
+    def test_fetch(self):
+        self.assertFalse(self.cache.fetch('mesh', self.path('frame1.ply')))
+
+        self.store('mesh', b'mesh')
+
+        self.assertTrue(self.cache.fetch('mesh', self.path('frame1.ply')))
+        self.assertEqual(read(self.path('frame1.ply')), b'mesh')
+
+    def test_fetch_replaces_existing_file(self):
+        self.store('mesh', b'mesh')
+        write(self.path('frame1.ply'), b'old mesh')
+
+        self.assertTrue(self.cache.fetch('mesh', self.path('frame1.ply')))
+        self.assertEqual(read(self.path('frame1.ply')), b'mesh')
+
+    def test_evict_least_recently_used(self):
+        self.cache.max_size = 8
+
+        self.store('a', b'aaaa')
+        self.store('b', b'bbbb')
+        self.assertTrue(self.cache.fetch('a', self.path('frame1.ply')))
+        self.store('c', b'cccc')
+
+        self.assertEqual(list(self.cache.entries), ['a', 'c'])
+        self.assertFalse(os.path.exists(self.cache.file_path('b')))
+        # Files that were handed out are kept
+        self.assertEqual(read(self.path('b.ply')), b'bbbb')
+
+    def test_evict_keeps_newest_entry(self):
+        self.cache.max_size = 2
+
+        self.store('a', b'aaaa')
+
+        self.assertEqual(list(self.cache.entries), ['a'])
+        self.assertTrue(os.path.exists(self.cache.file_path('a')))
+
+    def test_index(self):
+        self.store('a', b'aaaa')
+        self.store('b', b'bb')
+        self.assertTrue(self.cache.fetch('a', self.path('frame1.ply')))
+        self.cache.save()
+
+        self.assertEqual(list(self.open_cache().entries.items()), [('b', 2), ('a', 4)])
+
+    def test_index_skips_missing_files(self):
+        self.store('a', b'aaaa')
+        self.store('b', b'bb')
+        self.cache.save()
+        os.remove(self.cache.file_path('a'))
+
+        self.assertEqual(list(self.open_cache().entries), ['b'])
+
+    def test_fetch_missing_file(self):
+        self.store('mesh', b'mesh')
+        os.remove(self.cache.file_path('mesh'))
+
+        self.assertFalse(self.cache.fetch('mesh', self.path('frame1.ply')))
+        self.assertNotIn('mesh', self.cache.entries)
+        self.assertEqual(len(self.log_messages), 1)
+
+    def test_rewrite_fetched_file_keeps_cache_entry(self):
+        self.store('old', b'old mesh')
+        self.assertTrue(self.cache.fetch('old', self.path('frame2.ply')))
+
+        # Same file name, new mesh data (cache miss for the new key)
+        write(self.path('frame2.ply'), b'new mesh')
+
+        self.assertEqual(read(self.path('frame2.ply')), b'new mesh')
+        self.assertEqual(read(self.cache.file_path('old')), b'old mesh')
+        self.assertEqual(read(self.path('old.ply')), b'old mesh')
+
+
+class TriangleMeshPLYTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.ply_writer = meshdata.PLYFileWriter(log=lambda message: None)
+
+    def tearDown(self):
+        self.ply_writer.shutdown()
+        self.temp_dir.cleanup()
+
+    def test_sidecar_without_uvs(self):
+        # MeshPart.native_arrays() returns None for the uvs of meshes without UV layer
+        points = [0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0, 0.0]
+        normals = [0.0, 0.0, 1.0] * 3
+        indices = [0, 1, 2]
+        path = os.path.join(self.temp_dir.name, 'mesh.ply')
+
+        self.ply_writer.submit(path, meshdata.triangle_mesh_ply_blocks(points, normals, None, indices))
+        self.assertEqual(self.ply_writer.wait(), [])
+
+        content = read(path)
+        header_size = content.index(b'end_header\n') + len(b'end_header\n')
+
+        self.assertEqual(content[:header_size], meshdata.ply_header(3, 1))
+        self.assertEqual(len(content) - header_size, 3 * 6 * 4 + 1 + 3 * 4)
+
+
+class ReplaceFileTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_failed_write_keeps_old_file(self):
+        path = os.path.join(self.temp_dir.name, 'mesh.ply')
+        write(path, b'old mesh')
+
+        with self.assertRaises(RuntimeError):
+            with meshdata.replace_file(path) as f:
+                f.write(b'partial')
+                raise RuntimeError()
+
+        self.assertEqual(read(path), b'old mesh')
+        self.assertEqual(os.listdir(self.temp_dir.name), ['mesh.ply'])
+
+
+if __name__ == '__main__':
+    unittest.main()